@@ -1,16 +1,20 @@
-from typing import List, Dict, Any, TypedDict, Union, Optional
+from typing import List, Dict, Any, TypedDict, Union, Optional, Set, Tuple, AsyncIterator
 from typing_extensions import Annotated
 import operator
 import uuid
+import asyncio
+import random
+import time
+from collections import Counter
+from functools import lru_cache
 from datetime import datetime, date, timedelta
 
-from telethon import TelegramClient
-
 # Импорт компонентов langgraph
 from langgraph.graph import StateGraph, END, START
-from langchain_gigachat import GigaChat
-from langchain.prompts import PromptTemplate, ChatPromptTemplate
+from langgraph.config import get_stream_writer
+from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
 from langsmith.run_helpers import traceable
 from dotenv import load_dotenv
 
@@ -20,27 +24,65 @@ import logging
 # Импорт схем данных
 from models.schemas import (
     News,
+    NewsSource,
     SimpleAnalyzerOutput,
-    AnalyzerOutput,
-    ClassifierOutput,
+    AnalyzerClassifierOutput,
+    BatchAnalyzerOutput,
+    BatchCategoryOutput,
+    BatchAnalyzerClassifierOutput,
     CategoryOutput,
     CategorySummary,
-    ReportCategory,
     Report
 )
+from models.records import NewsAnalysis, news_key, index_news, materialize_categories
 
 # Импорт конфигов
 from config.settings import (
     GIGACHAT,
-    TELEGRAM,
     DEFAULT_LIMIT_PER_CHANNEL,
+    COLLECTOR_CONCURRENCY,
+    LLM_CACHE,
+    PIPELINE,
+    DEDUP,
+    SUMMARIZER,
+    STORY_CLUSTERING,
+    PREFILTER,
+    LOCAL_CLASSIFIER,
+    TELEGRAM_FETCH,
+    DIGEST_CACHE,
+    CHECKPOINTS,
 )
 
+# Общий клиент Telethon и локальное хранилище сообщений
+from utils.telegram_client import get_client
+from utils.message_store import get_message_store
+
+# Кэш результатов LLM по содержимому новостей
+from utils.llm_cache import get_llm_cache, make_cache_key
+from utils.helpers import pack_batches, truncate_to_tokens, format_report_for_telegram
+from utils.dedup import cluster_near_duplicates, NearDuplicateIndex
+from utils.story_clustering import cluster_stories
+from utils.prefilter import prefilter_news, rules_for
+from utils.local_classifier import LocalClassifier, get_local_classifier
+from utils.metrics import metrics, instrument_node, current_node
+from utils.llm_scheduler import get_llm_scheduler
+from utils.fetch_scheduler import get_fetch_scheduler
+from utils.digest_cache import get_digest_cache, make_digest_key, CachedDigest
+from utils.checkpoints import get_checkpoints
+
+# Объединение одновременных одинаковых запросов разных пользователей
+from utils.singleflight import SingleFlight
+
 # Импорт необходимых промптов
 from prompts.agents_prompts import (
     ANALYZER_PROMPT,
     CLASSIFIER_PROMPT,
+    ANALYZER_CLASSIFIER_PROMPT,
+    BATCH_ANALYZER_PROMPT,
+    BATCH_CLASSIFIER_PROMPT,
+    BATCH_ANALYZER_CLASSIFIER_PROMPT,
     SUMMARIZER_PROMPT,
+    SUMMARIZER_REDUCE_PROMPT,
     REPORTER_PROMPT,
     ERROR_PROMPT
 )
@@ -50,52 +92,459 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-API_ID = int(TELEGRAM["API_ID"])
-API_HASH = TELEGRAM["API_HASH"]
-SESSION_NAME = "newsbot_session"
 
 LIMIT_PER_CHANNEL = int(DEFAULT_LIMIT_PER_CHANNEL)
 
-# Инициализация модели GigaChat с обработкой ошибок и повторными попытками
-gigachat = GigaChat(
-    credentials=GIGACHAT['API_KEY'],
-    verify_ssl_certs=GIGACHAT['VERIFY_SSL'],
-    model=GIGACHAT['MODEL'],
-    scope=GIGACHAT['SCOPE'],
-    profanity_check=False,
-)
+# Ответы, когда в каналах нет сообщений для сводки
+NO_NEWS_TEXT = "📭 В ваших каналах пока нет новостей для сводки."
+NO_NEWS_SINCE_LAST_DIGEST_TEXT = "📭 С прошлой сводки новых сообщений нет."
+
+
+@lru_cache(maxsize=None)
+def get_gigachat():
+    """Модель GigaChat, создается при первом обращении"""
+    from langchain_gigachat import GigaChat
+
+    return GigaChat(
+        credentials=GIGACHAT['API_KEY'],
+        verify_ssl_certs=GIGACHAT['VERIFY_SSL'],
+        model=GIGACHAT['MODEL'],
+        scope=GIGACHAT['SCOPE'],
+        profanity_check=False,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_structured_chain(template: str, schema):
+    """Цепочка промпт -> GigaChat со структурированным выводом, собирается один раз на процесс"""
+    return ChatPromptTemplate.from_template(template) | get_gigachat().with_structured_output(schema)
+
+
+@lru_cache(maxsize=None)
+def get_text_chain(template: str):
+    """Цепочка промпт -> GigaChat -> строка, собирается один раз на процесс"""
+    return ChatPromptTemplate.from_template(template) | get_gigachat() | StrOutputParser()
+
+
+def emit_progress(event: Dict[str, Any]) -> None:
+    """Промежуточное событие для потокового запуска графа (stream_mode="custom").
+    Вне запуска графа, например в фоновом обновлении каналов, событие просто отбрасывается."""
+    try:
+        get_stream_writer()(event)
+    except RuntimeError:
+        pass
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Учет токенов ответа GigaChat в метриках узла, из которого сделан вызов"""
+
+    def __init__(self, node: str):
+        self.node = node
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+
+        # Некоторые версии интеграции отдают расход токенов только в llm_output
+        if not prompt_tokens and not completion_tokens:
+            usage = (response.llm_output or {}).get("token_usage")
+            if isinstance(usage, dict):
+                prompt_tokens = usage.get("prompt_tokens", 0)
+                completion_tokens = usage.get("completion_tokens", 0)
+            elif usage is not None:
+                prompt_tokens = getattr(usage, "prompt_tokens", 0)
+                completion_tokens = getattr(usage, "completion_tokens", 0)
+
+        metrics.inc("prompt_tokens", prompt_tokens, node=self.node)
+        metrics.inc("completion_tokens", completion_tokens, node=self.node)
+
+
+async def ainvoke_llm(chain, inputs: Dict[str, Any]):
+    """Асинхронный вызов цепочки через общий планировщик запросов к GigaChat:
+    приоритеты, ограничение темпа и числа одновременных запросов, повторы при 429 и сбоях"""
+    node = current_node.get()
+
+    async def call():
+        metrics.inc("llm_calls", node=node)
+        try:
+            return await chain.ainvoke(inputs, config={"callbacks": [TokenUsageCallback(node)]})
+        except Exception:
+            metrics.inc("llm_errors", node=node)
+            raise
+
+    return await get_llm_scheduler().run(call)
+
+
+# Выполняющиеся загрузки каналов и поэлементные вызовы модели, к которым могут присоединиться другие запросы
+channel_flights = SingleFlight()
+item_flights = SingleFlight()
+
+# Когда и с каким limit канал последний раз запрашивался из Telegram и удалась ли загрузка
+channel_fetched_at: Dict[str, Tuple[float, int, bool]] = {}
+
+# Фоновое переобучение локального классификатора категорий
+local_training: Optional[asyncio.Task] = None
 
 
 # Определение структуры состояния графа
 class GraphState(TypedDict):
     channels: Annotated[List[str], operator.add]
     limit_per_channel: int
-    collected_news: List[News]
-    analyzed_news: List[AnalyzerOutput]
-    categorized_news: Dict[str, List[ClassifierOutput]]
+    min_ids: Dict[str, int]
+    # Новости запуска по ключу "канал/id"; остальные поля ссылаются на них по ключу
+    news: Dict[str, News]
+    collected_news: List[str]
+    prefilter_dropped: Dict[str, int]
+    dedup_removed: int
+    analyzed_news: Dict[str, NewsAnalysis]
+    categorized_news: Dict[str, List[str]]
+    # Сюжеты по категориям: списки ключей новостей, первый ключ - представитель сюжета
+    stories: Dict[str, List[List[str]]]
     summaries: List[CategorySummary]
     report: Report
     errors: List[str]
 
 
-async def get_real_news(channel: str, limit: int) -> List[News]:
-    """Получение новостей из Telegram канала с фильтрацией по дате"""
-    async with TelegramClient(SESSION_NAME, API_ID, API_HASH) as client:
-        messages = []
-
-        async for msg in client.iter_messages(channel, limit=limit):
-            if msg.text:
-                news = News(
-                    id=str(msg.id),
-                    channel=channel,
-                    text=msg.text,
-                    date=str(msg.date),
-                    media_urls=[],
-                    views=msg.views if hasattr(msg, "views") else None
-                )
-                messages.append(news)
+async def fetch_new_messages(channel: str, limit: int) -> None:
+    """Загрузка в хранилище сообщений канала новее watermark-а.
+    Если в хранилище меньше limit сообщений канала (канал новый или limit вырос),
+    последние limit сообщений запрашиваются целиком, без min_id."""
+    store = get_message_store()
+    watermark = await asyncio.to_thread(store.get_watermark, channel)
+    count = await asyncio.to_thread(store.count_messages, channel)
+    min_id = watermark if count >= limit else 0
+
+    client = await get_client()
+    scheduler = get_fetch_scheduler()
+    entity = await scheduler.resolve(client, channel)
+
+    async def fetch():
+        return [msg async for msg in client.iter_messages(entity, limit=limit, min_id=min_id)]
+
+    messages = []
+    max_id = watermark
+
+    for msg in await scheduler.call(fetch):
+        max_id = max(max_id, msg.id)
+        if msg.text:
+            news = News(
+                id=str(msg.id),
+                channel=channel,
+                text=msg.text,
+                date=str(msg.date),
+                media_urls=[],
+                views=msg.views if hasattr(msg, "views") else None,
+                forwarded=getattr(msg, "fwd_from", None) is not None,
+                pinned=bool(getattr(msg, "pinned", False))
+            )
+            messages.append(news)
+
+    await asyncio.to_thread(store.save_messages, channel, messages, max_id)
+
+
+def channel_is_fresh(channel: str, limit: int) -> bool:
+    """Канал только что запрашивался с тем же или большим limit"""
+    fetched = channel_fetched_at.get(channel)
+    return fetched is not None and fetched[1] >= limit and time.monotonic() - fetched[0] < TELEGRAM_FETCH["FRESHNESS_SECONDS"]
+
+
+async def refresh_channel(channel: str, limit: int) -> bool:
+    """Загрузка новых сообщений канала, если он не запрашивался только что с тем же или большим limit.
+    Возвращает False, если канал не удалось обновить, в том числе при недавней неудачной попытке."""
+    if channel_is_fresh(channel, limit):
+        ok = channel_fetched_at[channel][2]
+    else:
+        # Одновременные запросы одного канала ждут одну общую загрузку
+        try:
+            await channel_flights.do((channel, limit), lambda: fetch_new_messages(channel, limit))
+            ok = True
+        except Exception as e:
+            # Недоступный канал или долгий FloodWait не должны срывать дайджест по остальным каналам
+            logger.warning(f"Could not fetch {channel}, using stored messages: {e}")
+            metrics.inc("fetch_errors")
+            ok = False
+        # Неудачная попытка тоже запоминается, чтобы сборщик не запрашивал канал повторно сразу после нее
+        channel_fetched_at[channel] = (time.monotonic(), limit, ok)
+
+    if not ok:
+        emit_progress({"type": "channel_error", "channel": channel})
+    return ok
+
+
+async def refresh_channels(channels: List[str], limit: int) -> AsyncIterator[Dict[str, Any]]:
+    """Загрузка каналов до запуска графа. Выдает те же события прогресса, что и сборщик в графе:
+    вне графа emit_progress их отбрасывает."""
+    semaphore = asyncio.Semaphore(COLLECTOR_CONCURRENCY)
+
+    async def refresh(channel: str) -> Tuple[str, bool]:
+        async with semaphore:
+            return channel, await refresh_channel(channel, limit)
+
+    yield {"type": "items", "stage": "collector", "total": len(channels), "done": 0}
+    for finished in asyncio.as_completed([refresh(channel) for channel in channels]):
+        channel, ok = await finished
+        if not ok:
+            yield {"type": "channel_error", "channel": channel}
+        yield {"type": "items", "stage": "collector", "total": 0, "done": 1}
+
+
+async def current_digest_key(channels: List[str], limit: int, min_ids: Dict[str, int]) -> str:
+    """Ключ кэша дайджеста по последним сохраненным id сообщений каналов"""
+    store = get_message_store()
+
+    def read_watermarks() -> Dict[str, int]:
+        return {channel: store.get_watermark(channel) for channel in channels}
+
+    latest_ids = await asyncio.to_thread(read_watermarks)
+    return make_digest_key(channels, latest_ids, limit, min_ids)
+
+
+async def get_real_news(channel: str, limit: int, min_id: int = 0) -> List[News]:
+    """Получение новостей канала: из Telegram запрашиваются только сообщения новее watermark-а.
+    Если канал не удалось обновить, отдаются ранее сохраненные сообщения."""
+    await refresh_channel(channel, limit)
+
+    # Остальное отдаем из хранилища
+    return await asyncio.to_thread(get_message_store().get_messages, channel, limit, min_id)
+
+
+# Поэлементные стадии: промпт и схема для одиночного вызова и для пакетного вызова
+ITEM_STAGES = {
+    "analyzer": (ANALYZER_PROMPT, SimpleAnalyzerOutput, BATCH_ANALYZER_PROMPT, BatchAnalyzerOutput),
+    "classifier": (CLASSIFIER_PROMPT, CategoryOutput, BATCH_CLASSIFIER_PROMPT, BatchCategoryOutput),
+    "analyzer_classifier": (
+        ANALYZER_CLASSIFIER_PROMPT,
+        AnalyzerClassifierOutput,
+        BATCH_ANALYZER_CLASSIFIER_PROMPT,
+        BatchAnalyzerClassifierOutput,
+    ),
+}
+
+
+async def invoke_batch(stage: str, texts: List[str]) -> Dict[int, Any]:
+    """Пакетный вызов модели по нескольким новостям.
+    Возвращает результаты по номерам новостей в пакете; неразобранные элементы отсутствуют."""
+    _, schema, batch_template, batch_schema = ITEM_STAGES[stage]
+    chain = get_structured_chain(batch_template, batch_schema)
+
+    items = "\n\n".join(f"[{position}] {text}" for position, text in enumerate(texts))
+    output = await ainvoke_llm(chain, {"items": items})
+
+    results = {}
+    for item in output.items:
+        if 0 <= item.item_id < len(texts) and item.item_id not in results:
+            results[item.item_id] = schema(**item.model_dump(exclude={"item_id"}))
+    return results
+
+
+async def run_item_stage(stage: str, texts: List[str], progress_stage: Optional[str] = None) -> List[Optional[Any]]:
+    """Выполнение поэлементной стадии по текстам новостей: кэш, затем пакеты, затем одиночные вызовы.
+    Прогресс показывается под именем progress_stage, если оно задано.
+    Для новостей, которые не удалось обработать, возвращается None."""
+    if not texts:
+        return []
+    template, schema, _, _ = ITEM_STAGES[stage]
+    progress_stage = progress_stage or stage
+    results: List[Optional[Any]] = [None] * len(texts)
+
+    cache = get_llm_cache() if LLM_CACHE["ENABLED"] else None
+    cache_keys = [make_cache_key(text, template, GIGACHAT["MODEL"]) for text in texts]
+    # Категории, полученные от модели, становятся обучающими примерами локального классификатора
+    learned: List[Tuple[str, str]] = []
+
+    if cache is not None:
+        results = await asyncio.to_thread(cache.get_many, cache_keys, schema)
+
+    pending = []
+    joined = {}
+    for index in range(len(texts)):
+        if results[index] is not None:
+            continue
+
+        # Если ту же новость уже обрабатывает другой запрос, ждем его результат
+        in_flight = item_flights.get(cache_keys[index])
+        if in_flight is not None:
+            joined[index] = in_flight
+        else:
+            item_flights.claim(cache_keys[index])
+            pending.append(index)
+
+    # Прогресс по новостям: сколько всего и сколько уже готово (из кэша сразу)
+    counted = set(range(len(texts))) - set(pending) - set(joined)
+    if cache is not None:
+        metrics.inc("cache_hits", len(counted))
+        metrics.inc("cache_misses", len(texts) - len(counted))
+    emit_progress({"type": "items", "stage": progress_stage, "total": len(texts), "done": len(counted)})
+
+    def remember(index: int, result) -> None:
+        results[index] = result
+        if cache is not None:
+            cache.set(cache_keys[index], result)
+        if stage in ("classifier", "analyzer_classifier"):
+            learned.append((texts[index], result.category.value))
+        if index not in counted:
+            counted.add(index)
+            emit_progress({"type": "items", "stage": progress_stage, "total": 0, "done": 1})
+
+    # Одиночный вызов модели по новости
+    chain = get_structured_chain(template, schema)
+
+    async def process_item(index: int) -> None:
+        try:
+            remember(index, await ainvoke_llm(chain, {"text": texts[index]}))
+        except Exception as item_error:
+            logger.warning(f"Error in {stage}: {item_error}")
+
+    try:
+        # Пакетный режим: несколько новостей в одном вызове, размер пакета ограничен бюджетом токенов
+        if PIPELINE["BATCH_SIZE"] > 1 and len(pending) > 1:
+            batches = pack_batches(
+                [texts[index] for index in pending],
+                PIPELINE["BATCH_SIZE"],
+                PIPELINE["BATCH_TOKEN_BUDGET"],
+            )
+
+            async def process_batch(batch: List[int]) -> None:
+                indices = [pending[position] for position in batch]
+                try:
+                    batch_results = await invoke_batch(stage, [texts[index] for index in indices])
+                except Exception as batch_error:
+                    metrics.inc("batch_fallbacks", len(indices))
+                    logger.warning(f"Error in {stage} batch of {len(indices)} items: {batch_error}. Falling back to single items.")
+                    return
+                for position, index in enumerate(indices):
+                    if position in batch_results:
+                        remember(index, batch_results[position])
+                if len(batch_results) < len(indices):
+                    metrics.inc("batch_fallbacks", len(indices) - len(batch_results))
+                    logger.warning(f"{stage} batch returned {len(batch_results)} of {len(indices)} items. Retrying the rest one by one.")
+
+            await asyncio.gather(*(process_batch(batch) for batch in batches if len(batch) > 1))
+
+        # Одиночные вызовы для оставшихся новостей
+        await asyncio.gather(*(process_item(index) for index in pending if results[index] is None))
+    finally:
+        # Отдаем результаты (или None) запросам, которые присоединились к нашей работе
+        for index in pending:
+            item_flights.resolve(cache_keys[index], results[index])
+
+    # Новости, которые обрабатывал другой запрос; при его неудаче пробуем сами
+    for index, future in joined.items():
+        results[index] = await asyncio.shield(future)
+    await asyncio.gather(*(process_item(index) for index in joined if results[index] is None))
+
+    # Оставшиеся новости завершены с ошибкой или получены от другого запроса
+    emit_progress({"type": "items", "stage": progress_stage, "total": 0, "done": len(texts) - len(counted)})
+
+    if cache is not None:
+        await asyncio.to_thread(cache.flush)
+        logger.info(f"LLM cache stats: {cache.stats()}")
+    if learned and LOCAL_CLASSIFIER["ENABLED"]:
+        await learn_categories(learned)
+
+    return results
+
+
+async def train_local_classifier() -> None:
+    """Переобучение локального классификатора в отдельном потоке"""
+    try:
+        await asyncio.to_thread(get_local_classifier().train)
+    except Exception as e:
+        logger.error(f"Error training local classifier: {e}")
+
+
+async def learn_categories(pairs: List[Tuple[str, str]]) -> None:
+    """Сохранение категорий от LLM и запуск переобучения, когда накопилось достаточно новых примеров"""
+    global local_training
+    classifier = get_local_classifier()
+    await asyncio.to_thread(classifier.add_labels, pairs)
+    needs_training = await asyncio.to_thread(classifier.needs_training)
+    if needs_training and (local_training is None or local_training.done()):
+        local_training = asyncio.create_task(train_local_classifier())
+
+
+def local_categories(texts: List[str]) -> Tuple[Optional[LocalClassifier], List[Optional[str]], Set[int]]:
+    """Уверенные ответы локального классификатора (None - новость классифицирует LLM)
+    и номера ответов, которые выборочно проверяются через LLM для метрики согласия"""
+    local = get_local_classifier() if LOCAL_CLASSIFIER["ENABLED"] else None
+    categories = local.predict(texts) if local is not None else [None] * len(texts)
+    shadow = {
+        index for index, category in enumerate(categories)
+        if category is not None and random.random() < LOCAL_CLASSIFIER["SHADOW_RATE"]
+    }
+    return local, categories, shadow
+
+
+def record_shadow(local: LocalClassifier, local_category: str, llm_category: str) -> None:
+    """Учет выборочной проверки: согласие с LLM видно в /metrics и решает, можно ли доверять модели"""
+    local.record_shadow(local_category, llm_category)
+    metrics.inc("shadow_checks")
+    metrics.inc("shadow_agreements", int(local_category == llm_category))
+
+
+async def classify_texts(texts: List[str]) -> List[Optional[str]]:
+    """Категории текстов: уверенные ответы локального классификатора, остальные новости - через LLM.
+    Для новостей, которые не удалось классифицировать, возвращается None."""
+    local, categories, shadow = local_categories(texts)
 
-        return messages
+    answered = sum(category is not None for category in categories)
+    if answered:
+        emit_progress({"type": "items", "stage": "classifier", "total": answered, "done": answered})
+
+    remaining = [index for index, category in enumerate(categories) if category is None or index in shadow]
+    results = await run_item_stage("classifier", [texts[index] for index in remaining])
+
+    for index, result in zip(remaining, results):
+        if result is None:
+            continue
+        if index in shadow:
+            record_shadow(local, categories[index], result.category.value)
+        categories[index] = result.category.value
+
+    if local is not None:
+        logger.info(f"Local classifier stats: {local.stats()}")
+
+    return categories
+
+
+async def analyze_and_classify_texts(texts: List[str]) -> Tuple[List[Optional[SimpleAnalyzerOutput]], List[Optional[str]]]:
+    """Совмещенные анализ и классификация текстов. Новости, в категории которых уверен локальный
+    классификатор, модель только анализирует (промпт анализа короче и без категорий),
+    остальные анализируются и классифицируются одним вызовом.
+    Для новостей, которые не удалось обработать, возвращается None."""
+    local, categories, shadow = local_categories(texts)
+    fused = [index for index, category in enumerate(categories) if category is None or index in shadow]
+    analyze_only = [index for index, category in enumerate(categories) if category is not None and index not in shadow]
+
+    fused_results, analyze_only_results = await asyncio.gather(
+        run_item_stage("analyzer_classifier", [texts[index] for index in fused]),
+        run_item_stage("analyzer", [texts[index] for index in analyze_only], progress_stage="analyzer_classifier"),
+    )
+
+    analyses: List[Optional[SimpleAnalyzerOutput]] = [None] * len(texts)
+
+    for index, result in zip(fused, fused_results):
+        if result is None:
+            continue
+        if index in shadow:
+            record_shadow(local, categories[index], result.category.value)
+        analyses[index] = result
+        categories[index] = result.category.value
+    for index, result in zip(analyze_only, analyze_only_results):
+        analyses[index] = result
+
+    # Категория без анализа не нужна: новость получит резервный анализ и категорию
+    categories = [category if analysis is not None else None for analysis, category in zip(analyses, categories)]
+
+    if local is not None:
+        logger.info(f"Local classifier stats: {local.stats()}")
+
+    return analyses, categories
 
 
 # Определение узлов графа (агентов)
@@ -105,194 +554,419 @@ async def collector_agent(state: GraphState) -> GraphState:
     logger.info(f"Collecting news from {state['channels']} with limit {state['limit_per_channel']}")
 
     try:
-        collected_news = []
-        for channel in state["channels"]:
-            real_news = await get_real_news(
-                channel,
-                state["limit_per_channel"],
-            )
-            collected_news.extend(real_news)
+        # Ограничиваем число одновременно опрашиваемых каналов
+        semaphore = asyncio.Semaphore(COLLECTOR_CONCURRENCY)
+
+        async def fetch_channel(channel: str) -> List[News]:
+            async with semaphore:
+                return await get_real_news(
+                    channel,
+                    state["limit_per_channel"],
+                    state["min_ids"].get(channel, 0),
+                )
+
+        results = await asyncio.gather(*(fetch_channel(channel) for channel in state["channels"]))
 
-        return {**state, "collected_news": collected_news}
+        news, collected_news = index_news([news for real_news in results for news in real_news])
+
+        return {"news": news, "collected_news": collected_news}
     except Exception as e:
         logger.error(f"Error in collector_agent: {e}")
-        return {**state, "errors": state["errors"] + [f"Collector error: {str(e)}"]}
+        return {"errors": state["errors"] + [f"Collector error: {str(e)}"]}
 
 
-@traceable(name="analyzer_agent")
-def analyzer_agent(state: GraphState) -> GraphState:
-    """Агент для анализа новостей с использованием структурированного вывода"""
-    logger.info(f"Analyzing {len(state['collected_news'])} news items")
+@traceable(name="prefilter_agent")
+def prefilter_agent(state: GraphState) -> GraphState:
+    """Агент для локального отсева рекламы, заглушек и прочих не-новостей до вызовов LLM"""
+    logger.info(f"Pre-filtering {len(state['collected_news'])} news items")
+    try:
+        kept_news, dropped = prefilter_news([state["news"][key] for key in state["collected_news"]])
+        logger.info(f"Pre-filter dropped {sum(dropped.values())} of {len(state['collected_news'])} news items: {dict(dropped)}")
+
+        news, collected_news = index_news(kept_news)
+        return {"news": news, "collected_news": collected_news, "prefilter_dropped": dict(dropped)}
+    except Exception as e:
+        logger.error(f"Error in prefilter_agent: {e}")
+        return {"errors": state["errors"] + [f"Pre-filter error: {str(e)}"]}
+
+
+@traceable(name="deduplicator_agent")
+def deduplicator_agent(state: GraphState) -> GraphState:
+    """Агент для склейки почти одинаковых новостей из разных каналов перед анализом"""
+    logger.info(f"Deduplicating {len(state['collected_news'])} news items")
     try:
-        analyzed_news = []
+        collected_news = [state["news"][key] for key in state["collected_news"]]
+        clusters = cluster_near_duplicates([news.text for news in collected_news])
+
+        unique_news = []
+        for cluster in clusters:
+            members = [collected_news[index] for index in cluster]
+
+            # Представитель кластера - самая просматриваемая, затем самая полная версия новости
+            representative = max(members, key=lambda news: (news.views or 0, len(news.text)))
+            duplicates = list(representative.duplicates)
+            for news in members:
+                if news is not representative:
+                    duplicates.append(NewsSource(channel=news.channel, id=news.id))
+                    duplicates.extend(news.duplicates)
+
+            # Новость без дубликатов не копируем
+            if len(members) > 1:
+                representative = representative.model_copy(update={"duplicates": duplicates})
+            unique_news.append(representative)
+
+        removed = len(collected_news) - len(unique_news)
+        logger.info(f"Deduplication removed {removed} of {len(collected_news)} news items")
+
+        news, unique_keys = index_news(unique_news)
+        return {"news": news, "collected_news": unique_keys, "dedup_removed": removed}
+    except Exception as e:
+        logger.error(f"Error in deduplicator_agent: {e}")
+        return {"errors": state["errors"] + [f"Deduplicator error: {str(e)}"]}
 
-        # Создаем модель со структурированным выводом
-        structured_gigachat = gigachat.with_structured_output(SimpleAnalyzerOutput)
 
-        prompt = ChatPromptTemplate.from_template(ANALYZER_PROMPT)
+def news_analysis(news: News, keywords: List[str], sentiment: str, importance_score: float) -> NewsAnalysis:
+    """Запись анализа новости; важность новости со слабым признаком рекламы понижается"""
+    if news.downranked:
+        importance_score *= rules_for(news.channel)["DOWNRANK_FACTOR"]
+    return NewsAnalysis.create(news_key(news), keywords, sentiment, importance_score)
 
-        for news in state["collected_news"]:
-            chain = prompt | structured_gigachat
-            try:
-                analysis = chain.invoke({"text": news.text})
-                full_analysis = AnalyzerOutput(
-                    keywords=analysis.keywords,
-                    sentiment=analysis.sentiment,
-                    importance_score=analysis.importance_score,
-                    news=news
-                )
-                # Добавляем новость к анализу
-                analyzed_news.append(full_analysis)
-            except Exception as analysis_error:
-                logger.warning(f"Error in analysis: {analysis_error}. Creating fallback analysis.")
-
-                # Резервный вариант: создаем базовый анализ
-                fallback_analysis = AnalyzerOutput(
-                    keywords=["новость"],
-                    sentiment="нейтральная",
-                    entities={"people": [], "organizations": [], "places": []},
-                    importance_score=0.5,
-                    news=news
-                )
-                analyzed_news.append(fallback_analysis)
 
-        return {**state, "analyzed_news": analyzed_news}
+def fallback_analysis(news: News) -> NewsAnalysis:
+    """Резервный анализ для новости, которую не удалось обработать моделью"""
+    metrics.inc("fallbacks")
+    return news_analysis(news, ["новость"], "нейтральная", 0.5)
+
+
+async def analyze_news(news_list: List[News]) -> List[NewsAnalysis]:
+    """Анализ списка новостей с резервным анализом для новостей, которые не удалось обработать"""
+    results = await run_item_stage("analyzer", [news.text for news in news_list])
+
+    analyzed_news = []
+    for news, analysis in zip(news_list, results):
+        if analysis is not None:
+            analyzed_news.append(news_analysis(news, analysis.keywords, analysis.sentiment, analysis.importance_score))
+        else:
+            logger.warning(f"Creating fallback analysis for news {news.channel}/{news.id}.")
+            analyzed_news.append(fallback_analysis(news))
+
+    return analyzed_news
+
+
+async def classify_news(news_list: List[News]) -> List[str]:
+    """Категории новостей с резервной категорией "Общество" """
+    results = await classify_texts([news.text for news in news_list])
+
+    categories = []
+    for news, result in zip(news_list, results):
+        if result is not None:
+            categories.append(result)
+        else:
+            logger.warning(f"Using fallback category for news {news.channel}/{news.id}.")
+            metrics.inc("fallbacks")
+
+            # Резервный вариант: используем категорию "Общество"
+            categories.append("Общество")
+
+    return categories
+
+
+async def analyze_and_classify_news(news_list: List[News]) -> Tuple[List[NewsAnalysis], List[str]]:
+    """Совмещенные анализ и классификация одним вызовом модели на новость"""
+    results, result_categories = await analyze_and_classify_texts([news.text for news in news_list])
+
+    analyzed_news = []
+    categories = []
+    for news, result, result_category in zip(news_list, results, result_categories):
+        if result is not None:
+            analysis = news_analysis(news, result.keywords, result.sentiment, result.importance_score)
+            category = result_category
+        else:
+            logger.warning(f"Using fallback analysis and category for news {news.channel}/{news.id}.")
+
+            # Резервный вариант: базовый анализ и категория "Общество"
+            analysis = fallback_analysis(news)
+            category = "Общество"
+
+        analyzed_news.append(analysis)
+        categories.append(category)
+
+    return analyzed_news, categories
+
+
+def group_by_category(keys: List[str], categories: List[str]) -> Dict[str, List[str]]:
+    """Раскладка ключей новостей по категориям"""
+    categorized_news = {}
+    for key, category in zip(keys, categories):
+        categorized_news.setdefault(category, []).append(key)
+    return categorized_news
+
+
+@traceable(name="analyzer_agent")
+async def analyzer_agent(state: GraphState) -> GraphState:
+    """Агент для анализа новостей с использованием структурированного вывода"""
+    logger.info(f"Analyzing {len(state['collected_news'])} news items")
+    try:
+        analyzed_news = await analyze_news([state["news"][key] for key in state["collected_news"]])
+
+        return {"analyzed_news": {analysis.news_key: analysis for analysis in analyzed_news}}
     except Exception as e:
         logger.error(f"Error in analyzer_agent: {e}")
-        return {**state, "errors": state["errors"] + [f"Analyzer error: {str(e)}"]}
+        return {"errors": state["errors"] + [f"Analyzer error: {str(e)}"]}
 
 
 @traceable(name="classifier_agent")
-def classifier_agent(state: GraphState) -> GraphState:
+async def classifier_agent(state: GraphState) -> GraphState:
     """Агент для классификации новостей с использованием структурированного вывода"""
     logger.info(f"Classifying {len(state['analyzed_news'])} news items")
     try:
-        structured_gigachat = gigachat.with_structured_output(CategoryOutput)
+        keys = list(state["analyzed_news"])
+        categories = await classify_news([state["news"][key] for key in keys])
 
-        prompt = ChatPromptTemplate.from_template(CLASSIFIER_PROMPT)
-
-        categorized_news = {}
-
-        for analysis in state["analyzed_news"]:
-            chain = prompt | structured_gigachat
-            # Выполняем классификацию
-            try:
-                result = chain.invoke({"text": analysis.news.text})
-                category = result.category.value
+        return {"categorized_news": group_by_category(keys, categories)}
+    except Exception as e:
+        logger.error(f"Error in classifier_agent: {e}")
+        return {"errors": state["errors"] + [f"Classifier error: {str(e)}"]}
 
-                # Создаем объект ClassifierOutput
-                classification = ClassifierOutput(
-                    category=category,
-                    analysis=analysis
-                )
 
-                # Добавляем классификацию в соответствующую категорию
-                if category not in categorized_news:
-                    categorized_news[category] = []
+@traceable(name="analyzer_classifier_agent")
+async def analyzer_classifier_agent(state: GraphState) -> GraphState:
+    """Агент для совмещенного анализа и классификации новостей одним вызовом модели"""
+    logger.info(f"Analyzing and classifying {len(state['collected_news'])} news items")
+    try:
+        analyzed_news, categories = await analyze_and_classify_news(
+            [state["news"][key] for key in state["collected_news"]]
+        )
 
-                categorized_news[category].append(classification)
-            except Exception as classify_error:
-                logger.warning(f"Error in classification: {classify_error}. Using fallback category.")
+        return {
+            "analyzed_news": {analysis.news_key: analysis for analysis in analyzed_news},
+            "categorized_news": group_by_category(state["collected_news"], categories),
+        }
+    except Exception as e:
+        logger.error(f"Error in analyzer_classifier_agent: {e}")
+        return {"errors": state["errors"] + [f"Analyzer-classifier error: {str(e)}"]}
 
-                # Резервный вариант: используем категорию "Общество"
-                category = "Общество"
 
-                # Создаем объект ClassifierOutput
-                classification = ClassifierOutput(
-                    category=category,
-                    analysis=analysis
+@traceable(name="stream_processor_agent")
+async def stream_processor_agent(state: GraphState) -> GraphState:
+    """Потоковый агент: новости каждого канала уходят на дедупликацию, анализ и классификацию
+    сразу после загрузки канала, не дожидаясь остальных каналов"""
+    logger.info(f"Streaming news from {state['channels']} with limit {state['limit_per_channel']}")
+    try:
+        semaphore = asyncio.Semaphore(COLLECTOR_CONCURRENCY)
+        duplicate_index = NearDuplicateIndex() if DEDUP["ENABLED"] else None
+
+        # Уникальные новости в порядке поступления и источники их дубликатов
+        unique_news: List[News] = []
+        duplicates: Dict[int, List[NewsSource]] = {}
+        analyses: Dict[int, NewsAnalysis] = {}
+        categories: Dict[int, str] = {}
+        collected_count = 0
+        dropped = Counter()
+
+        async def process_channel(channel: str) -> None:
+            nonlocal collected_count
+            async with semaphore:
+                news_list = await get_real_news(
+                    channel,
+                    state["limit_per_channel"],
+                    state["min_ids"].get(channel, 0),
                 )
+            collected_count += len(news_list)
+
+            if PREFILTER["ENABLED"]:
+                news_list, channel_dropped = prefilter_news(news_list)
+                dropped.update(channel_dropped)
+
+            positions = []
+            for news in news_list:
+                position = len(unique_news)
+                match = duplicate_index.find_or_add(position, news.text) if duplicate_index else None
+                if match is not None:
+                    duplicates[match].append(NewsSource(channel=news.channel, id=news.id))
+                    continue
+                unique_news.append(news)
+                duplicates[position] = []
+                positions.append(position)
+
+            channel_news = [unique_news[position] for position in positions]
+            if PIPELINE["FUSED_ANALYZE_CLASSIFY"]:
+                channel_analyses, channel_categories = await analyze_and_classify_news(channel_news)
+            else:
+                channel_analyses = await analyze_news(channel_news)
+                channel_categories = await classify_news(channel_news)
+
+            for position, analysis, category in zip(positions, channel_analyses, channel_categories):
+                analyses[position] = analysis
+                categories[position] = category
+
+        await asyncio.gather(*(process_channel(channel) for channel in state["channels"]))
+
+        # Прикрепляем к новостям источники дубликатов, пришедших позже
+        news, collected_news = index_news([
+            item.model_copy(update={"duplicates": duplicates[position]}) if duplicates[position] else item
+            for position, item in enumerate(unique_news)
+        ])
+        analyzed_news = {analyses[position].news_key: analyses[position] for position in range(len(unique_news))}
+        categorized_news = group_by_category(collected_news, [categories[position] for position in range(len(unique_news))])
+
+        removed = collected_count - sum(dropped.values()) - len(unique_news)
+        logger.info(f"Streamed {collected_count} news items, pre-filter dropped {dict(dropped)}, deduplication removed {removed}")
+
+        return {
+            "news": news,
+            "collected_news": collected_news,
+            "prefilter_dropped": dict(dropped),
+            "dedup_removed": removed,
+            "analyzed_news": analyzed_news,
+            "categorized_news": categorized_news,
+        }
+    except Exception as e:
+        logger.error(f"Error in stream_processor_agent: {e}")
+        return {"errors": state["errors"] + [f"Stream processor error: {str(e)}"]}
 
-                # Добавляем классификацию в соответствующую категорию
-                if category not in categorized_news:
-                    categorized_news[category] = []
 
-                categorized_news[category].append(classification)
+@traceable(name="story_clusterer_agent")
+def story_clusterer_agent(state: GraphState) -> GraphState:
+    """Агент для группировки новостей каждой категории по сюжетам перед суммаризацией"""
+    logger.info(f"Clustering stories in {len(state['categorized_news'])} categories")
+    try:
+        stories = {}
+        for category, keys in state["categorized_news"].items():
+            clusters = cluster_stories(
+                [state["news"][key].text for key in keys],
+                [state["analyzed_news"][key].importance_score for key in keys],
+            )
+            stories[category] = [[keys[index] for index in cluster] for cluster in clusters]
+
+        news_count = sum(len(keys) for keys in state["categorized_news"].values())
+        story_count = sum(len(category_stories) for category_stories in stories.values())
+        logger.info(f"Grouped {news_count} news items into {story_count} stories")
 
-        return {**state, "categorized_news": categorized_news}
+        return {"stories": stories}
     except Exception as e:
-        logger.error(f"Error in classifier_agent: {e}")
-        return {**state, "errors": state["errors"] + [f"Classifier error: {str(e)}"]}
+        logger.error(f"Error in story_clusterer_agent: {e}")
+        return {"errors": state["errors"] + [f"Story clusterer error: {str(e)}"]}
+
+
+def story_text(text: str, mentions: int) -> str:
+    """Сокращенный представитель сюжета с числом упоминаний для промпта суммаризатора"""
+    text = truncate_to_tokens(text, STORY_CLUSTERING["REPRESENTATIVE_TOKENS"])
+    return f"[Упоминаний: {mentions}] {text}" if mentions > 1 else text
+
+
+async def summarize_texts(category: str, texts: List[str], mentions: Optional[List[int]] = None) -> CategorySummary:
+    """Иерархическая (map-reduce) суммаризация новостей категории с ограничением размера каждого вызова.
+    Тексты режутся на куски по бюджету токенов, куски суммаризируются параллельно,
+    затем частичные сводки объединяются группами по MAX_FANOUT, пока не останется одна.
+    mentions - сколько новостей представляет каждый текст, если тексты - сюжеты."""
+    mentions = mentions or [1] * len(texts)
+    news_count = sum(mentions)
+    chunk_tokens = SUMMARIZER["CHUNK_TOKENS"]
+    texts = [truncate_to_tokens(text, chunk_tokens) for text in texts]
+    chunks = pack_batches(texts, len(texts), chunk_tokens)
+
+    map_chain = get_structured_chain(SUMMARIZER_PROMPT, CategorySummary)
+
+    # Map: сводка по каждому куску
+    results = await asyncio.gather(*(
+        ainvoke_llm(map_chain, {
+            "text": "\n\n".join(texts[index] for index in chunk),
+            "category": category,
+            "count": sum(mentions[index] for index in chunk)
+        })
+        for chunk in chunks
+    ), return_exceptions=True)
+
+    partials = [result.summary for result in results if not isinstance(result, BaseException)]
+    failed = len(results) - len(partials)
+    if failed:
+        logger.warning(f"{failed} of {len(chunks)} summary chunks failed for category {category}")
+    if not partials:
+        raise next(result for result in results if isinstance(result, BaseException))
+
+    # Reduce: объединяем частичные сводки, пока не останется одна
+    reduce_chain = get_structured_chain(SUMMARIZER_REDUCE_PROMPT, CategorySummary)
+    fanout = max(2, SUMMARIZER["MAX_FANOUT"])
+    while len(partials) > 1:
+        groups = [partials[i:i + fanout] for i in range(0, len(partials), fanout)]
+        reduced = await asyncio.gather(*(
+            ainvoke_llm(reduce_chain, {
+                "text": "\n\n".join(group),
+                "category": category,
+                "count": news_count
+            })
+            for group in groups
+        ))
+        partials = [summary.summary for summary in reduced]
+
+    return CategorySummary(category=category, summary=partials[0], news_count=news_count)
 
 
 @traceable(name="summarizer_agent")
-def summarizer_agent(state: GraphState) -> GraphState:
+async def summarizer_agent(state: GraphState) -> GraphState:
     """Агент для суммаризации новостей с использованием структурированного вывода"""
     logger.info(f"Summarizing {len(state['categorized_news'])} categories")
     try:
-        # Создаем модель со структурированным выводом
-        structured_gigachat = gigachat.with_structured_output(CategorySummary)
-        prompt = ChatPromptTemplate.from_template(SUMMARIZER_PROMPT)
-        chain = prompt | structured_gigachat
-
-        summaries = []
-
-        for category, news_list in state["categorized_news"].items():
-            all_texts = [item.analysis.news.text for item in news_list]
-            combined_text = "\n\n".join(all_texts)
+        async def summarize_category(category: str, keys: List[str]) -> CategorySummary:
+            # Вместо всех новостей сюжета в промпт идет один представитель с числом упоминаний
+            stories = state["stories"].get(category)
+            if stories:
+                all_texts = [story_text(state["news"][story[0]].text, len(story)) for story in stories]
+                mentions = [len(story) for story in stories]
+            else:
+                all_texts = [state["news"][key].text for key in keys]
+                mentions = None
 
             # Выполняем суммаризацию
             try:
-                summary = chain.invoke({
-                    "text": combined_text,
-                    "category": category,
-                    "count": len(news_list)
-                })
-
-                summaries.append(summary)
+                summary = await summarize_texts(category, all_texts, mentions)
             except Exception as summary_error:
                 logger.warning(f"Error in summarization: {summary_error}. Creating fallback summary.")
+                metrics.inc("fallbacks")
 
                 # Резервный вариант: создаем базовую сводку
-                fallback_summary = CategorySummary(
+                summary = CategorySummary(
                     category=category,
                     summary=f"Новости категории {category}",
-                    news_count=len(news_list)
+                    news_count=len(keys)
                 )
 
-                summaries.append(fallback_summary)
+            # Готовую сводку категории можно показать пользователю, не дожидаясь остальных
+            emit_progress({"type": "category_summary", "summary": summary})
+            return summary
+
+        # Категории суммаризируются параллельно
+        summaries = list(await asyncio.gather(*(
+            summarize_category(category, keys)
+            for category, keys in state["categorized_news"].items()
+        )))
 
-        return {**state, "summaries": summaries}
+        return {"summaries": summaries}
     except Exception as e:
         logger.error(f"Error in summarizer_agent: {e}")
-        return {**state, "errors": state["errors"] + [f"Summarizer error: {str(e)}"]}
+        return {"errors": state["errors"] + [f"Summarizer error: {str(e)}"]}
 
 
 @traceable(name="reporter_agent")
-def reporter_agent(state: GraphState) -> GraphState:
+async def reporter_agent(state: GraphState) -> GraphState:
     """Агент для формирования отчета с учетом выбранной даты"""
     logger.info(f"Generating report with {len(state['summaries'])} summaries")
 
     try:
-        # Создаем категории отчета
-        report_categories = []
-        all_summaries = []
-
-        for summary in state["summaries"]:
-            category = summary.category
-            news_list = state["categorized_news"].get(category, [])
-
-            # Создаем список новостей для категории
-            category_news = [item.analysis.news for item in news_list]
-
-            # Создаем категорию отчета
-            report_category = ReportCategory(
-                category=category,
-                summary=summary.summary,
-                news_count=summary.news_count,
-                news=category_news
-            )
-
-            report_categories.append(report_category)
-            all_summaries.append(f"Категория '{category}' ({summary.news_count} новостей): {summary.summary}")
+        # Категории отчета собираются из ключей новостей только здесь, на выходе конвейера
+        report_categories = materialize_categories(state["summaries"], state["categorized_news"], state["news"])
+        all_summaries = [
+            f"Категория '{summary.category}' ({summary.news_count} новостей): {summary.summary}"
+            for summary in state["summaries"]
+        ]
 
         # Генерируем общую сводку
         combined_text = "\n\n".join(all_summaries)
-        prompt = ChatPromptTemplate.from_template(REPORTER_PROMPT)
-        chain = prompt | gigachat | StrOutputParser()
+        chain = get_text_chain(REPORTER_PROMPT)
 
         # Выполняем генерацию общей сводки
-        overall_summary = chain.invoke({"text": combined_text})
+        overall_summary = await ainvoke_llm(chain, {"text": combined_text})
 
         # Создаем отчет
         report = Report(
@@ -304,10 +978,10 @@ def reporter_agent(state: GraphState) -> GraphState:
             overall_summary=overall_summary
         )
 
-        return {**state, "report": report}
+        return {"report": report}
     except Exception as e:
         logger.error(f"Error in reporter_agent: {e}")
-        return {**state, "errors": state["errors"] + [f"Reporter error: {str(e)}"]}
+        return {"errors": state["errors"] + [f"Reporter error: {str(e)}"]}
 
 
 def has_errors(state: GraphState) -> str:
@@ -317,6 +991,16 @@ def has_errors(state: GraphState) -> str:
     return "continue"
 
 
+def route_stage(state: GraphState) -> str:
+    """Переход после узла: к обработчику ошибок, к завершению, если новостей нет, или к следующему узлу"""
+    if has_errors(state) == "error_handler":
+        return "error_handler"
+    # Без новостей сводки и отчет не нужны: модель не вызываем ради пустого дайджеста
+    if not state["collected_news"]:
+        return "no_news"
+    return "continue"
+
+
 def error_handler(state: GraphState) -> GraphState:
     """Обработчик ошибок"""
     logger.error(f"Errors occurred: {state['errors']}")
@@ -330,93 +1014,279 @@ def error_handler(state: GraphState) -> GraphState:
         categories=[],
         overall_summary=f"Произошли ошибки: {', '.join(state['errors'])}"
     )
-    return {**state, "report": error_report}
+    return {"report": error_report}
 
 
-def create_agent_graph():
-    """Создание графа агентов"""
+def create_agent_graph(checkpointer=None):
+    """Создание графа агентов; с checkpointer состояние сохраняется после каждого узла"""
     graph = StateGraph(GraphState)
+    fused = PIPELINE["FUSED_ANALYZE_CLASSIFY"]
+    streaming = PIPELINE["STREAMING"]
+
+    def add_node(name: str, func) -> None:
+        # Каждый узел пишет время, число элементов и ошибки во встроенные метрики
+        graph.add_node(name, instrument_node(name, func, stage_item_count))
 
     # 1. Добавляем все узлы
-    graph.add_node("collector", collector_agent)
-    graph.add_node("analyzer", analyzer_agent)
-    graph.add_node("classifier", classifier_agent)
-    graph.add_node("summarizer", summarizer_agent)
-    graph.add_node("reporter", reporter_agent)
-    graph.add_node("error_handler", error_handler)
+    if streaming:
+        add_node("stream_processor", stream_processor_agent)
+    else:
+        add_node("collector", collector_agent)
+        if PREFILTER["ENABLED"]:
+            add_node("prefilter", prefilter_agent)
+        if DEDUP["ENABLED"]:
+            add_node("deduplicator", deduplicator_agent)
+        if fused:
+            add_node("analyzer_classifier", analyzer_classifier_agent)
+        else:
+            add_node("analyzer", analyzer_agent)
+            add_node("classifier", classifier_agent)
+    if STORY_CLUSTERING["ENABLED"]:
+        add_node("clusterer", story_clusterer_agent)
+    add_node("summarizer", summarizer_agent)
+    add_node("reporter", reporter_agent)
+    add_node("error_handler", error_handler)
 
     # 2. Добавляем ребра
-    graph.add_edge(START, "collector")
-    graph.add_edge("collector", "analyzer")
-    graph.add_edge("analyzer", "classifier")
-    graph.add_edge("classifier", "summarizer")
-    graph.add_edge("summarizer", "reporter")
-    graph.add_edge("reporter", END)
+    graph.add_edge(START, "stream_processor" if streaming else "collector")
 
     # 3. Добавляем условные ребра для обработки ошибок
-    graph.add_conditional_edges(
-        "collector",
-        has_errors,
-        {
-            "error_handler": "error_handler",
-            "continue": "analyzer"
-        }
-    )
+    if streaming:
+        stages = ["stream_processor"]
+    else:
+        stages = ["collector"]
+        if PREFILTER["ENABLED"]:
+            stages.append("prefilter")
+        if DEDUP["ENABLED"]:
+            stages.append("deduplicator")
+        if fused:
+            stages.append("analyzer_classifier")
+        else:
+            stages.extend(["analyzer", "classifier"])
+    if STORY_CLUSTERING["ENABLED"]:
+        stages.append("clusterer")
+    stages.extend(["summarizer", "reporter"])
+
+    for node, next_node in zip(stages, stages[1:]):
+        graph.add_conditional_edges(
+            node,
+            route_stage,
+            {
+                "error_handler": "error_handler",
+                "no_news": END,
+                "continue": next_node
+            }
+        )
 
+    # Ошибка последнего узла тоже превращается в отчет об ошибке, а не в пустой отчет
     graph.add_conditional_edges(
-        "analyzer",
+        "reporter",
         has_errors,
         {
             "error_handler": "error_handler",
-            "continue": "classifier"
+            "continue": END
         }
     )
 
-    graph.add_conditional_edges(
-        "classifier",
-        has_errors,
-        {
-            "error_handler": "error_handler",
-            "continue": "summarizer"
-        }
-    )
+    graph.add_edge("error_handler", END)
+    return graph.compile(checkpointer=checkpointer)
 
-    graph.add_conditional_edges(
-        "summarizer",
-        has_errors,
-        {
-            "error_handler": "error_handler",
-            "continue": "reporter"
-        }
-    )
 
-    graph.add_edge("error_handler", END)
-    return graph.compile()
+@lru_cache(maxsize=None)
+def get_agent_graph():
+    """Скомпилированный граф агентов, собирается один раз на процесс"""
+    return create_agent_graph()
 
 
-@traceable(name="process_news_channels")
-async def process_news_channels(
+_checkpointed_graph = None
+
+
+async def get_checkpointed_graph():
+    """Граф агентов с сохранением состояния запусков в SQLite"""
+    global _checkpointed_graph
+    checkpoints = await get_checkpoints()
+    if _checkpointed_graph is None:
+        # Компиляция графа занимает заметное время: не блокируем цикл событий
+        graph = await asyncio.to_thread(create_agent_graph, checkpoints.saver)
+        if _checkpointed_graph is None:
+            _checkpointed_graph = graph
+    return _checkpointed_graph
+
+
+def build_pipeline() -> None:
+    """Сборка графа без сохранения состояния и всех цепочек конвейера"""
+    get_agent_graph()
+    for template, schema, batch_template, batch_schema in ITEM_STAGES.values():
+        get_structured_chain(template, schema)
+        get_structured_chain(batch_template, batch_schema)
+    get_structured_chain(SUMMARIZER_PROMPT, CategorySummary)
+    get_structured_chain(SUMMARIZER_REDUCE_PROMPT, CategorySummary)
+    get_text_chain(REPORTER_PROMPT)
+
+
+async def warm_up() -> None:
+    """Предварительная сборка графов и всех цепочек, чтобы первый запрос не тратил на это время.
+    Дайджесты пользователей идут через граф с сохранением состояния, поэтому собирается и он."""
+    await asyncio.to_thread(build_pipeline)
+    if CHECKPOINTS["ENABLED"]:
+        await get_checkpointed_graph()
+
+
+def stage_item_count(node: str, update: Dict[str, Any]) -> Optional[int]:
+    """Число элементов, которое выдал узел графа, для отображения прогресса"""
+    if node in ("collector", "prefilter", "deduplicator", "stream_processor"):
+        return len(update.get("collected_news", []))
+    if node in ("analyzer", "analyzer_classifier"):
+        return len(update.get("analyzed_news", []))
+    if node == "classifier":
+        return sum(len(news_list) for news_list in update.get("categorized_news", {}).values())
+    if node == "clusterer":
+        return sum(len(stories) for stories in update.get("stories", {}).values())
+    if node == "summarizer":
+        return len(update.get("summaries", []))
+    return None
+
+
+async def stream_news_channels(
         channels: List[str],
         limit_per_channel: int = LIMIT_PER_CHANNEL,
-):
-    """Обработка новостных каналов с опциональной фильтрацией по дате"""
-    agent_graph = create_agent_graph()
+        user_id: Optional[str] = None,
+        since_last_digest: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Потоковая обработка новостных каналов. По ходу работы выдаются события:
+    завершение узла ("stage"), прогресс по новостям ("items"), готовая сводка категории
+    ("category_summary"); последним выдается событие "report" с итоговым отчетом.
+    Если в каналах нет новых сообщений с прошлого такого же дайджеста, отчет берется из кэша.
+    Запуск пользователя с сохранением состояния после сбоя продолжается с последнего успешного узла."""
+    agent_graph = get_agent_graph()
+    store = get_message_store()
+    checkpointing = CHECKPOINTS["ENABLED"] and user_id is not None
+
+    min_ids = {}
+    if since_last_digest and user_id is not None:
+        min_ids = await asyncio.to_thread(store.get_digest_watermarks, user_id)
+
+    cache_key = None
+    if DIGEST_CACHE["ENABLED"]:
+        # Ключ кэша зависит от последних id каналов, поэтому нужны только что обновленные каналы
+        if not PIPELINE["STREAMING"]:
+            # Сборщик и так ждет все каналы до анализа: загружаем их заранее.
+            # Сборщик графа затем не запрашивает только что обновленные каналы повторно
+            async for event in refresh_channels(channels, limit_per_channel):
+                yield event
+            cache_key = await current_digest_key(channels, limit_per_channel, min_ids)
+        elif all(channel_is_fresh(channel, limit_per_channel) for channel in channels):
+            # Потоковый режим анализирует канал сразу после загрузки, заранее каналы не загружаем:
+            # кэш проверяется, только если все каналы и так только что обновлены, иначе заполняется после запуска
+            cache_key = await current_digest_key(channels, limit_per_channel, min_ids)
+
+        cached = get_digest_cache().get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            logger.info(f"Digest for {len(channels)} channels served from cache")
+            if user_id is not None:
+                await asyncio.to_thread(store.set_digest_watermarks, user_id, cached.watermarks)
+            yield {"type": "report", "report": cached.report, "text": cached.text}
+            return
 
     initial_state = {
         "channels": channels,
         "limit_per_channel": limit_per_channel,
+        "min_ids": min_ids,
+        "news": {},
         "collected_news": [],
-        "analyzed_news": [],
+        "prefilter_dropped": {},
+        "dedup_removed": 0,
+        "analyzed_news": {},
         "categorized_news": {},
+        "stories": {},
         "summaries": [],
         "report": None,
         "errors": [],
     }
 
-    logger.info(f"Starting processing of {len(channels)} channels")
-
-    # Запускаем граф агентов
-    final_state = await agent_graph.ainvoke(initial_state)
+    graph_input, config, thread_id = initial_state, None, None
+    if checkpointing:
+        checkpoints = await get_checkpoints()
+        # Поток запуска: тот же пользователь и тот же запрос (каналы, limit, границы прошлого дайджеста)
+        thread_id = f"{user_id}:{make_digest_key(channels, {}, limit_per_channel, min_ids)}"
+        if not checkpoints.claim(thread_id):
+            # Такой же дайджест уже собирается в этом процессе: два запуска не пишут в один поток
+            logger.info(f"Run {thread_id} is already in progress, running without checkpoints")
+            thread_id = None
+
+    final_state = initial_state
+    try:
+        if thread_id is not None:
+            agent_graph = await get_checkpointed_graph()
+            await checkpoints.start(thread_id)
+            config = checkpoints.config(thread_id)
+
+            snapshot = await checkpoints.resume_point(agent_graph, thread_id)
+            if snapshot is not None:
+                logger.info(f"Resuming run {thread_id} from {', '.join(snapshot.next)}")
+                graph_input, config = None, snapshot.config
+            else:
+                # Состояние прошлого запуска без точки возобновления не нужно: channels накапливается
+                await checkpoints.saver.adelete_thread(thread_id)
+
+        logger.info(f"Starting processing of {len(channels)} channels")
+
+        # Запускаем граф агентов
+        async for mode, chunk in agent_graph.astream(graph_input, config, stream_mode=["updates", "custom", "values"]):
+            if mode == "values":
+                final_state = chunk
+            elif mode == "custom":
+                yield chunk
+            else:
+                for node, update in chunk.items():
+                    yield {"type": "stage", "node": node, "count": stage_item_count(node, update or {})}
+
+        # Успешный запуск возобновлять не придется
+        if thread_id is not None and not final_state["errors"]:
+            await checkpoints.delete(thread_id)
+    finally:
+        # Поток освобождается и при ошибке, и при досрочном закрытии генератора
+        if thread_id is not None:
+            checkpoints.release(thread_id)
+
+    text = None
+    if not final_state["errors"]:
+        digest_watermarks = {}
+        for key in final_state["collected_news"]:
+            news = final_state["news"][key]
+            for source in [news, *news.duplicates]:
+                digest_watermarks[source.channel] = max(digest_watermarks.get(source.channel, 0), int(source.id))
+
+        # Запоминаем, до какого сообщения каждого канала пользователь получил дайджест
+        if user_id is not None:
+            await asyncio.to_thread(store.set_digest_watermarks, user_id, digest_watermarks)
+
+        # Отчеты с ошибками не кэшируем
+        if DIGEST_CACHE["ENABLED"] and final_state["report"] is not None:
+            if cache_key is None:
+                # Каналы загрузил сам граф: ключ строим по сохраненным им последним id
+                cache_key = await current_digest_key(channels, limit_per_channel, min_ids)
+            text = format_report_for_telegram(final_state["report"])
+            get_digest_cache().set(cache_key, CachedDigest(final_state["report"], text, digest_watermarks))
+
+    if final_state["report"] is None and not final_state["errors"] and not final_state["collected_news"]:
+        logger.info(f"No news in {len(channels)} channels")
+        text = NO_NEWS_SINCE_LAST_DIGEST_TEXT if since_last_digest else NO_NEWS_TEXT
 
     logger.info("Processing completed")
-    return final_state["report"]
+    yield {"type": "report", "report": final_state["report"], "text": text}
+
+
+@traceable(name="process_news_channels")
+async def process_news_channels(
+        channels: List[str],
+        limit_per_channel: int = LIMIT_PER_CHANNEL,
+        user_id: Optional[str] = None,
+        since_last_digest: bool = False,
+):
+    """Обработка новостных каналов, опционально только сообщений после прошлого дайджеста пользователя"""
+    report = None
+    async for event in stream_news_channels(channels, limit_per_channel, user_id, since_last_digest):
+        if event["type"] == "report":
+            report = event["report"]
+    return report
@@ -0,0 +1,81 @@
+"""
+Фоновое обновление каналов пользователей.
+Периодически забирает новые сообщения всех каналов из подписок и заранее прогоняет их
+через анализ и классификацию. Результаты попадают в хранилище сообщений и кэш LLM,
+поэтому интерактивный дайджест тратит время только на суммаризацию и отчет.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict
+
+from agents.agent_graph import get_real_news, run_item_stage, classify_texts, analyze_and_classify_texts, LIMIT_PER_CHANNEL
+from config.settings import PIPELINE, REFRESHER, LLM_CACHE, PREFILTER
+from utils.prefilter import prefilter_news
+from utils.llm_scheduler import llm_priority, BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelRefresher:
+    """Планировщик фонового обновления каналов из подписок пользователей"""
+
+    def __init__(self, get_subscriber_counts: Callable[[], Dict[str, int]]):
+        # get_subscriber_counts возвращает актуальное число подписчиков каждого канала
+        self._get_subscriber_counts = get_subscriber_counts
+        self._next_refresh: Dict[str, float] = {}
+        self._semaphore = asyncio.Semaphore(REFRESHER["CONCURRENCY"])
+
+    def interval_for(self, channel: str) -> float:
+        """Интервал обновления канала со случайным разбросом, чтобы каналы не обновлялись залпом"""
+        interval = REFRESHER["CHANNEL_INTERVALS"].get(channel, REFRESHER["INTERVAL_SECONDS"])
+        jitter = REFRESHER["JITTER"]
+        return interval * random.uniform(1 - jitter, 1 + jitter)
+
+    async def refresh_channel(self, channel: str) -> None:
+        """Сбор, анализ и классификация новых сообщений канала"""
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                news_list = await get_real_news(channel, LIMIT_PER_CHANNEL)
+                if PREFILTER["ENABLED"]:
+                    news_list, _ = prefilter_news(news_list)
+                texts = [news.text for news in news_list]
+                if PIPELINE["FUSED_ANALYZE_CLASSIFY"]:
+                    await analyze_and_classify_texts(texts)
+                else:
+                    await run_item_stage("analyzer", texts)
+                    await classify_texts(texts)
+                logger.info(f"Refreshed {channel}: {len(news_list)} news in {time.monotonic() - started:.1f}s")
+            except Exception as e:
+                logger.warning(f"Error refreshing {channel}: {e}")
+            finally:
+                self._next_refresh[channel] = time.monotonic() + self.interval_for(channel)
+
+    async def run(self) -> None:
+        """Бесконечный цикл обновления: каналы с большим числом подписчиков обновляются первыми"""
+        logger.info("Channel refresher started")
+        # Запросы фонового обновления пропускают вперед интерактивные дайджесты
+        llm_priority.set(BACKGROUND)
+        if not LLM_CACHE["ENABLED"]:
+            logger.warning("LLM cache is disabled: precomputed analysis will not be reused by digests")
+        while True:
+            counts = await asyncio.to_thread(self._get_subscriber_counts)
+
+            # Забываем каналы, от которых все отписались
+            for channel in list(self._next_refresh):
+                if channel not in counts:
+                    del self._next_refresh[channel]
+
+            now = time.monotonic()
+            due = [channel for channel in counts if self._next_refresh.get(channel, 0) <= now]
+            due.sort(key=lambda channel: counts[channel], reverse=True)
+
+            if due:
+                await asyncio.gather(*(self.refresh_channel(channel) for channel in due))
+                continue
+
+            # Спим до ближайшего обновления, но регулярно просыпаемся, чтобы заметить новые подписки
+            next_due = min(self._next_refresh.values(), default=now + REFRESHER["POLL_SECONDS"])
+            await asyncio.sleep(max(0.0, min(next_due - now, REFRESHER["POLL_SECONDS"])))
@@ -0,0 +1,341 @@
+"""
+Локальные заменители Telegram и GigaChat для офлайн-замеров конвейера.
+
+SyntheticCorpus генерирует детерминированные русскоязычные новости по категориям,
+с долей рекламы, коротких заглушек и перепостов между каналами.
+FakeTelegramClient отдает их через iter_messages, FakeGigaChat отвечает на все промпты конвейера
+корректными структурированными ответами. У обоих настраиваются задержки (логнормальное
+распределение) и доля ошибок, модель считает вызовы и токены по стадиям.
+"""
+import asyncio
+import math
+import random
+import re
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+from models.schemas import (
+    SimpleAnalyzerOutput,
+    CategoryOutput,
+    AnalyzerClassifierOutput,
+    BatchAnalyzerOutput,
+    BatchCategoryOutput,
+    BatchAnalyzerClassifierOutput,
+    CategorySummary,
+)
+from utils.helpers import estimate_tokens
+
+# Фрагменты новостей по категориям; по ним же фиктивная модель определяет категорию
+CATEGORY_PHRASES = {
+    "Политика": [
+        "Госдума приняла в первом чтении законопроект о {topic}",
+        "министр иностранных дел провел переговоры с коллегой из {country}",
+        "губернатор {city} подписал указ о {topic}",
+        "в Совете Федерации обсудили поправки к закону о {topic}",
+    ],
+    "Экономика": [
+        "Центробанк сохранил ключевую ставку на уровне {number}%",
+        "инфляция в {city} за месяц составила {number}%",
+        "курс рубля к доллару вырос на торгах Мосбиржи",
+        "компании {city} нарастили экспорт на {number} млрд рублей",
+    ],
+    "Технологии": [
+        "в {city} запустили сеть 5G для {number} тысяч абонентов",
+        "разработчики представили нейросеть для {topic}",
+        "производитель смартфонов анонсировал новый процессор",
+        "в {city} открыли дата-центр мощностью {number} МВт",
+    ],
+    "Наука": [
+        "ученые из {city} открыли новый вид бактерий",
+        "астрономы обнаружили экзопланету в {number} световых годах от Земли",
+        "физики провели эксперимент на коллайдере в {city}",
+        "биологи расшифровали геном древнего растения",
+    ],
+    "Спорт": [
+        "сборная России обыграла команду {country} со счетом {number}:1",
+        "футбольный клуб из {city} вышел в финал кубка",
+        "хоккеисты установили рекорд сезона по числу шайб",
+        "чемпионат мира по биатлону пройдет в {city}",
+    ],
+    "Культура": [
+        "в {city} открылась выставка современного искусства",
+        "театр представил премьеру спектакля по роману классика",
+        "фильм режиссера из {city} получил приз кинофестиваля",
+        "музей показал {number} ранее не выставлявшихся картин",
+    ],
+    "Общество": [
+        "в {city} открыли новую школу на {number} учеников",
+        "волонтеры собрали {number} тонн помощи для пенсионеров",
+        "жители {city} проголосовали за благоустройство парка",
+        "в поликлиниках {city} продлили часы приема",
+    ],
+    "Происшествия": [
+        "в {city} произошло ДТП с участием {number} автомобилей",
+        "спасатели потушили пожар на складе в {city}",
+        "полиция задержала подозреваемых в мошенничестве",
+        "из-за ливня в {city} подтоплены {number} улиц",
+    ],
+}
+
+CITIES = ["Москве", "Санкт-Петербурге", "Казани", "Новосибирске", "Екатеринбурге", "Самаре", "Владивостоке", "Туле"]
+COUNTRIES = ["Китая", "Индии", "Бразилии", "Турции", "Сербии", "Египта"]
+TOPICS = ["налогах", "образовании", "здравоохранении", "транспорте", "цифровых платформах", "экологии"]
+
+ADS = [
+    "Реклама. ООО «Ромашка», erid: 2Vtzqx{number}. Скидки до {number}% по промокоду NEWS",
+    "Розыгрыш! Подпишитесь на наш канал и выиграйте iPhone",
+]
+STUBS = ["Подробности позже", "Видео", "👍🔥🔥", "Срочно!"]
+
+
+def _fill(template: str, rng: random.Random) -> str:
+    return template.format(
+        city=rng.choice(CITIES),
+        country=rng.choice(COUNTRIES),
+        topic=rng.choice(TOPICS),
+        number=rng.randint(2, 99),
+    )
+
+
+def _lognormal(rng: random.Random, median: float, sigma: float) -> float:
+    """Случайная задержка с заданной медианой и разбросом, в секундах"""
+    if median <= 0:
+        return 0.0
+    return rng.lognormvariate(math.log(median), sigma)
+
+
+class SyntheticCorpus:
+    """Детерминированные сообщения каналов: новости, реклама, заглушки и перепосты"""
+
+    def __init__(
+            self,
+            seed: int = 1,
+            ad_share: float = 0.05,
+            stub_share: float = 0.05,
+            repost_share: float = 0.15,
+            stories: int = 200,
+    ):
+        self.seed = seed
+        self.ad_share = ad_share
+        self.stub_share = stub_share
+        self.repost_share = repost_share
+
+        # Общий пул историй, которые перепечатывают разные каналы
+        rng = random.Random(seed)
+        self._stories = [self._story(rng) for _ in range(stories)]
+
+    @staticmethod
+    def _story(rng: random.Random) -> str:
+        phrases = CATEGORY_PHRASES[rng.choice(list(CATEGORY_PHRASES))]
+        sentences = [_fill(phrase, rng) for phrase in rng.sample(phrases, rng.randint(2, 3))]
+        return ". ".join(sentence[0].upper() + sentence[1:] for sentence in sentences) + "."
+
+    def message_text(self, channel: str, message_id: int) -> str:
+        """Текст сообщения канала; одинаков при каждом обращении"""
+        rng = random.Random(zlib.crc32(f"{self.seed}:{channel}:{message_id}".encode("utf-8")))
+        roll = rng.random()
+        if roll < self.ad_share:
+            return _fill(rng.choice(ADS), rng)
+        if roll < self.ad_share + self.stub_share:
+            return rng.choice(STUBS)
+        if roll < self.ad_share + self.stub_share + self.repost_share:
+            return rng.choice(self._stories)
+        return self._story(rng)
+
+
+class FakeMessage:
+    """Сообщение Telethon с полями, которые читает конвейер"""
+
+    def __init__(self, message_id: int, text: str, date: datetime, views: int):
+        self.id = message_id
+        self.text = text
+        self.message = text
+        self.date = date
+        self.views = views
+        self.fwd_from = None
+        self.pinned = False
+        self.action = None
+
+
+class FloodWaitError(Exception):
+    """Аналог telethon.errors.FloodWaitError"""
+
+    def __init__(self, seconds: int):
+        super().__init__(f"A wait of {seconds} seconds is required")
+        self.seconds = seconds
+
+
+class FakeTelegramClient:
+    """Заменитель TelegramClient: каналы с messages_per_channel сообщениями, задержки, ошибки и FloodWait"""
+
+    def __init__(
+            self,
+            corpus: SyntheticCorpus,
+            messages_per_channel: int = 200,
+            latency: float = 0.15,
+            latency_sigma: float = 0.5,
+            error_rate: float = 0.0,
+            flood_wait_rate: float = 0.0,
+            flood_wait_seconds: int = 1,
+            seed: int = 1,
+    ):
+        self.corpus = corpus
+        self.messages_per_channel = messages_per_channel
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.calls = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._epoch = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def get_input_entity(self, channel: str) -> str:
+        return channel
+
+    async def iter_messages(self, channel: str, limit: Optional[int] = None, min_id: int = 0, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(_lognormal(self._rng, self.latency, self.latency_sigma))
+        roll = self._rng.random()
+        if roll < self.error_rate:
+            self.errors += 1
+            raise ConnectionError(f"Fake Telegram error for {channel}")
+        if roll < self.error_rate + self.flood_wait_rate:
+            self.errors += 1
+            raise FloodWaitError(self.flood_wait_seconds)
+
+        count = 0
+        for message_id in range(self.messages_per_channel, min_id, -1):
+            if limit is not None and count >= limit:
+                break
+            count += 1
+            yield FakeMessage(
+                message_id,
+                self.corpus.message_text(channel, message_id),
+                self._epoch + timedelta(minutes=message_id),
+                views=100 + message_id,
+            )
+
+
+# Стадия конвейера по схеме структурированного вывода; вызовы без схемы - общая сводка
+SCHEMA_STAGES = {
+    SimpleAnalyzerOutput: "analyzer",
+    BatchAnalyzerOutput: "analyzer",
+    CategoryOutput: "classifier",
+    BatchCategoryOutput: "classifier",
+    AnalyzerClassifierOutput: "analyzer_classifier",
+    BatchAnalyzerClassifierOutput: "analyzer_classifier",
+    CategorySummary: "summarizer",
+}
+
+_ITEM_RE = re.compile(r"^\[(\d+)\] (.*?)(?=^\[\d+\] |\Z)", re.MULTILINE | re.DOTALL)
+_WORD_RE = re.compile(r"\w{5,}")
+
+# Слова, по которым фиктивная модель узнает категорию
+_CATEGORY_WORDS = {
+    category: {word.lower() for phrase in phrases for word in _WORD_RE.findall(phrase)}
+    for category, phrases in CATEGORY_PHRASES.items()
+}
+
+
+class FakeRateLimitError(Exception):
+    """Аналог ответа 429 от GigaChat с аргументами как у gigachat.exceptions.ResponseError"""
+
+    def __init__(self):
+        super().__init__("https://gigachat.fake/chat/completions", 429, b"Too Many Requests", {})
+
+
+def guess_category(text: str) -> str:
+    words = {word.lower() for word in _WORD_RE.findall(text)}
+    scores = {category: len(words & vocabulary) for category, vocabulary in _CATEGORY_WORDS.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] else "Общество"
+
+
+def _analysis(text: str) -> Dict[str, Any]:
+    words = _WORD_RE.findall(text.lower())
+    return {
+        "keywords": list(dict.fromkeys(words))[:5] or ["новость"],
+        "sentiment": "нейтральная",
+        "importance_score": round(min(1.0, len(words) / 40), 2),
+    }
+
+
+def _item_output(schema, text: str) -> Dict[str, Any]:
+    if schema in (SimpleAnalyzerOutput, BatchAnalyzerOutput):
+        return _analysis(text)
+    if schema in (CategoryOutput, BatchCategoryOutput):
+        return {"category": guess_category(text)}
+    return {**_analysis(text), "category": guess_category(text)}
+
+
+class FakeGigaChat(RunnableLambda):
+    """Заменитель GigaChat: структурированные ответы для всех промптов, задержки, ошибки и учет токенов"""
+
+    def __init__(
+            self,
+            latency: float = 0.3,
+            latency_sigma: float = 0.5,
+            error_rate: float = 0.0,
+            seed: int = 1,
+            schema=None,
+            usage: Optional[Dict[str, Dict[str, int]]] = None,
+    ):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.seed = seed
+        self.schema = schema
+        # Общий учет для всех моделей, полученных через with_structured_output
+        self.usage = usage if usage is not None else defaultdict(lambda: defaultdict(int))
+        self._rng = random.Random(seed)
+        super().__init__(self._invoke, afunc=self._ainvoke)
+
+    def with_structured_output(self, schema, **kwargs) -> "FakeGigaChat":
+        return FakeGigaChat(self.latency, self.latency_sigma, self.error_rate, self.seed, schema, self.usage)
+
+    def _respond(self, prompt: Any) -> Any:
+        text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+        stage = SCHEMA_STAGES.get(self.schema, "reporter")
+        usage = self.usage[stage]
+        usage["calls"] += 1
+        usage["prompt_tokens"] += estimate_tokens(text)
+
+        if self._rng.random() < self.error_rate:
+            usage["errors"] += 1
+            raise FakeRateLimitError()
+
+        output = self._build(text)
+        completion = output.model_dump_json() if isinstance(output, BaseModel) else output.content
+        usage["completion_tokens"] += estimate_tokens(completion)
+        return output
+
+    def _build(self, text: str) -> Any:
+        if self.schema is None:
+            return AIMessage(content="Главное за период: " + text[-300:])
+        if self.schema is CategorySummary:
+            return CategorySummary(category="", summary=text[-400:], news_count=text.count("\n\n") + 1)
+        if self.schema in (BatchAnalyzerOutput, BatchCategoryOutput, BatchAnalyzerClassifierOutput):
+            item_schema = self.schema.model_fields["items"].annotation.__args__[0]
+            return self.schema(items=[
+                item_schema(item_id=int(item_id), **_item_output(self.schema, item_text))
+                for item_id, item_text in _ITEM_RE.findall(text)
+            ])
+        return self.schema(**_item_output(self.schema, text))
+
+    def _invoke(self, prompt: Any) -> Any:
+        return self._respond(prompt)
+
+    async def _ainvoke(self, prompt: Any) -> Any:
+        await asyncio.sleep(_lognormal(self._rng, self.latency, self.latency_sigma))
+        return self._respond(prompt)
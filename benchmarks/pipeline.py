@@ -0,0 +1,265 @@
+"""
+Офлайн-замер полного конвейера process_news_channels на фиктивных Telegram и GigaChat.
+
+Запуск из корня проекта:
+    python -m benchmarks.pipeline
+    python -m benchmarks.pipeline --channels 2,5,10 --limits 10,30 --concurrency 1,4 --repeats 5
+    python -m benchmarks.pipeline --llm-rates 0,5
+    python -m benchmarks.pipeline --compare benchmarks/results/<прошлый замер>.json
+
+Каждая комбинация каналов x limit_per_channel x одновременных запросов выполняется в отдельном
+процессе с чистыми хранилищами. Печатаются p50/p95 времени дайджеста, вызовы LLM и токены
+по стадиям на один дайджест и пиковая память; результаты сохраняются в benchmarks/results/.
+Настройки конвейера (LLM_CONCURRENCY, LLM_BATCH_SIZE, PIPELINE_STREAMING и т.д.) берутся из окружения.
+Ограничение темпа запросов к GigaChat (LLM_RATE_PER_SECOND) при быстрой фиктивной модели
+определяет почти все время дайджеста, поэтому оно задается для каждой комбинации явно (--llm-rates)
+и печатается в результатах; по умолчанию ограничение выключено.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Фиктивные значения, чтобы модули импортировались без настоящего .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("GIGACHAT_API_KEY", "benchmark")
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(values: List[float], share: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+async def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Замер одной комбинации параметров внутри дочернего процесса"""
+    from agents import agent_graph
+    from benchmarks.fakes import SyntheticCorpus, FakeTelegramClient, FakeGigaChat
+    from utils.metrics import metrics
+
+    corpus = SyntheticCorpus(seed=case["seed"], repost_share=case["repost_share"])
+    client = FakeTelegramClient(
+        corpus,
+        latency=case["tg_latency"],
+        error_rate=case["tg_error_rate"],
+        flood_wait_rate=case["tg_flood_wait_rate"],
+        seed=case["seed"],
+    )
+    llm = FakeGigaChat(latency=case["llm_latency"], error_rate=case["llm_error_rate"], seed=case["seed"])
+
+    async def get_fake_client():
+        return client
+
+    agent_graph.get_client = get_fake_client
+    agent_graph.get_gigachat = lambda: llm
+    agent_graph.get_structured_chain.cache_clear()
+    agent_graph.get_text_chain.cache_clear()
+
+    async def digest(round_index: int, user: int) -> Optional[float]:
+        # Свои каналы у каждого запроса и раунда, чтобы не попадать в хранилище сообщений;
+        # с --shared-channels все запросы раунда читают одни и те же каналы
+        owner = "all" if case["shared_channels"] else user
+        channels = [f"@bench_{round_index}_{owner}_{index}" for index in range(case["channels"])]
+        started = time.perf_counter()
+        try:
+            report = await agent_graph.process_news_channels(channels, case["limit"])
+        except Exception:
+            return None
+        if report.title.startswith("Ошибка"):
+            return None
+        return (time.perf_counter() - started) * 1000
+
+    latencies = []
+    failures = 0
+    for round_index in range(case["repeats"]):
+        results = await asyncio.gather(*(digest(round_index, user) for user in range(case["concurrency"])))
+        latencies.extend(result for result in results if result is not None)
+        failures += sum(result is None for result in results)
+    usage = {stage: dict(counts) for stage, counts in llm.usage.items()}
+    counters = metrics.snapshot()
+
+    # Отдельный раунд под tracemalloc: он замедляет выполнение и не входит в замер времени
+    tracemalloc.start()
+    await asyncio.gather(*(digest(case["repeats"], user) for user in range(case["concurrency"])))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    digests = case["repeats"] * case["concurrency"]
+    return {
+        **{key: case[key] for key in ("channels", "limit", "concurrency", "llm_rate")},
+        "digests": digests,
+        "failures": failures,
+        "p50_ms": percentile(latencies, 0.5) if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) if latencies else None,
+        "mean_ms": statistics.mean(latencies) if latencies else None,
+        "llm": {
+            stage: {name: value / digests for name, value in counts.items()}
+            for stage, counts in sorted(usage.items())
+        },
+        "retries": sum(values.get("retries", 0) for values in counters.values()) / digests,
+        "batch_fallbacks": sum(values.get("batch_fallbacks", 0) for values in counters.values()) / digests,
+        "fallbacks": sum(values.get("fallbacks", 0) for values in counters.values()) / digests,
+        "telegram_calls": client.calls,
+        "peak_traced_mb": peak / 2 ** 20,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_child(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Запуск комбинации в чистом процессе со своими файлами хранилищ"""
+    with tempfile.TemporaryDirectory(prefix="newsbot-bench-") as directory:
+        env = {
+            **os.environ,
+            "MESSAGE_STORE_PATH": os.path.join(directory, "messages.db"),
+            "USER_STORE_PATH": os.path.join(directory, "users.db"),
+            "LLM_CACHE_PATH": os.path.join(directory, "llm_cache.db"),
+            "LOCAL_CLASSIFIER_PATH": os.path.join(directory, "local_classifier.db"),
+            "CHECKPOINTS_PATH": os.path.join(directory, "checkpoints.db"),
+            "LLM_RATE_PER_SECOND": str(case["llm_rate"]),
+            "PREFILTER_CHANNEL_RULES_PATH": "",
+            "LANGCHAIN_TRACING_V2": "false",
+        }
+        output = subprocess.run(
+            [sys.executable, "-W", "ignore", "-m", "benchmarks.pipeline", "--case", json.dumps(case)],
+            capture_output=True, text=True, env=env,
+        )
+        if output.returncode != 0:
+            raise RuntimeError(f"Benchmark case {case} failed:\n{output.stderr[-2000:]}")
+        return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def case_key(result: Dict[str, Any]) -> tuple:
+    return result["channels"], result["limit"], result["concurrency"], result.get("llm_rate")
+
+
+def format_ms(value: Optional[float]) -> str:
+    return "     -" if value is None else f"{value:6.0f}"
+
+
+def format_rate(value: float) -> str:
+    return "off" if not value else f"{value:g}"
+
+
+def print_results(results: List[Dict[str, Any]], previous: Optional[Dict[tuple, Dict[str, Any]]] = None) -> None:
+    print(f"{'channels':>8} {'limit':>5} {'conc':>4} {'rate/s':>6} {'p50 ms':>8} {'p95 ms':>8} {'fail':>4} "
+          f"{'calls':>6} {'tokens':>8} {'retry':>6} {'batchfb':>7} {'fallbk':>6} {'peak MB':>8}")
+    for result in results:
+        calls = sum(stage["calls"] for stage in result["llm"].values())
+        tokens = sum(stage["prompt_tokens"] + stage.get("completion_tokens", 0) for stage in result["llm"].values())
+        line = (f"{result['channels']:>8} {result['limit']:>5} {result['concurrency']:>4} "
+                f"{format_rate(result['llm_rate']):>6} "
+                f"{format_ms(result['p50_ms']):>8} {format_ms(result['p95_ms']):>8} {result['failures']:>4} "
+                f"{calls:>6.1f} {tokens:>8.0f} {result.get('retries', 0):>6.1f} "
+                f"{result.get('batch_fallbacks', 0):>7.1f} {result.get('fallbacks', 0):>6.1f} "
+                f"{result['peak_traced_mb']:>8.1f}")
+
+        before = (previous or {}).get(case_key(result))
+        if before and before["p50_ms"] and result["p50_ms"]:
+            before_calls = sum(stage["calls"] for stage in before["llm"].values())
+            line += (f"   p50 {(result['p50_ms'] / before['p50_ms'] - 1) * 100:+.0f}%"
+                     f", calls {calls - before_calls:+.1f}")
+        print(line)
+
+        for stage, counts in result["llm"].items():
+            print(f"{'':>35} {stage:<20} calls {counts['calls']:6.1f}  prompt {counts['prompt_tokens']:8.0f}"
+                  f"  completion {counts.get('completion_tokens', 0):7.0f}  errors {counts.get('errors', 0):4.1f}")
+
+
+def parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_floats(value: str) -> List[float]:
+    return [float(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the news pipeline")
+    parser.add_argument("--channels", type=parse_ints, default=[2, 5], help="Числа каналов через запятую")
+    parser.add_argument("--limits", type=parse_ints, default=[10, 20], help="Значения limit_per_channel")
+    parser.add_argument("--concurrency", type=parse_ints, default=[1, 4], help="Числа одновременных дайджестов")
+    parser.add_argument("--llm-rates", type=parse_floats, default=[0.0],
+                        help="Значения LLM_RATE_PER_SECOND через запятую, 0 - без ограничения")
+    parser.add_argument("--repeats", type=int, default=3, help="Раундов на комбинацию")
+    parser.add_argument("--shared-channels", action="store_true", help="Одновременные запросы читают одни каналы")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Медиана задержки GigaChat, с")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--tg-latency", type=float, default=0.1, help="Медиана задержки iter_messages, с")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0)
+    parser.add_argument("--tg-flood-wait-rate", type=float, default=0.0, help="Доля запросов с FloodWait на 1 с")
+    parser.add_argument("--repost-share", type=float, default=0.15, help="Доля перепостов между каналами")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", help="Файл прошлого замера для сравнения")
+    parser.add_argument("--output", default=RESULTS_DIR, help="Каталог для сохранения результатов")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(asyncio.run(run_case(json.loads(args.case)))))
+        return
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = {case_key(result): result for result in json.load(f)["results"]}
+
+    settings = {
+        "repeats": args.repeats,
+        "shared_channels": args.shared_channels,
+        "llm_latency": args.llm_latency,
+        "llm_error_rate": args.llm_error_rate,
+        "tg_latency": args.tg_latency,
+        "tg_error_rate": args.tg_error_rate,
+        "tg_flood_wait_rate": args.tg_flood_wait_rate,
+        "repost_share": args.repost_share,
+        "seed": args.seed,
+    }
+    results = []
+    cases = itertools.product(args.channels, args.limits, args.concurrency, args.llm_rates)
+    for channels, limit, concurrency, llm_rate in cases:
+        print(f"Running channels={channels} limit={limit} concurrency={concurrency} llm_rate={llm_rate:g}...", file=sys.stderr)
+        results.append(run_child({
+            **settings, "channels": channels, "limit": limit, "concurrency": concurrency, "llm_rate": llm_rate,
+        }))
+
+    print_results(results, previous)
+
+    os.makedirs(args.output, exist_ok=True)
+    commit = git_commit()
+    path = os.path.join(args.output, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    # Настройки конвейера из окружения, влияющие на результат
+    environment = {
+        key: value for key, value in os.environ.items()
+        if key.startswith(("LLM_", "PIPELINE_", "FUSED_", "DEDUP_", "PREFILTER_", "SUMMARIZER_", "COLLECTOR_", "LOCAL_CLASSIFIER_"))
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"commit": commit, "date": datetime.now().isoformat(), "settings": settings,
+                   "environment": environment, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Замер времени запуска бота и накладных расходов конвейера на один запрос.
+
+Запуск из корня проекта:
+    python -m benchmarks.startup
+
+Сеть не используется: GigaChat и Telethon только создаются, но не вызываются.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Фиктивные значения, чтобы модули импортировались без настоящего .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("GIGACHAT_API_KEY", "benchmark")
+
+REPEATS = 5
+
+
+def measure_import(module: str) -> float:
+    """Время импорта модуля в чистом интерпретаторе, в секундах"""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - t)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", code],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def median_ms(func, repeats: int = REPEATS) -> float:
+    """Медиана времени выполнения функции, в миллисекундах"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    print("Startup")
+    for module in ["main", "agents.agent_graph"]:
+        timings = [measure_import(module) for _ in range(REPEATS)]
+        print(f"  import {module:<22} {statistics.median(timings) * 1000:8.1f} ms")
+
+    from agents import agent_graph
+
+    print("Per-request pipeline overhead")
+    first_start = time.perf_counter()
+    agent_graph.build_pipeline()
+    print(f"  first build_pipeline()        {(time.perf_counter() - first_start) * 1000:8.1f} ms")
+
+    def rebuild():
+        # Так конвейер собирался на каждый запрос до кэширования графа и цепочек
+        agent_graph.create_agent_graph()
+        for template, schema, batch_template, batch_schema in agent_graph.ITEM_STAGES.values():
+            agent_graph.get_structured_chain.__wrapped__(template, schema)
+            agent_graph.get_structured_chain.__wrapped__(batch_template, batch_schema)
+
+    print(f"  rebuild graph and chains      {median_ms(rebuild):8.1f} ms")
+    print(f"  cached get_agent_graph()      {median_ms(agent_graph.get_agent_graph) * 1000:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
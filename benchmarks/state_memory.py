@@ -0,0 +1,175 @@
+"""
+Замер памяти, которую занимает состояние конвейера, в байтах на новость.
+
+Запуск из корня проекта:
+    python -m benchmarks.state_memory
+    python -m benchmarks.state_memory --news 100,1000,10000
+
+Сравниваются прежняя вложенная раскладка состояния (копии News внутри AnalyzerOutput,
+ClassifierOutput и ReportCategory) и текущая: новости по ключу, записи анализа со ссылкой
+на ключ и Report, собранный на выходе. Считается память всех объектов, которые состояние
+удерживает после reporter, включая сами новости; сеть и модель не используются.
+"""
+import argparse
+import gc
+import os
+import random
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+# Фиктивные значения, чтобы модули импортировались без настоящего .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("TELEGRAM_API_ID", "1")
+os.environ.setdefault("TELEGRAM_API_HASH", "benchmark")
+os.environ.setdefault("GIGACHAT_API_KEY", "benchmark")
+
+from agents.agent_graph import group_by_category
+from benchmarks.fakes import SyntheticCorpus, CATEGORY_PHRASES
+from models.records import NewsAnalysis, index_news, materialize_categories
+from models.schemas import News, AnalyzerOutput, ClassifierOutput, CategorySummary, ReportCategory, Report
+
+SENTIMENTS = ["позитивная", "нейтральная", "негативная"]
+
+
+def make_items(count: int, channels: int, seed: int) -> List[Dict[str, Any]]:
+    """Сообщения в том виде, в каком их отдает хранилище, и ответы модели по ним"""
+    corpus = SyntheticCorpus(seed=seed)
+    rng = random.Random(seed)
+    categories = list(CATEGORY_PHRASES)
+    items = []
+    for index in range(count):
+        channel = f"@bench_{index % channels}"
+        message_id = index // channels + 1
+        text = corpus.message_text(channel, message_id)
+        items.append({
+            "payload": {
+                "id": str(message_id),
+                "channel": channel,
+                "text": text,
+                "date": str(datetime(2025, 1, 1)),
+                "views": rng.randint(100, 10000),
+            },
+            "keywords": text.split()[:6],
+            "sentiment": rng.choice(SENTIMENTS),
+            "importance_score": round(rng.random(), 2),
+            "category": rng.choice(categories),
+        })
+    return items
+
+
+def make_report(report_categories: List[ReportCategory]) -> Report:
+    return Report(
+        id="benchmark",
+        title="Дайджест новостей",
+        date=datetime(2025, 1, 1),
+        period="день",
+        categories=report_categories,
+        overall_summary="Общая сводка",
+    )
+
+
+def nested_state(items: List[Dict[str, Any]], streaming: bool) -> Dict[str, Any]:
+    """Прежняя раскладка: каждая стадия хранит pydantic-модели с новостью внутри"""
+    collected_news = [News(**item["payload"]) for item in items]
+    if not streaming:
+        # Дедупликация копировала каждую новость, чтобы прикрепить источники дубликатов
+        collected_news = [news.model_copy(update={"duplicates": list(news.duplicates)}) for news in collected_news]
+
+    analyzed_news = [
+        AnalyzerOutput(
+            keywords=item["keywords"],
+            sentiment=item["sentiment"],
+            importance_score=item["importance_score"],
+            news=news,
+        )
+        for item, news in zip(items, collected_news)
+    ]
+    if streaming:
+        # Потоковый режим копировал и новость, и ее анализ
+        collected_news = [news.model_copy(update={"duplicates": []}) for news in collected_news]
+        analyzed_news = [
+            analysis.model_copy(update={"news": news}) for analysis, news in zip(analyzed_news, collected_news)
+        ]
+
+    categorized_news: Dict[str, List[ClassifierOutput]] = {}
+    for item, analysis in zip(items, analyzed_news):
+        categorized_news.setdefault(item["category"], []).append(
+            ClassifierOutput(category=item["category"], analysis=analysis)
+        )
+
+    report = make_report([
+        ReportCategory(
+            category=category,
+            summary=f"Новости категории {category}",
+            news_count=len(news_list),
+            news=[entry.analysis.news for entry in news_list],
+        )
+        for category, news_list in categorized_news.items()
+    ])
+    return {
+        "collected_news": collected_news,
+        "analyzed_news": analyzed_news,
+        "categorized_news": categorized_news,
+        "report": report,
+    }
+
+
+def compact_state(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Текущая раскладка: новости по ключу, записи со ссылками на ключ"""
+    news, collected_news = index_news([News(**item["payload"]) for item in items])
+    analyzed_news = {
+        key: NewsAnalysis.create(key, item["keywords"], item["sentiment"], item["importance_score"])
+        for key, item in zip(collected_news, items)
+    }
+    categorized_news = group_by_category(collected_news, [item["category"] for item in items])
+
+    summaries = [
+        CategorySummary(category=category, summary=f"Новости категории {category}", news_count=len(keys))
+        for category, keys in categorized_news.items()
+    ]
+    report = make_report(materialize_categories(summaries, categorized_news, news))
+    return {
+        "news": news,
+        "collected_news": collected_news,
+        "analyzed_news": analyzed_news,
+        "categorized_news": categorized_news,
+        "report": report,
+    }
+
+
+def retained_bytes(build: Callable[[], Dict[str, Any]]) -> int:
+    """Память объектов, которые удерживает построенное состояние"""
+    gc.collect()
+    tracemalloc.start()
+    state = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del state
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory footprint of the pipeline state per news item")
+    parser.add_argument("--news", default="100,1000,10000", help="Числа новостей через запятую")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    layouts = {
+        "nested (graph)": lambda items: nested_state(items, streaming=False),
+        "nested (streaming)": lambda items: nested_state(items, streaming=True),
+        "compact": compact_state,
+    }
+
+    print(f"{'news':>7} " + " ".join(f"{name:>20}" for name in layouts) + f" {'saved':>7}")
+    for count in [int(value) for value in args.news.split(",") if value]:
+        items = make_items(count, args.channels, args.seed)
+        per_news = {name: retained_bytes(lambda: build(items)) / count for name, build in layouts.items()}
+        saved = 1 - per_news["compact"] / per_news["nested (graph)"]
+        print(f"{count:>7} " + " ".join(f"{per_news[name]:>17.0f} B" for name in layouts) + f" {saved:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения из .env
@@ -18,6 +19,8 @@ TELEGRAM = {
     "API_ID": os.getenv("TELEGRAM_API_ID"),
     "API_HASH": os.getenv("TELEGRAM_API_HASH"),
     "PHONE": os.getenv("TELEGRAM_PHONE"),
+    # Файл сессии Telethon; каждому процессу-обработчику очереди нужна своя копия
+    "SESSION_NAME": os.getenv("TELEGRAM_SESSION_NAME", "newsbot_session"),
 }
 
 # LangSmith / LangChain Tracing
@@ -29,4 +32,176 @@ LANGSMITH = {
 
 # Project Defaults
 DEFAULT_LIMIT_PER_CHANNEL = int(os.getenv("DEFAULT_LIMIT_PER_CHANNEL", 10))
-MAX_CHANNELS_PER_USER = int(os.getenv("MAX_CHANNELS_PER_USER", 20))
\ No newline at end of file
+MAX_CHANNELS_PER_USER = int(os.getenv("MAX_CHANNELS_PER_USER", 20))
+
+# Storage Settings
+MESSAGE_STORE_PATH = os.getenv("MESSAGE_STORE_PATH", "data/messages.db")
+# Сколько последних сообщений каждого канала хранить; более старые удаляются при сохранении новых
+MESSAGE_STORE_MAX_PER_CHANNEL = int(os.getenv("MESSAGE_STORE_MAX_PER_CHANNEL", 500))
+USER_STORE_PATH = os.getenv("USER_STORE_PATH", "data/users.db")
+
+# LLM Cache Settings
+LLM_CACHE = {
+    "ENABLED": os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "PATH": os.getenv("LLM_CACHE_PATH", "data/llm_cache.db"),
+    "MAX_SIZE": int(os.getenv("LLM_CACHE_MAX_SIZE", 10000)),  # Записей в LRU-кэше в памяти
+    "TTL_SECONDS": int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+    "MAX_ROWS": int(os.getenv("LLM_CACHE_MAX_ROWS", 200000)),  # Записей в SQLite; сверх лимита удаляются самые старые
+    "PURGE_INTERVAL_SECONDS": int(os.getenv("LLM_CACHE_PURGE_INTERVAL_SECONDS", 3600)),
+}
+
+# Pipeline Settings
+PIPELINE = {
+    # Анализ и классификация одним вызовом модели вместо двух узлов analyzer -> classifier
+    "FUSED_ANALYZE_CLASSIFY": os.getenv("FUSED_ANALYZE_CLASSIFY", "false").lower() in ("true", "1", "yes"),
+    # Сколько новостей упаковывается в один вызов модели на поэлементных стадиях (1 - без пакетов)
+    "BATCH_SIZE": int(os.getenv("LLM_BATCH_SIZE", 1)),
+    # Ограничение на суммарный размер текстов новостей в одном пакете, в токенах
+    "BATCH_TOKEN_BUDGET": int(os.getenv("LLM_BATCH_TOKEN_BUDGET", 3000)),
+    # Потоковый режим: новости канала анализируются сразу после его загрузки, без ожидания остальных каналов
+    "STREAMING": os.getenv("PIPELINE_STREAMING", "false").lower() in ("true", "1", "yes"),
+}
+
+# Startup Settings
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() in ("true", "1", "yes")  # Собирать граф и цепочки в фоне сразу после запуска
+
+# Progressive Delivery Settings
+PROGRESS = {
+    "EDIT_INTERVAL_SECONDS": float(os.getenv("PROGRESS_EDIT_INTERVAL_SECONDS", 2)),  # Не чаще одного редактирования прогресса
+    "MESSAGE_INTERVAL_SECONDS": float(os.getenv("PROGRESS_MESSAGE_INTERVAL_SECONDS", 1)),  # Пауза между сводками категорий
+}
+
+# Digest Job Queue Settings (дайджесты собирают отдельные процессы: python worker.py)
+JOB_QUEUE = {
+    "ENABLED": os.getenv("JOB_QUEUE_ENABLED", "false").lower() in ("true", "1", "yes"),
+    "PATH": os.getenv("JOB_QUEUE_PATH", "data/jobs.db"),
+    "VISIBILITY_TIMEOUT_SECONDS": int(os.getenv("JOB_VISIBILITY_TIMEOUT_SECONDS", 120)),  # Аренда задания обработчиком
+    "HEARTBEAT_SECONDS": int(os.getenv("JOB_HEARTBEAT_SECONDS", 30)),  # Как часто обработчик продлевает аренду
+    "MAX_ATTEMPTS": int(os.getenv("JOB_MAX_ATTEMPTS", 3)),
+    "RETRY_DELAY_SECONDS": int(os.getenv("JOB_RETRY_DELAY_SECONDS", 10)),
+    "POLL_SECONDS": float(os.getenv("JOB_POLL_SECONDS", 1)),  # Пауза опроса пустой очереди
+    "WORKER_CONCURRENCY": int(os.getenv("JOB_WORKER_CONCURRENCY", 2)),  # Дайджестов одновременно в одном обработчике
+    "FAILED_TTL_SECONDS": int(os.getenv("JOB_FAILED_TTL_SECONDS", 7 * 24 * 3600)),  # Сколько хранятся задания с ошибкой
+    "PURGE_INTERVAL_SECONDS": int(os.getenv("JOB_PURGE_INTERVAL_SECONDS", 3600)),
+}
+
+# LLM Settings
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 8))  # Максимум одновременных запросов к GigaChat во всем процессе
+
+# GigaChat Request Scheduler Settings
+LLM_SCHEDULER = {
+    "RATE_PER_SECOND": float(os.getenv("LLM_RATE_PER_SECOND", 5)),  # Темп запросов под квоту API, 0 - без ограничения
+    "BURST": int(os.getenv("LLM_RATE_BURST", 10)),  # Сколько запросов можно отправить залпом после простоя
+    "MIN_CONCURRENCY": int(os.getenv("LLM_MIN_CONCURRENCY", 1)),
+    "MAX_CONCURRENCY": LLM_CONCURRENCY,
+    # Ответ дольше цели или 429 уменьшает число одновременных запросов в DECREASE_FACTOR раз
+    "LATENCY_TARGET_SECONDS": float(os.getenv("LLM_LATENCY_TARGET_SECONDS", 20)),
+    "DECREASE_FACTOR": float(os.getenv("LLM_DECREASE_FACTOR", 0.5)),
+    "MAX_RETRIES": int(os.getenv("LLM_MAX_RETRIES", 4)),
+    "BACKOFF_BASE_SECONDS": float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 1)),
+    "BACKOFF_MAX_SECONDS": float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 30)),
+}
+
+# Pre-Filter Settings (каждое правило можно переопределить для канала в CHANNEL_RULES_PATH)
+PREFILTER = {
+    "ENABLED": os.getenv("PREFILTER_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "CHANNEL_RULES_PATH": os.getenv("PREFILTER_CHANNEL_RULES_PATH", "config/prefilter.json"),
+    "MIN_WORDS": int(os.getenv("PREFILTER_MIN_WORDS", 3)),  # Минимальное число слов без ссылок: отсекаются только заглушки
+    "MAX_LINK_DENSITY": float(os.getenv("PREFILTER_MAX_LINK_DENSITY", 0.5)),  # Максимальная доля текста, занятая ссылками
+    "MIN_LETTER_RATIO": float(os.getenv("PREFILTER_MIN_LETTER_RATIO", 0.5)),  # Минимальная доля букв среди видимых символов
+    "BOILERPLATE_MIN_SHARE": float(os.getenv("PREFILTER_BOILERPLATE_MIN_SHARE", 0.5)),  # Доля сообщений с повторяющейся строкой
+    "DROP_FORWARDS": os.getenv("PREFILTER_DROP_FORWARDS", "false").lower() in ("true", "1", "yes"),
+    "DROP_PINNED": os.getenv("PREFILTER_DROP_PINNED", "false").lower() in ("true", "1", "yes"),
+    # Явные признаки рекламы: совпадение целым словом или хэштегом отсеивает сообщение
+    "AD_MARKERS": ["#реклама", "#ad", "#партнерский", "erid", "на правах рекламы"],
+    # Слабые признаки розыгрышей и рекламы (начало слова): два разных признака отсеивают сообщение,
+    # один только понижает важность новости, например "розыгрыш Кубка России"
+    "WEAK_AD_MARKERS": ["розыгрыш", "разыгрываем", "промокод", "подпишитесь", "условия участия", "giveaway"],
+    "DOWNRANK_FACTOR": float(os.getenv("PREFILTER_DOWNRANK_FACTOR", 0.5)),  # Множитель важности новости со слабым признаком
+}
+
+# Near-Duplicate Detection Settings
+DEDUP = {
+    "ENABLED": os.getenv("DEDUP_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "THRESHOLD": float(os.getenv("DEDUP_THRESHOLD", 0.6)),  # Минимальная оценка сходства Жаккара для дубликатов
+    "SHINGLE_SIZE": int(os.getenv("DEDUP_SHINGLE_SIZE", 3)),  # Длина шингла в словах
+    "NUM_PERM": int(os.getenv("DEDUP_NUM_PERM", 64)),  # Длина MinHash-сигнатуры
+    "BANDS": int(os.getenv("DEDUP_BANDS", 16)),  # Число полос LSH, должно делить NUM_PERM
+}
+
+# Local Category Classifier Settings (обучается на категориях, полученных от GigaChat)
+LOCAL_CLASSIFIER = {
+    "ENABLED": os.getenv("LOCAL_CLASSIFIER_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "PATH": os.getenv("LOCAL_CLASSIFIER_PATH", "data/local_classifier.db"),
+    "CONFIDENCE_THRESHOLD": float(os.getenv("LOCAL_CLASSIFIER_CONFIDENCE_THRESHOLD", 0.8)),  # Ниже порога новость уходит в LLM
+    "MIN_TRAIN_SIZE": int(os.getenv("LOCAL_CLASSIFIER_MIN_TRAIN_SIZE", 500)),  # Примеров для первого обучения
+    "RETRAIN_EVERY": int(os.getenv("LOCAL_CLASSIFIER_RETRAIN_EVERY", 200)),  # Новых примеров для переобучения
+    "MIN_AGREEMENT": float(os.getenv("LOCAL_CLASSIFIER_MIN_AGREEMENT", 0.9)),  # Согласие с LLM на отложенной выборке для включения модели
+    "HOLDOUT_SHARE": float(os.getenv("LOCAL_CLASSIFIER_HOLDOUT_SHARE", 0.2)),
+    "SHADOW_RATE": float(os.getenv("LOCAL_CLASSIFIER_SHADOW_RATE", 0.05)),  # Доля уверенных ответов, проверяемых через LLM
+    "HASH_DIMS": int(os.getenv("LOCAL_CLASSIFIER_HASH_DIMS", 1 << 17)),  # Число хэшированных признаков
+    "EPOCHS": int(os.getenv("LOCAL_CLASSIFIER_EPOCHS", 100)),
+}
+
+# Summarizer Settings
+SUMMARIZER = {
+    "CHUNK_TOKENS": int(os.getenv("SUMMARIZER_CHUNK_TOKENS", 4000)),  # Размер куска новостей на один вызов модели
+    "MAX_FANOUT": int(os.getenv("SUMMARIZER_MAX_FANOUT", 8)),  # Сколько частичных сводок объединяется за один вызов
+}
+
+# Story Clustering Settings (новости категории группируются по сюжетам перед суммаризацией)
+STORY_CLUSTERING = {
+    "ENABLED": os.getenv("STORY_CLUSTERING_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "THRESHOLD": float(os.getenv("STORY_CLUSTERING_THRESHOLD", 0.4)),  # Минимальное косинусное сходство новостей одного сюжета
+    "DIMS": int(os.getenv("STORY_CLUSTERING_DIMS", 1024)),  # Размерность хэшированных TF-IDF векторов
+    "REPRESENTATIVE_TOKENS": int(os.getenv("STORY_CLUSTERING_REPRESENTATIVE_TOKENS", 200)),  # Длина представителя сюжета в промпте
+}
+
+# Metrics Settings
+METRICS = {
+    "HTTP_PORT": int(os.getenv("METRICS_HTTP_PORT", 0)),  # Порт эндпоинта /metrics в формате Prometheus, 0 - не запускать
+    "HTTP_HOST": os.getenv("METRICS_HTTP_HOST", "127.0.0.1"),
+}
+# Telegram id пользователей, которым доступна команда /metrics
+ADMIN_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Collector Settings
+COLLECTOR_CONCURRENCY = int(os.getenv("COLLECTOR_CONCURRENCY", 5))  # Сколько каналов опрашивается одновременно
+
+# Telegram Fetch Scheduler Settings (общие для всех пользователей одной сессии Telethon)
+TELEGRAM_FETCH = {
+    "MIN_INTERVAL_SECONDS": float(os.getenv("TELEGRAM_MIN_INTERVAL_SECONDS", 0.3)),  # Минимальный интервал между запросами
+    "CONCURRENCY": int(os.getenv("TELEGRAM_CONCURRENCY", 3)),  # Сколько запросов выполняется одновременно
+    "MAX_FLOOD_WAIT_SECONDS": int(os.getenv("TELEGRAM_MAX_FLOOD_WAIT_SECONDS", 60)),  # Дольше не ждем, берем сохраненные сообщения
+    "MAX_RETRIES": int(os.getenv("TELEGRAM_MAX_RETRIES", 2)),
+    "ENTITY_TTL_SECONDS": int(os.getenv("TELEGRAM_ENTITY_TTL_SECONDS", 24 * 3600)),  # Кэш разрешения username канала
+    "ENTITY_ERROR_TTL_SECONDS": int(os.getenv("TELEGRAM_ENTITY_ERROR_TTL_SECONDS", 600)),  # Кэш ошибки разрешения
+    "FRESHNESS_SECONDS": int(os.getenv("TELEGRAM_FRESHNESS_SECONDS", 30)),  # Только что обновленный канал не запрашиваем повторно
+}
+
+# Checkpoint Settings (состояние запусков графа для возобновления после сбоя)
+CHECKPOINTS = {
+    "ENABLED": os.getenv("CHECKPOINTS_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "PATH": os.getenv("CHECKPOINTS_PATH", "data/checkpoints.db"),
+    "TTL_SECONDS": int(os.getenv("CHECKPOINTS_TTL_SECONDS", 24 * 3600)),  # Сколько хранится состояние незавершенного запуска
+    "RESUME_WINDOW_SECONDS": int(os.getenv("CHECKPOINTS_RESUME_WINDOW_SECONDS", 600)),  # Более старый запуск начинается заново
+    "GC_INTERVAL_SECONDS": int(os.getenv("CHECKPOINTS_GC_INTERVAL_SECONDS", 3600)),
+}
+
+# Digest Cache Settings (готовые дайджесты по набору каналов и последним id сообщений)
+DIGEST_CACHE = {
+    "ENABLED": os.getenv("DIGEST_CACHE_ENABLED", "true").lower() in ("true", "1", "yes"),
+    "MAX_SIZE": int(os.getenv("DIGEST_CACHE_MAX_SIZE", 256)),
+    "TTL_SECONDS": int(os.getenv("DIGEST_CACHE_TTL_SECONDS", 3600)),
+}
+
+# Background Refresh Settings
+REFRESHER = {
+    "ENABLED": os.getenv("REFRESHER_ENABLED", "false").lower() in ("true", "1", "yes"),
+    "INTERVAL_SECONDS": int(os.getenv("REFRESH_INTERVAL_SECONDS", 900)),
+    # Индивидуальные интервалы для каналов, например {"@channel": 300}
+    "CHANNEL_INTERVALS": json.loads(os.getenv("REFRESH_CHANNEL_INTERVALS", "{}")),
+    "JITTER": float(os.getenv("REFRESH_JITTER", 0.1)),  # Доля случайного разброса интервала
+    "CONCURRENCY": int(os.getenv("REFRESH_CONCURRENCY", 2)),  # Сколько каналов обновляется одновременно
+    "POLL_SECONDS": int(os.getenv("REFRESH_POLL_SECONDS", 30)),  # Как часто проверять новые подписки
+}
@@ -1,5 +1,3 @@
-import os
-import json
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import (
@@ -12,13 +10,26 @@ from aiogram.types import (
 )
 from dotenv import load_dotenv
 import asyncio
+import importlib
 import logging
+from typing import Optional
 
-from agents.agent_graph import process_news_channels
-from utils.helpers import (
-    format_report_for_telegram
+from utils.progress import ProgressMessage, send_digest_events
+from utils.metrics import metrics
+from utils.telegram_client import close_client
+from utils.checkpoints import close_checkpoints
+from utils.user_store import UserStore, get_user_store, ChannelAlreadyAdded, ChannelLimitReached
+from utils.job_queue import JobQueue, get_job_queue
+from config.settings import (
+    TELEGRAM,
+    WARMUP_ON_START,
+    REFRESHER,
+    PROGRESS,
+    MAX_CHANNELS_PER_USER,
+    METRICS,
+    ADMIN_IDS,
+    JOB_QUEUE,
 )
-from config.settings import TELEGRAM
 
 load_dotenv()
 
@@ -28,46 +39,35 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=TELEGRAM['BOT_TOKEN'])
 dp = Dispatcher()
 
-user_channels = dict()
+# Хранилища открываются в main(): импорт модуля не должен создавать файлы баз данных
+user_store: Optional[UserStore] = None
+job_queue: Optional[JobQueue] = None
 
 main_kb = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="📰 Получить сводку последних новостей")],
+        [KeyboardButton(text="🆕 Новое с прошлой сводки")],
         [KeyboardButton(text="ℹ️ Помощь"), KeyboardButton(text="📋 Список каналов")],
         [KeyboardButton(text="➕ Добавить канал"), KeyboardButton(text="❌ Удалить канал")],
     ],
     resize_keyboard=True
 )
 
-# Вспомогательные функции
-# TODO: перенести их в helpers и сделать нормальную логику обработки
-def save_user_channels():
-    try:
-        os.makedirs("data", exist_ok=True)
-        with open("data/user_channels.json", "w", encoding="utf-8") as f:
-            json.dump(user_channels, f)
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении списка каналов: {e}")
-
-def load_user_channels():
-    global user_channels
-    try:
-        if os.path.exists("data/user_channels.json"):
-            with open("data/user_channels.json", "r", encoding="utf-8") as f:
-                user_channels = json.load(f)
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке списка каналов: {e}")
-
-
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
-    load_user_channels()
     await message.answer(
         "👋 Привет! Я бот для агрегации новостей из Telegram-каналов.\n"
         "Пользуйся кнопками для управления.",
         reply_markup=main_kb
     )
 
+@dp.message(Command("metrics"))
+async def cmd_metrics(message: Message):
+    # Метрики производительности видят только администраторы
+    if str(message.from_user.id) not in ADMIN_IDS:
+        return
+    await message.answer(metrics.render_summary())
+
 @dp.message(lambda m: m.text == "ℹ️ Помощь")
 async def help_handler(message: Message):
     await message.answer(
@@ -76,6 +76,7 @@ async def help_handler(message: Message):
         "➕ Добавить канал - добавить канал для сбора новостей\n"
         "❌ Удалить канал - удалить канал из списка\n"
         "📰 Получить сводку последних новостей - собрать и проанализировать новости\n"
+        "🆕 Новое с прошлой сводки - сводка только по сообщениям, вышедшим после прошлой сводки\n"
         "ℹ️ Помощь - это сообщение",
         parse_mode="Markdown"
     )
@@ -96,20 +97,24 @@ async def add_channel_handler(message: Message):
         channel = "@" + channel
 
     user_id = str(message.from_user.id)
-    if user_id not in user_channels:
-        user_channels[user_id] = []
-    if channel in user_channels[user_id]:
+    try:
+        await asyncio.to_thread(user_store.add_channel, user_id, channel)
+    except ChannelAlreadyAdded:
         await message.answer(f"❌ Канал {channel} уже добавлен.", reply_markup=main_kb)
         return
+    except ChannelLimitReached:
+        await message.answer(
+            f"❌ Нельзя добавить больше {MAX_CHANNELS_PER_USER} каналов. Удалите ненужные каналы.",
+            reply_markup=main_kb
+        )
+        return
 
-    user_channels[user_id].append(channel)
-    save_user_channels()
     await message.answer(f"✅ Канал {channel} добавлен в список.", reply_markup=main_kb)
 
 @dp.message(lambda m: m.text == "📋 Список каналов")
 async def list_channels(message: Message):
     user_id = str(message.from_user.id)
-    channels = user_channels.get(user_id, [])
+    channels = await asyncio.to_thread(user_store.get_channels, user_id)
     if not channels:
         await message.answer("У вас нет добавленных каналов.", reply_markup=main_kb)
         return
@@ -119,7 +124,7 @@ async def list_channels(message: Message):
 @dp.message(lambda m: m.text == "❌ Удалить канал")
 async def remove_channel_prompt(message: Message):
     user_id = str(message.from_user.id)
-    channels = user_channels.get(user_id, [])
+    channels = await asyncio.to_thread(user_store.get_channels, user_id)
     if not channels:
         await message.answer("У вас нет добавленных каналов.", reply_markup=main_kb)
         return
@@ -135,11 +140,8 @@ async def remove_channel_prompt(message: Message):
 async def remove_channel_handler(callback: CallbackQuery):
     user_id = str(callback.from_user.id)
     index = int(callback.data.split("_")[1])
-    channels = user_channels.get(user_id, [])
-    if 0 <= index < len(channels):
-        removed = channels.pop(index)
-        user_channels[user_id] = channels
-        save_user_channels()
+    removed = await asyncio.to_thread(user_store.remove_channel, user_id, index)
+    if removed is not None:
         await callback.message.edit_text(f"Канал {removed} удалён.")
         await callback.message.answer("Выберите действие:", reply_markup=main_kb)
     else:
@@ -147,27 +149,121 @@ async def remove_channel_handler(callback: CallbackQuery):
 
 @dp.message(lambda m: m.text == "📰 Получить сводку последних новостей")
 async def get_news(message: Message):
+    await send_digest(message)
+
+@dp.message(lambda m: m.text == "🆕 Новое с прошлой сводки")
+async def get_news_since_last_digest(message: Message):
+    await send_digest(message, since_last_digest=True)
+
+async def send_digest(message: Message, since_last_digest: bool = False):
     user_id = str(message.from_user.id)
-    channels = user_channels.get(user_id, [])
+    channels = await asyncio.to_thread(user_store.get_channels, user_id)
     if not channels:
         await message.answer("У вас нет добавленных каналов.", reply_markup=main_kb)
         return
 
+    if JOB_QUEUE["ENABLED"]:
+        await enqueue_digest(message, user_id, channels, since_last_digest)
+        return
+
     processing_msg = await message.answer("⏳ Обработка каналов, пожалуйста, подождите...")
+    progress = ProgressMessage(processing_msg, PROGRESS["EDIT_INTERVAL_SECONDS"])
 
     try:
-        report = await process_news_channels(channels)
-        formatted = format_report_for_telegram(report)
-        await bot.send_message(message.chat.id, formatted, parse_mode="Markdown")
+        # Конвейер импортируется лениво: langchain, langgraph и telethon не замедляют запуск бота
+        from agents.agent_graph import stream_news_channels
+
+        events = stream_news_channels(channels, user_id=user_id, since_last_digest=since_last_digest)
+        await send_digest_events(bot, message.chat.id, events, progress, PROGRESS["MESSAGE_INTERVAL_SECONDS"])
     except Exception as e:
         logger.error(f"Ошибка при получении новостей: {e}")
         await message.answer("Произошла ошибка при получении новостей.", reply_markup=main_kb)
     finally:
         await processing_msg.delete()
 
+async def enqueue_digest(message: Message, user_id: str, channels: list, since_last_digest: bool):
+    """Постановка дайджеста в очередь: его соберет и отправит процесс-обработчик (worker.py)"""
+    processing_msg = await message.answer("⏳ Сводка поставлена в очередь, пожалуйста, подождите...")
+    try:
+        _, created = await asyncio.to_thread(
+            job_queue.enqueue,
+            user_id,
+            message.chat.id,
+            channels,
+            since_last_digest=since_last_digest,
+            progress_message_id=processing_msg.message_id,
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при постановке сводки в очередь: {e}")
+        await processing_msg.edit_text("Произошла ошибка при получении новостей.")
+        return
+
+    if not created:
+        # Такая сводка уже готовится: ход ее сборки показывает сообщение первого запроса
+        try:
+            await processing_msg.delete()
+        except Exception as e:
+            logger.warning(f"Не удалось удалить сообщение о прогрессе: {e}")
+
+async def warm_up_pipeline():
+    """Фоновая загрузка и сборка конвейера, пока бот уже отвечает на команды"""
+    try:
+        # Модуль тянет за собой langchain, langgraph и telethon, поэтому импортируем его вне цикла событий
+        agent_graph = await asyncio.to_thread(importlib.import_module, "agents.agent_graph")
+        await agent_graph.warm_up()
+        logger.info("Pipeline warmed up")
+    except Exception as e:
+        logger.error(f"Ошибка при прогреве конвейера: {e}")
+
+async def run_channel_refresher():
+    """Фоновое обновление и предварительный анализ каналов из подписок"""
+    # Модуль тянет за собой весь конвейер, поэтому импортируем его вне цикла событий
+    refresher = await asyncio.to_thread(importlib.import_module, "agents.refresher")
+    await refresher.ChannelRefresher(user_store.subscriber_counts).run()
+
+async def run_metrics_server():
+    """HTTP-эндпоинт /metrics в текстовом формате Prometheus"""
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=metrics.render_prometheus().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS["HTTP_HOST"], METRICS["HTTP_PORT"]).start()
+        logger.info(f"Metrics endpoint listening on {METRICS['HTTP_HOST']}:{METRICS['HTTP_PORT']}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def main():
-    load_user_channels()
-    await dp.start_polling(bot)
+    global user_store, job_queue
+    user_store = await asyncio.to_thread(get_user_store)
+    if JOB_QUEUE["ENABLED"]:
+        job_queue = await asyncio.to_thread(get_job_queue)
+
+    # Храним ссылки на фоновые задачи, чтобы их не удалил сборщик мусора
+    background_tasks = []
+    # В режиме очереди конвейер и фоновое обновление каналов работают только в процессах-обработчиках
+    if WARMUP_ON_START and not JOB_QUEUE["ENABLED"]:
+        background_tasks.append(asyncio.create_task(warm_up_pipeline()))
+    if REFRESHER["ENABLED"] and not JOB_QUEUE["ENABLED"]:
+        background_tasks.append(asyncio.create_task(run_channel_refresher()))
+    if METRICS["HTTP_PORT"]:
+        background_tasks.append(asyncio.create_task(run_metrics_server()))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await close_client()
+        await close_checkpoints()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+"""
+Компактные записи состояния конвейера.
+Новости одного запуска хранятся в состоянии графа один раз, в словаре по ключу "канал/id".
+Результаты анализа и раскладка по категориям ссылаются на новости по ключу, а pydantic-модели
+отчета (ReportCategory, Report) собираются из записей только на выходе конвейера.
+"""
+import sys
+from typing import Dict, List, NamedTuple, Tuple
+
+from models.schemas import News, ReportCategory, CategorySummary
+
+
+def news_key(news: News) -> str:
+    """Ключ новости в хранилище запуска; строки ключей интернируются"""
+    return sys.intern(f"{news.channel}/{news.id}")
+
+
+def index_news(news_list: List[News]) -> Tuple[Dict[str, News], List[str]]:
+    """Хранилище новостей по ключу и ключи в исходном порядке"""
+    news = {news_key(item): item for item in news_list}
+    return news, list(news)
+
+
+class NewsAnalysis(NamedTuple):
+    """Результат анализа новости: ссылка на новость по ключу и поля анализа без копии новости"""
+    news_key: str
+    keywords: Tuple[str, ...]
+    sentiment: str
+    importance_score: float
+
+    @classmethod
+    def create(cls, key: str, keywords: List[str], sentiment: str, importance_score: float) -> "NewsAnalysis":
+        # Тональность принимает несколько значений на все новости: храним одну строку на значение
+        return cls(key, tuple(keywords), sys.intern(sentiment), importance_score)
+
+
+def materialize_categories(
+        summaries: List[CategorySummary],
+        categorized_news: Dict[str, List[str]],
+        news: Dict[str, News],
+) -> List[ReportCategory]:
+    """Категории отчета со списками новостей, собранные по ключам"""
+    return [
+        ReportCategory(
+            category=summary.category,
+            summary=summary.summary,
+            news_count=summary.news_count,
+            news=[news[key] for key in categorized_news.get(summary.category, [])],
+        )
+        for summary in summaries
+    ]
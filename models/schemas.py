@@ -3,6 +3,11 @@ from typing import List, Dict, Optional
 from datetime import datetime
 from enum import Enum
 
+class NewsSource(BaseModel):
+    """Сообщение канала, в котором опубликована новость"""
+    channel: str = Field(description="Название канала")
+    id: str = Field(description="Идентификатор сообщения в канале")
+
 class News(BaseModel):
     """Модель данных для новостей"""
     id: str = Field(description="Уникальный идентификатор новости")
@@ -11,6 +16,10 @@ class News(BaseModel):
     date: str = Field(description="Дата и время публикации новости")
     media_urls: List[str] = Field(default=[], description="Список URL медиафайлов, прикрепленных к новости")
     views: Optional[int] = Field(default=None, description="Количество просмотров новости, если доступно")
+    forwarded: bool = Field(default=False, description="Сообщение переслано из другого канала")
+    pinned: bool = Field(default=False, description="Сообщение закреплено в канале")
+    downranked: bool = Field(default=False, description="Предфильтр нашел слабый признак рекламы, важность новости понижается")
+    duplicates: List[NewsSource] = Field(default=[], description="Почти идентичные сообщения других каналов с этой же новостью")
 
 class Entities(BaseModel):
     """Именованные сущности, найденные в тексте новости"""
@@ -44,6 +53,34 @@ class CategoryOutput(BaseModel):
     """Категория новости"""
     category: NewsCategory = Field(description="Категория новости")
 
+class AnalyzerClassifierOutput(SimpleAnalyzerOutput):
+    """Совмещенный результат анализа и классификации новости за один вызов модели"""
+    category: NewsCategory = Field(description="Категория новости")
+
+class BatchAnalyzerItem(SimpleAnalyzerOutput):
+    """Результат анализа одной новости из пакета"""
+    item_id: int = Field(description="Номер новости в пакете")
+
+class BatchAnalyzerOutput(BaseModel):
+    """Результаты анализа пакета новостей"""
+    items: List[BatchAnalyzerItem] = Field(description="Результаты анализа для каждой новости пакета")
+
+class BatchCategoryItem(CategoryOutput):
+    """Категория одной новости из пакета"""
+    item_id: int = Field(description="Номер новости в пакете")
+
+class BatchCategoryOutput(BaseModel):
+    """Категории пакета новостей"""
+    items: List[BatchCategoryItem] = Field(description="Категории для каждой новости пакета")
+
+class BatchAnalyzerClassifierItem(AnalyzerClassifierOutput):
+    """Совмещенный результат анализа и классификации одной новости из пакета"""
+    item_id: int = Field(description="Номер новости в пакете")
+
+class BatchAnalyzerClassifierOutput(BaseModel):
+    """Совмещенные результаты анализа и классификации пакета новостей"""
+    items: List[BatchAnalyzerClassifierItem] = Field(description="Результаты для каждой новости пакета")
+
 class ClassifierOutput(BaseModel):
     """Структурированный вывод для агента-классификатора"""
     category: str = Field(description="Категория новости (Политика, Экономика, Технологии, Наука, Спорт, Культура, Общество, Происшествия)")
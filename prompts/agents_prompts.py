@@ -32,16 +32,95 @@ CLASSIFIER_PROMPT = """
 Если подходящей категории среди представленных нет, то добавь ее.
 """
 
+# Промпт для совмещенного анализа и классификации новостей за один вызов
+ANALYZER_CLASSIFIER_PROMPT = """
+Проанализируй следующий текст новости и предоставь структурированный анализ:
+
+Текст: {text}
+
+Выдели ключевые слова, определи тональность (позитивная/негативная/нейтральная), 
+оцени важность новости по шкале от 0 до 1, где 1 - крайне важная новость.
+Определи наиболее подходящую категорию новости, выбери только одну категорию из списка:
+- Политика
+- Экономика
+- Технологии
+- Наука
+- Спорт
+- Культура
+- Общество
+- Происшествия
+"""
+
+# Пакетные версии промптов: несколько новостей за один вызов модели.
+# Каждая новость в {items} предваряется номером в квадратных скобках, например [0].
+BATCH_ANALYZER_PROMPT = """
+Проанализируй каждую из следующих новостей и предоставь структурированный анализ для каждой из них:
+
+{items}
+
+Для каждой новости выдели ключевые слова, определи тональность (позитивная/негативная/нейтральная), 
+оцени важность новости по шкале от 0 до 1, где 1 - крайне важная новость.
+Для каждой новости обязательно укажи ее номер item_id из квадратных скобок. Не пропускай новости.
+"""
+
+BATCH_CLASSIFIER_PROMPT = """
+Определи наиболее подходящую категорию для каждой из следующих новостей. 
+Для каждой новости выбери только одну категорию из списка:
+- Политика
+- Экономика
+- Технологии
+- Наука
+- Спорт
+- Культура
+- Общество
+- Происшествия
+
+Новости:
+{items}
+
+Для каждой новости обязательно укажи ее номер item_id из квадратных скобок. Не пропускай новости.
+"""
+
+BATCH_ANALYZER_CLASSIFIER_PROMPT = """
+Проанализируй каждую из следующих новостей и предоставь структурированный анализ для каждой из них:
+
+{items}
+
+Для каждой новости выдели ключевые слова, определи тональность (позитивная/негативная/нейтральная), 
+оцени важность новости по шкале от 0 до 1, где 1 - крайне важная новость.
+Определи наиболее подходящую категорию каждой новости, выбери только одну категорию из списка:
+- Политика
+- Экономика
+- Технологии
+- Наука
+- Спорт
+- Культура
+- Общество
+- Происшествия
+Для каждой новости обязательно укажи ее номер item_id из квадратных скобок. Не пропускай новости.
+"""
+
 # Промпт для суммаризации новостей по категориям
 SUMMARIZER_PROMPT = """
 Сделай краткую информативную сводку из следующих новостей категории "{category}" (всего {count} новостей).
 Сводка должна быть лаконичной (до 100 слов) и содержать ключевую информацию.
+Пометка [Упоминаний: N] означает, что об этом сюжете написано в N сообщениях: такие сюжеты важнее.
 Не используй форматирование Mardown, заголовки или специальные символы.
 
 Новости:
 {text}
 """
 
+# Промпт для объединения частичных сводок одной категории (иерархическая суммаризация)
+SUMMARIZER_REDUCE_PROMPT = """
+Объедини следующие частичные сводки новостей категории "{category}" (всего {count} новостей) в одну общую сводку.
+Сводка должна быть лаконичной (до 100 слов), без повторов и содержать ключевую информацию.
+Не используй форматирование Mardown, заголовки или специальные символы.
+
+Частичные сводки:
+{text}
+"""
+
 # Промпт для формирования общей сводки отчета
 REPORTER_PROMPT = """
 Сделай общую сводку по следующим категориям новостей:
@@ -0,0 +1,166 @@
+"""
+Сохранение состояния запусков графа в SQLite для возобновления после сбоя.
+После каждого узла AsyncSqliteSaver (langgraph-checkpoint-sqlite) записывает состояние в поток
+с ключом "пользователь:запрос", где запрос определяется набором каналов, limit и границами прошлого дайджеста.
+Если поздний узел (суммаризатор, отчет) завершился ошибкой или процесс упал посреди дайджеста,
+повторный запрос того же дайджеста в пределах RESUME_WINDOW_SECONDS продолжает работу с последнего
+успешного узла. Потоки успешных запусков удаляются сразу, остальные - по истечении TTL.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, TYPE_CHECKING
+
+from config.settings import CHECKPOINTS
+
+if TYPE_CHECKING:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    from langgraph.types import StateSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class RunRegistry:
+    """Время последнего обращения к потокам запусков, для удаления устаревших"""
+
+    def __init__(self, path: str = CHECKPOINTS["PATH"]):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def touch(self, thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO runs (thread_id, updated_at) VALUES (?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at
+                """,
+                (thread_id, time.time())
+            )
+            self._conn.commit()
+
+    def forget(self, thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM runs WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+
+    def stale(self, ttl: float) -> List[str]:
+        """Потоки, к которым не обращались дольше ttl секунд"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT thread_id FROM runs WHERE updated_at < ?", (time.time() - ttl,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class Checkpoints:
+    """Сохраненные состояния запусков: поиск точки возобновления, удаление и сборка мусора"""
+
+    def __init__(self, saver: "AsyncSqliteSaver", registry: RunRegistry):
+        self.saver = saver
+        self.registry = registry
+        self._collected_at = 0.0
+        # Потоки запусков, выполняющихся в этом процессе
+        self._active: Set[str] = set()
+
+    @staticmethod
+    def config(thread_id: str) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": thread_id}}
+
+    def claim(self, thread_id: str) -> bool:
+        """Занять поток; False, если тот же запуск уже выполняется в этом процессе"""
+        if thread_id in self._active:
+            return False
+        self._active.add(thread_id)
+        return True
+
+    def release(self, thread_id: str) -> None:
+        self._active.discard(thread_id)
+
+    async def resume_point(self, graph, thread_id: str) -> Optional["StateSnapshot"]:
+        """Последнее сохраненное состояние без ошибок, после которого остались невыполненные узлы.
+        None, если запуска не было, он завершился успешно, не прошел ни одного узла
+        или сохранен раньше RESUME_WINDOW_SECONDS назад: такой дайджест уже устарел бы."""
+        async for snapshot in graph.aget_state_history(self.config(thread_id)):
+            if snapshot.values.get("errors"):
+                continue
+            if not snapshot.next or snapshot.metadata.get("step", -1) <= 0:
+                return None
+            age = datetime.now(timezone.utc) - datetime.fromisoformat(snapshot.created_at)
+            if age.total_seconds() > CHECKPOINTS["RESUME_WINDOW_SECONDS"]:
+                return None
+            return snapshot
+        return None
+
+    async def start(self, thread_id: str) -> None:
+        """Отметка о начале запуска и периодическое удаление устаревших потоков"""
+        await asyncio.to_thread(self.registry.touch, thread_id)
+        if time.monotonic() - self._collected_at >= CHECKPOINTS["GC_INTERVAL_SECONDS"]:
+            self._collected_at = time.monotonic()
+            await self.collect_garbage()
+
+    async def delete(self, thread_id: str) -> None:
+        await self.saver.adelete_thread(thread_id)
+        await asyncio.to_thread(self.registry.forget, thread_id)
+
+    async def collect_garbage(self) -> int:
+        """Удаление потоков, к которым не обращались дольше TTL"""
+        stale = await asyncio.to_thread(self.registry.stale, CHECKPOINTS["TTL_SECONDS"])
+        for thread_id in stale:
+            await self.delete(thread_id)
+        if stale:
+            logger.info(f"Removed {len(stale)} stale checkpoint threads")
+        return len(stale)
+
+
+_checkpoints: Optional[Checkpoints] = None
+_checkpoints_lock: Optional[asyncio.Lock] = None
+
+
+async def get_checkpoints() -> Checkpoints:
+    """Общее хранилище состояний запусков; соединение aiosqlite открывается при первом обращении"""
+    global _checkpoints, _checkpoints_lock
+
+    if _checkpoints_lock is None:
+        _checkpoints_lock = asyncio.Lock()
+
+    # Одновременные первые запросы не должны открыть несколько соединений:
+    # поток каждого соединения aiosqlite не дает процессу завершиться, пока соединение открыто
+    async with _checkpoints_lock:
+        if _checkpoints is None:
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+            registry = RunRegistry()
+            conn = await aiosqlite.connect(CHECKPOINTS["PATH"])
+            saver = AsyncSqliteSaver(conn)
+            try:
+                await saver.setup()
+            except Exception:
+                await conn.close()
+                raise
+            _checkpoints = Checkpoints(saver, registry)
+        return _checkpoints
+
+
+async def close_checkpoints() -> None:
+    """Закрытие соединения с хранилищем при остановке процесса"""
+    global _checkpoints
+    if _checkpoints_lock is None:
+        return
+    async with _checkpoints_lock:
+        if _checkpoints is not None:
+            await _checkpoints.saver.conn.close()
+            _checkpoints = None
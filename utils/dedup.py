@@ -0,0 +1,105 @@
+"""
+Поиск почти одинаковых новостей (перепостов между каналами).
+Тексты разбиваются на словесные шинглы, для них считается MinHash-сигнатура,
+кандидаты в дубликаты ищутся через LSH-индекс по полосам сигнатуры.
+"""
+import random
+import re
+import zlib
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from config.settings import DEDUP
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_URL_RE = re.compile(r"https?://\S+|t\.me/\S+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = DEDUP["SHINGLE_SIZE"]) -> Set[int]:
+    """Хэши словесных шинглов нормализованного текста (без ссылок, регистра и пунктуации)"""
+    words = _WORD_RE.findall(_URL_RE.sub(" ", text.lower()))
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i:i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+
+class NearDuplicateIndex:
+    """Инкрементальный MinHash LSH-индекс: каждый новый текст либо находит похожий, либо добавляется"""
+
+    def __init__(
+            self,
+            threshold: float = DEDUP["THRESHOLD"],
+            num_perm: int = DEDUP["NUM_PERM"],
+            bands: int = DEDUP["BANDS"],
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        # Фиксированное зерно: сигнатуры одинаковы между запусками
+        rng = random.Random(1)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self._buckets: List[Dict[Tuple[int, ...], List[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: Dict[Hashable, Tuple[int, ...]] = {}
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        """MinHash-сигнатура текста"""
+        hashes = shingles(text)
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        )
+
+    @staticmethod
+    def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+        """Оценка коэффициента Жаккара по двум сигнатурам"""
+        return sum(x == y for x, y in zip(first, second)) / len(first)
+
+    def find_or_add(self, key: Hashable, text: str) -> Optional[Hashable]:
+        """Ключ ранее добавленного почти такого же текста; если его нет, текст добавляется в индекс"""
+        signature = self.signature(text)
+        bands = [
+            signature[band * self.rows:(band + 1) * self.rows]
+            for band in range(self.bands)
+        ]
+
+        candidates = []
+        for band, band_key in enumerate(bands):
+            for candidate in self._buckets[band].get(band_key, []):
+                if candidate not in candidates:
+                    candidates.append(candidate)
+
+        for candidate in candidates:
+            if self.similarity(signature, self._signatures[candidate]) >= self.threshold:
+                return candidate
+
+        self._signatures[key] = signature
+        for band, band_key in enumerate(bands):
+            self._buckets[band].setdefault(band_key, []).append(key)
+        return None
+
+
+def cluster_near_duplicates(texts: List[str]) -> List[List[int]]:
+    """Группировка текстов в кластеры почти одинаковых; кластеры в порядке первого появления"""
+    index = NearDuplicateIndex()
+    clusters: Dict[int, List[int]] = {}
+    for position, text in enumerate(texts):
+        match = index.find_or_add(position, text)
+        if match is None:
+            clusters[position] = [position]
+        else:
+            clusters[match].append(position)
+    return list(clusters.values())
@@ -0,0 +1,82 @@
+"""
+Кэш готовых дайджестов.
+Ключ - нормализованный набор каналов, id последнего сообщения каждого канала, лимит новостей
+на канал и границы "с прошлой сводки". Пока в каналах не появилось новых сообщений, повторный
+запрос того же набора каналов получает готовый отчет без вызовов LLM.
+Записи удаляются по TTL и при превышении размера (LRU).
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config.settings import DIGEST_CACHE
+from models.schemas import Report
+
+
+def make_digest_key(
+        channels: List[str],
+        latest_ids: Dict[str, int],
+        limit_per_channel: int,
+        min_ids: Dict[str, int],
+) -> str:
+    """Ключ дайджеста: порядок и регистр каналов не важны"""
+    entries = sorted(
+        (channel.lower(), latest_ids.get(channel, 0), min_ids.get(channel, 0))
+        for channel in set(channels)
+    )
+    raw = json.dumps({"channels": entries, "limit": limit_per_channel}, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CachedDigest(NamedTuple):
+    report: Report
+    text: str  # Отчет, отформатированный для Telegram
+    watermarks: Dict[str, int]  # Последние id сообщений каналов, вошедших в дайджест
+
+
+class DigestCache:
+    """LRU-кэш готовых дайджестов в памяти процесса, с TTL"""
+
+    def __init__(self, max_size: int = DIGEST_CACHE["MAX_SIZE"], ttl: float = DIGEST_CACHE["TTL_SECONDS"]):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, CachedDigest]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedDigest]:
+        """Готовый дайджест или None, если записи нет или она устарела"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: str, digest: CachedDigest) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, digest)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+_cache: Optional[DigestCache] = None
+
+
+def get_digest_cache() -> DigestCache:
+    """Общий экземпляр кэша дайджестов"""
+    global _cache
+    if _cache is None:
+        _cache = DigestCache()
+    return _cache
@@ -0,0 +1,129 @@
+"""
+Планировщик запросов к Telegram через общую сессию Telethon.
+Все запросы всех пользователей проходят через общий темп и лимит одновременных запросов.
+FloodWait запоминается как дедлайн аккаунта: до его истечения новые запросы ждут,
+а запрос, получивший FloodWait, повторяется после дедлайна, если ожидание не слишком долгое.
+Разрешение username канала в сущность кэшируется, чтобы не тратить на него запрос каждый раз.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from config.settings import TELEGRAM_FETCH
+from utils.metrics import metrics
+from utils.telegram_client import SESSION_NAME
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ошибки разрешения username, которые не исчезнут при повторе
+PERMANENT_ENTITY_ERRORS = {"UsernameNotOccupiedError", "UsernameInvalidError", "ChannelPrivateError", "ChannelInvalidError"}
+
+
+def flood_wait_seconds(error: BaseException) -> Optional[int]:
+    """Сколько секунд Telegram просит подождать: FloodWaitError, FloodPremiumWaitError, SlowModeWaitError"""
+    seconds = getattr(error, "seconds", None)
+    if type(error).__name__.endswith("WaitError") and isinstance(seconds, int):
+        return seconds
+    return None
+
+
+class FloodWaitActive(Exception):
+    """Аккаунт ждет FloodWait дольше допустимого: запрос не выполняется"""
+
+
+class FetchScheduler:
+    """Темп, ограничение одновременных запросов и дедлайны FloodWait для аккаунта Telegram"""
+
+    def __init__(
+            self,
+            account: str = SESSION_NAME,
+            min_interval: float = TELEGRAM_FETCH["MIN_INTERVAL_SECONDS"],
+            concurrency: int = TELEGRAM_FETCH["CONCURRENCY"],
+            max_flood_wait: float = TELEGRAM_FETCH["MAX_FLOOD_WAIT_SECONDS"],
+            max_retries: int = TELEGRAM_FETCH["MAX_RETRIES"],
+            entity_ttl: float = TELEGRAM_FETCH["ENTITY_TTL_SECONDS"],
+            entity_error_ttl: float = TELEGRAM_FETCH["ENTITY_ERROR_TTL_SECONDS"],
+    ):
+        self.account = account
+        self.min_interval = min_interval
+        self.max_flood_wait = max_flood_wait
+        self.max_retries = max_retries
+        self.entity_ttl = entity_ttl
+        self.entity_error_ttl = entity_error_ttl
+
+        self._flood_until: Dict[str, float] = {}
+        self._next_start = 0.0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pace_lock = asyncio.Lock()
+        # username -> (срок годности, сущность или ошибка разрешения)
+        self._entities: Dict[str, Tuple[float, Any]] = {}
+
+    def flood_wait_left(self) -> float:
+        """Сколько секунд осталось до конца FloodWait аккаунта"""
+        return max(0.0, self._flood_until.get(self.account, 0.0) - time.monotonic())
+
+    async def _wait_turn(self) -> None:
+        """Ожидание конца FloodWait и соблюдение минимального интервала между запросами"""
+        async with self._pace_lock:
+            while True:
+                wait = max(self._flood_until.get(self.account, 0.0), self._next_start) - time.monotonic()
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._next_start = time.monotonic() + self.min_interval
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        """Выполнение запроса к Telegram с учетом темпа и повтором после FloodWait"""
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                # Долгий FloodWait не ждем: вызывающий код обойдется сохраненными сообщениями
+                if self.flood_wait_left() > self.max_flood_wait:
+                    raise FloodWaitActive(f"Telegram flood wait for another {self.flood_wait_left():.0f}s")
+                await self._wait_turn()
+                try:
+                    return await func()
+                except Exception as e:
+                    seconds = flood_wait_seconds(e)
+                    if seconds is None:
+                        raise
+
+                    # Дедлайн общий для аккаунта: остальные запросы тоже подождут
+                    deadline = time.monotonic() + seconds + 1
+                    self._flood_until[self.account] = max(self._flood_until.get(self.account, 0.0), deadline)
+                    metrics.inc("flood_waits")
+                    logger.warning(f"Telegram FloodWait for {seconds}s on account {self.account}")
+                    if seconds > self.max_flood_wait or attempt == self.max_retries:
+                        raise
+
+    async def resolve(self, client: Any, channel: str) -> Any:
+        """Сущность канала для запросов; удачные и неудачные разрешения кэшируются"""
+        cached = self._entities.get(channel)
+        if cached is not None and cached[0] > time.monotonic():
+            if isinstance(cached[1], Exception):
+                raise cached[1]
+            return cached[1]
+
+        try:
+            entity = await self.call(lambda: client.get_input_entity(channel))
+        except Exception as e:
+            # Несуществующий или недоступный канал не разрешаем повторно до истечения срока
+            if isinstance(e, ValueError) or type(e).__name__ in PERMANENT_ENTITY_ERRORS:
+                self._entities[channel] = (time.monotonic() + self.entity_error_ttl, e)
+            raise
+
+        self._entities[channel] = (time.monotonic() + self.entity_ttl, entity)
+        return entity
+
+
+_scheduler: Optional[FetchScheduler] = None
+
+
+def get_fetch_scheduler() -> FetchScheduler:
+    """Общий экземпляр планировщика запросов к Telegram"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FetchScheduler()
+    return _scheduler
@@ -4,6 +4,33 @@ from datetime import datetime
 from typing import Dict, List, Any
 
 
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов: для русского текста в среднем ~3 символа на токен"""
+    return max(1, len(text) // 3)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Обрезка текста до примерного бюджета токенов"""
+    max_chars = max_tokens * 3
+    return text if len(text) <= max_chars else text[:max_chars]
+
+def pack_batches(texts: List[str], max_items: int, token_budget: int) -> List[List[int]]:
+    """Жадная упаковка текстов в пакеты не больше max_items элементов и token_budget токенов.
+    Возвращает индексы текстов по пакетам; слишком длинный текст попадает в пакет один."""
+    batches = []
+    current = []
+    current_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
 def safe_parse_date(date_value):
     if isinstance(date_value, str):
         try:
@@ -15,13 +42,21 @@ def safe_parse_date(date_value):
     else:
         return datetime.now()  # или другое значение по умолчанию
 
-def format_report_for_telegram(report):
+def format_overall_summary_for_telegram(report):
     report = report.model_dump()
     formatted_text = f"📊 *{report['title']}*\n\n"
     formatted_text += f"📅 Дата: {safe_parse_date(report['date']).strftime('%d.%m.%Y %H:%M')}\n\n"
     formatted_text += f"📝 *Общая сводка:*\n\n\n{report['overall_summary']}\n\n"
+    return formatted_text
+
+def format_category_summary_for_telegram(summary):
+    formatted_text = f"*{summary.category}* ({summary.news_count} новостей):\n"
+    formatted_text += f"{summary.summary}\n\n"
+    return formatted_text
+
+def format_report_for_telegram(report):
+    formatted_text = format_overall_summary_for_telegram(report)
     formatted_text += "📌 *Сводки по категориям:*\n\n"
-    for category in report['categories']:
-        formatted_text += f"*{category['category']}* ({category['news_count']} новостей):\n"
-        formatted_text += f"{category['summary']}\n\n"
-    return formatted_text
\ No newline at end of file
+    for category in report.categories:
+        formatted_text += format_category_summary_for_telegram(category)
+    return formatted_text
@@ -0,0 +1,270 @@
+"""
+Надежная очередь заданий на дайджест в SQLite (режим WAL) для отдельных процессов-обработчиков.
+Бот кладет задание в очередь, обработчики (python worker.py) забирают его и отправляют дайджест сами.
+- Одинаковое активное задание пользователя не ставится повторно (дедупликация по ключу).
+- Взятое задание арендуется на время видимости; обработчик продлевает аренду, пока работает.
+  Если обработчик упал, после истечения аренды задание снова достается другому обработчику.
+  Когда попытки исчерпаны, claim отдает задание с expired=True, чтобы обработчик сообщил пользователю об ошибке.
+- В задании запоминаются уже отправленные сводки категорий: повторная попытка их не отправляет.
+- Задания одного пользователя выполняются строго по очереди, разные пользователи - параллельно.
+- Выполненные задания удаляются сразу, задания с ошибкой - через FAILED_TTL_SECONDS.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from config.settings import JOB_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class Job(NamedTuple):
+    id: int
+    user_id: str
+    chat_id: int
+    channels: List[str]
+    since_last_digest: bool
+    progress_message_id: Optional[int]  # Сообщение о прогрессе, которое редактирует обработчик
+    attempts: int
+    delivered_categories: Tuple[str, ...] = ()  # Сводки категорий, отправленные прошлыми попытками
+    expired: bool = False  # Аренда истекала слишком часто: задание уже помечено ошибкой
+
+
+def make_job_key(user_id: str, channels: List[str], since_last_digest: bool) -> str:
+    """Ключ дедупликации: пользователь, вид дайджеста и набор каналов"""
+    raw = json.dumps([user_id, since_last_digest, sorted(channel.lower() for channel in channels)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """Очередь заданий с арендой, повторами и порядком выполнения по пользователям"""
+
+    def __init__(
+            self,
+            path: str = JOB_QUEUE["PATH"],
+            visibility_timeout: float = JOB_QUEUE["VISIBILITY_TIMEOUT_SECONDS"],
+            max_attempts: int = JOB_QUEUE["MAX_ATTEMPTS"],
+            retry_delay: float = JOB_QUEUE["RETRY_DELAY_SECONDS"],
+            failed_ttl: float = JOB_QUEUE["FAILED_TTL_SECONDS"],
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.failed_ttl = failed_ttl
+        self._purged_at = 0.0
+        self._lock = threading.Lock()
+        # Очередь делят несколько процессов: ждем блокировку записи, а не падаем сразу
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_key TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                visible_at REAL NOT NULL,
+                worker TEXT,
+                error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (job_key)
+                WHERE status IN ('queued', 'running');
+            CREATE INDEX IF NOT EXISTS jobs_by_user ON jobs (user_id, status);
+            """
+        )
+        self._conn.commit()
+
+    def enqueue(
+            self,
+            user_id: str,
+            chat_id: int,
+            channels: List[str],
+            since_last_digest: bool = False,
+            progress_message_id: Optional[int] = None,
+    ) -> Tuple[int, bool]:
+        """Постановка задания. Возвращает id задания и признак, что оно новое,
+        а не уже ожидающее или выполняющееся такое же"""
+        job_key = make_job_key(user_id, channels, since_last_digest)
+        payload = json.dumps({
+            "channels": channels,
+            "since_last_digest": since_last_digest,
+            "progress_message_id": progress_message_id,
+        }, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            try:
+                cursor = self._conn.execute(
+                    """
+                    INSERT INTO jobs (job_key, user_id, chat_id, payload, status, visible_at, created_at)
+                    VALUES (?, ?, ?, ?, 'queued', ?, ?)
+                    """,
+                    (job_key, user_id, chat_id, payload, now, now)
+                )
+                self._conn.commit()
+                return cursor.lastrowid, True
+            except sqlite3.IntegrityError:
+                self._conn.rollback()
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE job_key = ? AND status IN ('queued', 'running')", (job_key,)
+                ).fetchone()
+                return row[0], False
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Аренда самого старого доступного задания. Задание доступно, если у пользователя
+        нет более раннего незавершенного задания и нет задания в работе с действующей арендой.
+        Задание с исчерпанными попытками помечается ошибкой и возвращается с expired=True"""
+        if time.monotonic() - self._purged_at >= JOB_QUEUE["PURGE_INTERVAL_SECONDS"]:
+            self._purged_at = time.monotonic()
+            self.purge_failed()
+
+        with self._lock:
+            now = time.time()
+            # BEGIN IMMEDIATE: выбор и аренда задания атомарны между процессами
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT id, user_id, chat_id, payload, attempts FROM jobs AS job
+                    WHERE status IN ('queued', 'running') AND visible_at <= ?
+                      AND NOT EXISTS (
+                          SELECT 1 FROM jobs AS other
+                          WHERE other.user_id = job.user_id
+                            AND other.status IN ('queued', 'running')
+                            AND (other.id < job.id OR (other.status = 'running' AND other.visible_at > ?))
+                      )
+                    ORDER BY id LIMIT 1
+                    """,
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.commit()
+                    return None
+
+                job_id, user_id, chat_id, payload, attempts = row
+                if attempts >= self.max_attempts:
+                    # Аренда истекала слишком часто: обработчики падают на этом задании.
+                    # Задание отдается обработчику только для того, чтобы тот сообщил пользователю об ошибке
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'failed', visible_at = ?, error = 'visibility timeout expired' WHERE id = ?",
+                        (now, job_id)
+                    )
+                    self._conn.commit()
+                    logger.warning(f"Job {job_id} failed after {attempts} attempts")
+                    return self._make_job(job_id, user_id, chat_id, json.loads(payload), attempts, expired=True)
+
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = ?, visible_at = ?, worker = ? WHERE id = ?",
+                    (attempts + 1, now + self.visibility_timeout, worker, job_id)
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+            return self._make_job(job_id, user_id, chat_id, json.loads(payload), attempts + 1)
+
+    @staticmethod
+    def _make_job(job_id: int, user_id: str, chat_id: int, data: Dict[str, Any], attempts: int, expired: bool = False) -> Job:
+        return Job(
+            id=job_id,
+            user_id=user_id,
+            chat_id=chat_id,
+            channels=data["channels"],
+            since_last_digest=data["since_last_digest"],
+            progress_message_id=data.get("progress_message_id"),
+            attempts=attempts,
+            delivered_categories=tuple(data.get("delivered_categories", ())),
+            expired=expired,
+        )
+
+    def extend(self, job_id: int, worker: str) -> bool:
+        """Продление аренды; False, если задание уже забрал другой обработчик"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET visible_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.visibility_timeout, job_id, worker)
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def record_delivered(self, job_id: int, worker: str, category: str) -> None:
+        """Запоминаем отправленную пользователю сводку категории, чтобы повторная попытка ее не дублировала"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)
+            ).fetchone()
+            if row is None:
+                return
+            data = json.loads(row[0])
+            delivered = data.setdefault("delivered_categories", [])
+            if category not in delivered:
+                delivered.append(category)
+            self._conn.execute(
+                "UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(data, ensure_ascii=False), job_id)
+            )
+            self._conn.commit()
+
+    def complete(self, job_id: int, worker: str) -> None:
+        """Выполненные задания удаляются: для дедупликации нужны только активные"""
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ? AND worker = ?", (job_id, worker))
+            self._conn.commit()
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """Возврат задания в очередь с задержкой или окончательная ошибка.
+        Возвращает True, если попытки исчерпаны"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)
+            ).fetchone()
+            if row is None:
+                return False
+
+            final = row[0] >= self.max_attempts
+            # У задания с ошибкой visible_at - время ошибки, по нему задание удаляется через FAILED_TTL_SECONDS
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, visible_at = ?, error = ? WHERE id = ?",
+                ("failed" if final else "queued", time.time() + (0 if final else self.retry_delay), error, job_id)
+            )
+            self._conn.commit()
+            return final
+
+    def purge_failed(self) -> int:
+        """Удаление заданий с ошибкой старше FAILED_TTL_SECONDS"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status = 'failed' AND visible_at < ?", (time.time() - self.failed_ttl,)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Purged {cursor.rowcount} failed jobs")
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """Общий экземпляр очереди заданий"""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
@@ -0,0 +1,186 @@
+"""
+Кэш результатов LLM, адресуемый по содержимому.
+Ключ - хэш нормализованного текста новости, версии промпта и имени модели.
+Перед постоянным слоем на SQLite стоит LRU-кэш в памяти, записи удаляются по TTL.
+Размер SQLite ограничен MAX_ROWS записями: при периодической очистке удаляются устаревшие
+и самые старые записи сверх лимита.
+Новые записи сразу попадают в память, а в SQLite записываются пачкой методом flush,
+который, как и чтение с диска, вызывается из отдельного потока, а не из цикла событий.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+from config.settings import LLM_CACHE
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста: юникод NFC и схлопывание пробельных символов"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def prompt_version(template: str) -> str:
+    """Версия промпта - короткий хэш его шаблона, меняется при любой правке промпта"""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def make_cache_key(text: str, template: str, model: str) -> str:
+    """Ключ кэша по тексту новости, промпту и модели"""
+    raw = "\x1f".join([prompt_version(template), model, normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Двухуровневый кэш: LRU в памяти + SQLite, с TTL и счетчиками попаданий"""
+
+    def __init__(
+            self,
+            path: str = LLM_CACHE["PATH"],
+            max_size: int = LLM_CACHE["MAX_SIZE"],
+            ttl: float = LLM_CACHE["TTL_SECONDS"],
+            max_rows: int = LLM_CACHE["MAX_ROWS"],
+            purge_interval: float = LLM_CACHE["PURGE_INTERVAL_SECONDS"],
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.purge_interval = purge_interval
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        # Записи, еще не сохраненные в SQLite
+        self._pending: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        # Порядок expires_at совпадает с порядком записи: по нему удаляются самые старые записи
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires_at)")
+        self._conn.commit()
+        self.purge()
+
+    def get(self, key: str, schema: Type[T]) -> Optional[T]:
+        """Результат из кэша или None, если записи нет или она устарела"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at >= now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return schema.model_validate_json(payload)
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT payload, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            payload, expires_at = row
+            self._remember(key, expires_at, payload)
+            self.disk_hits += 1
+        return schema.model_validate_json(payload)
+
+    def get_many(self, keys: List[str], schema: Type[T]) -> List[Optional[T]]:
+        """Результаты из кэша по нескольким ключам одним обращением"""
+        return [self.get(key, schema) for key in keys]
+
+    def set(self, key: str, value: BaseModel) -> None:
+        """Сохранение результата в память; на диск запись попадет при следующем flush"""
+        payload = value.model_dump_json()
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, payload)
+            self._pending[key] = (expires_at, payload)
+
+    def flush(self) -> None:
+        """Запись накопленных результатов в SQLite одной транзакцией"""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO llm_cache (key, payload, expires_at) VALUES (?, ?, ?)",
+                [(key, payload, expires_at) for key, (expires_at, payload) in pending.items()]
+            )
+            self._conn.commit()
+        if time.monotonic() - self._purged_at >= self.purge_interval:
+            self.purge()
+
+    def purge(self) -> int:
+        """Удаление устаревших записей и самых старых записей сверх max_rows"""
+        self._purged_at = time.monotonic()
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),)).rowcount
+            evicted = self._conn.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_rows,)
+            ).rowcount
+            self._conn.commit()
+        if expired or evicted:
+            logger.info(f"LLM cache purged {expired} expired and {evicted} oldest rows")
+        return expired + evicted
+
+    def _remember(self, key: str, expires_at: float, payload: str) -> None:
+        self._memory[key] = (expires_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        """Счетчики попаданий и промахов"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> LLMCache:
+    """Общий экземпляр кэша LLM"""
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
@@ -0,0 +1,206 @@
+"""
+Общий для процесса планировщик запросов к GigaChat.
+Запросы ждут в очереди с приоритетами (интерактивные дайджесты раньше фонового обновления),
+темп ограничен корзиной токенов под квоту API, а число одновременных запросов подстраивается
+по AIMD: медленно растет, пока ответы быстрые, и резко падает на 429 и при росте задержки.
+Ошибки перегрузки и сетевые сбои повторяются с экспоненциальной задержкой со случайным разбросом.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from config.settings import LLM_SCHEDULER
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Приоритеты: меньше - раньше
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Приоритет запросов текущей задачи; фоновые задачи выставляют BACKGROUND
+llm_priority: ContextVar[int] = ContextVar("llm_priority", default=INTERACTIVE)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP-статус ошибки GigaChat: ResponseError(url, status_code, content, headers)"""
+    status = getattr(error, "status_code", None)
+    if status is None and len(getattr(error, "args", ())) >= 2 and isinstance(error.args[1], int):
+        status = error.args[1]
+    return status
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Значение заголовка Retry-After ответа, в секундах"""
+    args = getattr(error, "args", ())
+    headers = args[3] if len(args) >= 4 else None
+    try:
+        return float(headers.get("Retry-After")) if headers is not None and headers.get("Retry-After") else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Перегрузка API, ошибка сервера или сетевой сбой"""
+    if status_code(error) in RETRYABLE_STATUSES:
+        return True
+    return isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)) or type(error).__module__.startswith("httpx")
+
+
+class LLMScheduler:
+    """Очередь с приоритетами, корзина токенов и адаптивный лимит одновременных запросов"""
+
+    def __init__(
+            self,
+            rate: float = LLM_SCHEDULER["RATE_PER_SECOND"],
+            burst: int = LLM_SCHEDULER["BURST"],
+            min_concurrency: int = LLM_SCHEDULER["MIN_CONCURRENCY"],
+            max_concurrency: int = LLM_SCHEDULER["MAX_CONCURRENCY"],
+            latency_target: float = LLM_SCHEDULER["LATENCY_TARGET_SECONDS"],
+            decrease_factor: float = LLM_SCHEDULER["DECREASE_FACTOR"],
+            max_retries: int = LLM_SCHEDULER["MAX_RETRIES"],
+            backoff_base: float = LLM_SCHEDULER["BACKOFF_BASE_SECONDS"],
+            backoff_max: float = LLM_SCHEDULER["BACKOFF_MAX_SECONDS"],
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self) -> None:
+        """Выдача разрешений ожидающим запросам в порядке приоритета, пока есть слоты и токены"""
+        self._timer = None
+        while self._queue and self.in_flight < int(self.limit):
+            if self._queue[0][2].done():
+                heapq.heappop(self._queue)  # Ожидание отменено
+                continue
+
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if self.rate > 0 and self._tokens < 1:
+                wait = max(wait, (1 - self._tokens) / self.rate)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            if self.rate > 0:
+                self._tokens -= 1
+            self.in_flight += 1
+            heapq.heappop(self._queue)[2].set_result(None)
+
+    async def _acquire(self, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), future))
+        if self._timer is None:
+            self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Разрешение могло быть выдано одновременно с отменой: возвращаем слот
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        if self._timer is None:
+            self._dispatch()
+
+    def _decrease(self, now: float) -> None:
+        """Мультипликативное снижение лимита, не чаще раза за целевую задержку"""
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+        logger.info(f"LLM concurrency limit decreased to {self.limit:.1f}")
+
+    def _on_success(self, latency: float) -> None:
+        now = time.monotonic()
+        if latency > self.latency_target:
+            self._decrease(now)
+        else:
+            # Аддитивный рост: примерно +1 слот за каждые limit успешных быстрых ответов
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def _on_rate_limited(self, pause: Optional[float]) -> None:
+        now = time.monotonic()
+        self._decrease(now)
+        self._tokens = 0.0
+        if pause:
+            self._paused_until = max(self._paused_until, now + pause)
+
+    def backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка перед повтором с полным случайным разбросом"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def run(self, call: Callable[[], Awaitable[T]], priority: Optional[int] = None) -> T:
+        """Выполнение запроса через очередь с повторами при перегрузке и сетевых сбоях"""
+        priority = llm_priority.get() if priority is None else priority
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority)
+            started = time.monotonic()
+            try:
+                result = await call()
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+
+                pause = None
+                if status_code(e) == 429:
+                    pause = retry_after(e)
+                    self._on_rate_limited(pause)
+                delay = max(pause or 0.0, self.backoff(attempt))
+                metrics.inc("retries")
+                logger.warning(f"Retrying LLM request in {delay:.1f}s after error: {e}")
+            else:
+                self._on_success(time.monotonic() - started)
+                return result
+            finally:
+                # Слот освобождается при любом исходе, включая отмену запроса
+                self._release()
+
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"limit": round(self.limit, 1), "in_flight": self.in_flight, "queued": len(self._queue)}
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Общий экземпляр планировщика запросов к GigaChat"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
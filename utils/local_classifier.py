@@ -0,0 +1,277 @@
+"""
+Локальный классификатор категорий новостей, обученный на ответах GigaChat.
+Каждая категория, полученная от модели, сохраняется как обучающий пример (текст, категория).
+На этих примерах на CPU обучается мультиклассовая логистическая регрессия по хэшированным
+словесным n-граммам (NumPy). Уверенные ответы локальной модели заменяют вызов LLM,
+неуверенные новости по-прежнему классифицирует GigaChat.
+"""
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import LOCAL_CLASSIFIER
+from models.schemas import NewsCategory
+from utils.llm_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_URL_RE = re.compile(r"https?://\S+|t\.me/\S+")
+_WORD_RE = re.compile(r"\w+")
+
+# Порядок классов модели
+CATEGORIES = [category.value for category in NewsCategory]
+
+
+def features(text: str, dims: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Хэшированные признаки текста: слова, их начала (грубая замена стемминга) и биграммы слов.
+    Возвращает номера признаков и их веса (логарифм частоты, нормированный по L2)."""
+    words = _WORD_RE.findall(_URL_RE.sub(" ", text.lower()))
+    tokens = ["\x01"]  # Признак-смещение, чтобы у любого текста был хотя бы один признак
+    tokens.extend(words)
+    tokens.extend("\x02" + word[:5] for word in words if len(word) > 5)
+    tokens.extend(f"{first} {second}" for first, second in zip(words, words[1:]))
+
+    indices = np.fromiter((zlib.crc32(token.encode("utf-8")) % dims for token in tokens), dtype=np.int64, count=len(tokens))
+    indices, counts = np.unique(indices, return_counts=True)
+    values = np.log1p(counts).astype(np.float32)
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+def _stack_features(texts: List[str], dims: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Разреженная матрица признаков: номера столбцов, значения и начала строк"""
+    pairs = [features(text, dims) for text in texts]
+    lengths = np.fromiter((len(indices) for indices, _ in pairs), dtype=np.int64, count=len(pairs))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    columns = np.concatenate([indices for indices, _ in pairs])
+    values = np.concatenate([values for _, values in pairs])
+    return columns, values, starts
+
+
+def _probabilities(weights: np.ndarray, bias: np.ndarray, columns: np.ndarray, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Вероятности классов для разреженной матрицы признаков"""
+    logits = np.add.reduceat(weights[columns] * values[:, None], starts, axis=0) + bias
+    logits -= logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def fit(
+        texts: List[str],
+        labels: List[int],
+        dims: int,
+        epochs: int,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Обучение логистической регрессии полным градиентным спуском с AdaGrad"""
+    columns, values, starts = _stack_features(texts, dims)
+    rows = np.repeat(np.arange(len(texts)), np.diff(np.append(starts, len(columns))))
+    targets = np.zeros((len(texts), len(CATEGORIES)), dtype=np.float32)
+    targets[np.arange(len(texts)), labels] = 1.0
+
+    weights = np.zeros((dims, len(CATEGORIES)), dtype=np.float32)
+    bias = np.zeros(len(CATEGORIES), dtype=np.float32)
+    weights_history = np.full_like(weights, 1e-8)
+    bias_history = np.full_like(bias, 1e-8)
+
+    for _ in range(epochs):
+        errors = (_probabilities(weights, bias, columns, values, starts) - targets) / len(texts)
+        weighted = values[:, None] * errors[rows]
+
+        # Градиент по весам собирается по столбцам признаков, без плотной матрицы текстов
+        weights_grad = np.stack(
+            [np.bincount(columns, weights=weighted[:, k], minlength=dims) for k in range(len(CATEGORIES))],
+            axis=1,
+        ).astype(np.float32) + l2 * weights
+        bias_grad = errors.sum(axis=0)
+
+        weights_history += weights_grad ** 2
+        bias_history += bias_grad ** 2
+        weights -= learning_rate * weights_grad / np.sqrt(weights_history)
+        bias -= learning_rate * bias_grad / np.sqrt(bias_history)
+
+    return weights, bias
+
+
+class LocalClassifier:
+    """Обучающие примеры от GigaChat, локальная модель и метрики ее согласия с LLM"""
+
+    def __init__(
+            self,
+            path: str = LOCAL_CLASSIFIER["PATH"],
+            dims: int = LOCAL_CLASSIFIER["HASH_DIMS"],
+            threshold: float = LOCAL_CLASSIFIER["CONFIDENCE_THRESHOLD"],
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.dims = dims
+        self.threshold = threshold
+        self.local_answers = 0
+        self.llm_answers = 0
+        self.shadow_checks = 0
+        self.shadow_agreements = 0
+
+        # (веса, смещения) активной модели; заменяется целиком после переобучения
+        self._model: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._trained_on = 0
+        self._evaluation: Dict[str, float] = {}
+
+        self._lock = threading.Lock()
+        self._train_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS labels (
+                text TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS model (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                dims INTEGER NOT NULL,
+                weights BLOB NOT NULL,
+                bias BLOB NOT NULL,
+                trained_on INTEGER NOT NULL,
+                agreement REAL NOT NULL,
+                coverage REAL NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+        self._load_model()
+
+    def _load_model(self) -> None:
+        """Загрузка сохраненной модели, если она обучена с текущим числом признаков"""
+        row = self._conn.execute(
+            "SELECT dims, weights, bias, trained_on, agreement, coverage FROM model WHERE id = 1"
+        ).fetchone()
+        if row is None or row[0] != self.dims:
+            return
+
+        dims, weights, bias, trained_on, agreement, coverage = row
+        self._trained_on = trained_on
+        self._evaluation = {"agreement": agreement, "coverage": coverage}
+        if agreement >= LOCAL_CLASSIFIER["MIN_AGREEMENT"]:
+            self._model = (
+                np.frombuffer(weights, dtype=np.float32).reshape(dims, len(CATEGORIES)),
+                np.frombuffer(bias, dtype=np.float32),
+            )
+        logger.info(f"Loaded local classifier trained on {trained_on} labels: {self._evaluation}")
+
+    def add_labels(self, pairs: List[Tuple[str, str]]) -> None:
+        """Сохранение категорий, полученных от GigaChat, как обучающих примеров"""
+        if not pairs:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO labels (text, category, created_at) VALUES (?, ?, ?)",
+                [(normalize_text(text), category, now) for text, category in pairs]
+            )
+
+    def label_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def predict(self, texts: List[str]) -> List[Optional[str]]:
+        """Категории, в которых модель уверена; None - нет модели или модель не уверена"""
+        model = self._model
+        if model is None or not texts:
+            self.llm_answers += len(texts)
+            return [None] * len(texts)
+
+        probabilities = _probabilities(*model, *_stack_features(texts, self.dims))
+        best = probabilities.argmax(axis=1)
+        confident = probabilities[np.arange(len(texts)), best] >= self.threshold
+
+        self.local_answers += int(confident.sum())
+        self.llm_answers += int((~confident).sum())
+        return [CATEGORIES[label] if ok else None for label, ok in zip(best, confident)]
+
+    def record_shadow(self, local_category: str, llm_category: str) -> None:
+        """Учет выборочной проверки уверенного ответа локальной модели через LLM"""
+        self.shadow_checks += 1
+        self.shadow_agreements += local_category == llm_category
+
+    def needs_training(self) -> bool:
+        """Накопилось достаточно новых примеров с прошлого обучения"""
+        count = self.label_count()
+        return count >= LOCAL_CLASSIFIER["MIN_TRAIN_SIZE"] and count - self._trained_on >= LOCAL_CLASSIFIER["RETRAIN_EVERY"]
+
+    def train(self) -> Dict[str, float]:
+        """Обучение модели на накопленных примерах с проверкой на отложенной выборке.
+        Модель включается, только если ее уверенные ответы достаточно часто совпадают с LLM."""
+        with self._train_lock:
+            with self._lock:
+                rows = self._conn.execute("SELECT text, category FROM labels").fetchall()
+            rows = [(text, CATEGORIES.index(category)) for text, category in rows if category in CATEGORIES]
+
+            started = time.monotonic()
+            random.Random(1).shuffle(rows)
+            split = max(1, int(len(rows) * LOCAL_CLASSIFIER["HOLDOUT_SHARE"]))
+            holdout, train = rows[:split], rows[split:]
+
+            weights, bias = fit(
+                [text for text, _ in train], [label for _, label in train], self.dims, LOCAL_CLASSIFIER["EPOCHS"]
+            )
+
+            # Согласие с LLM среди уверенных ответов и доля новостей, которые модель берет на себя
+            probabilities = _probabilities(weights, bias, *_stack_features([text for text, _ in holdout], self.dims))
+            best = probabilities.argmax(axis=1)
+            confident = probabilities[np.arange(len(holdout)), best] >= self.threshold
+            labels = np.array([label for _, label in holdout])
+            evaluation = {
+                "agreement": float((best[confident] == labels[confident]).mean()) if confident.any() else 0.0,
+                "coverage": float(confident.mean()),
+                "accuracy": float((best == labels).mean()),
+            }
+
+            active = evaluation["agreement"] >= LOCAL_CLASSIFIER["MIN_AGREEMENT"]
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO model (id, dims, weights, bias, trained_on, agreement, coverage) "
+                    "VALUES (1, ?, ?, ?, ?, ?, ?)",
+                    (self.dims, weights.tobytes(), bias.tobytes(), len(rows), evaluation["agreement"], evaluation["coverage"])
+                )
+            self._model = (weights, bias) if active else None
+            self._trained_on = len(rows)
+            self._evaluation = evaluation
+
+            logger.info(
+                f"Trained local classifier on {len(train)} labels in {time.monotonic() - started:.1f}s: "
+                f"{evaluation}, {'active' if active else 'inactive (agreement below MIN_AGREEMENT)'}"
+            )
+            return evaluation
+
+    def stats(self) -> Dict[str, float]:
+        answered = self.local_answers + self.llm_answers
+        return {
+            "active": self._model is not None,
+            "trained_on": self._trained_on,
+            **self._evaluation,
+            "local_share": self.local_answers / answered if answered else 0.0,
+            "shadow_agreement": self.shadow_agreements / self.shadow_checks if self.shadow_checks else 0.0,
+        }
+
+
+_classifier: Optional[LocalClassifier] = None
+
+
+def get_local_classifier() -> LocalClassifier:
+    """Общий экземпляр локального классификатора"""
+    global _classifier
+    if _classifier is None:
+        _classifier = LocalClassifier()
+    return _classifier
@@ -0,0 +1,140 @@
+"""
+Локальное хранилище сообщений каналов на SQLite.
+Для каждого канала хранится максимальный увиденный id сообщения (watermark),
+чтобы повторные запросы к Telegram забирали только новые сообщения.
+Для каждого канала хранятся только MESSAGE_STORE_MAX_PER_CHANNEL последних сообщений.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from models.schemas import News
+from config.settings import MESSAGE_STORE_PATH, MESSAGE_STORE_MAX_PER_CHANNEL
+
+
+class MessageStore:
+    """Хранилище сообщений с watermark-ами по каналам и по дайджестам пользователей"""
+
+    def __init__(self, path: str = MESSAGE_STORE_PATH, max_per_channel: int = MESSAGE_STORE_MAX_PER_CHANNEL):
+        self.max_per_channel = max_per_channel
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                channel TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (channel, id)
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                channel TEXT PRIMARY KEY,
+                max_id INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS digest_watermarks (
+                user_id TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                max_id INTEGER NOT NULL,
+                PRIMARY KEY (user_id, channel)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def get_watermark(self, channel: str) -> int:
+        """Максимальный id сообщения канала, уже полученный из Telegram"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT max_id FROM watermarks WHERE channel = ?", (channel,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def save_messages(self, channel: str, news_list: List[News], max_id: int) -> None:
+        """Сохранение новых сообщений канала и сдвиг его watermark-а"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (channel, id, date, payload) VALUES (?, ?, ?, ?)",
+                [(channel, int(news.id), news.date, news.model_dump_json()) for news in news_list]
+            )
+            self._conn.execute(
+                """
+                INSERT INTO watermarks (channel, max_id, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(channel) DO UPDATE SET
+                    max_id = MAX(max_id, excluded.max_id),
+                    updated_at = excluded.updated_at
+                """,
+                (channel, max_id, datetime.now().isoformat())
+            )
+            # Удаляем сообщения старше max_per_channel последних
+            self._conn.execute(
+                """
+                DELETE FROM messages WHERE channel = ? AND id <= (
+                    SELECT id FROM messages WHERE channel = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (channel, channel, self.max_per_channel)
+            )
+            self._conn.commit()
+
+    def count_messages(self, channel: str) -> int:
+        """Число сохраненных сообщений канала"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE channel = ?", (channel,)
+            ).fetchone()
+        return row[0]
+
+    def get_messages(
+            self,
+            channel: str,
+            limit: int,
+            min_id: int = 0,
+    ) -> List[News]:
+        """Последние сообщения канала из хранилища новее min_id"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM messages WHERE channel = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                (channel, min_id, limit)
+            ).fetchall()
+        return [News.model_validate_json(row[0]) for row in rows]
+
+    def get_digest_watermarks(self, user_id: str) -> Dict[str, int]:
+        """Id последних сообщений каждого канала, попавших в прошлый дайджест пользователя"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel, max_id FROM digest_watermarks WHERE user_id = ?", (user_id,)
+            ).fetchall()
+        return {channel: max_id for channel, max_id in rows}
+
+    def set_digest_watermarks(self, user_id: str, watermarks: Dict[str, int]) -> None:
+        """Запоминаем, до какого сообщения пользователь уже получил дайджест"""
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO digest_watermarks (user_id, channel, max_id) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, channel) DO UPDATE SET
+                    max_id = MAX(max_id, excluded.max_id)
+                """,
+                [(user_id, channel, max_id) for channel, max_id in watermarks.items()]
+            )
+            self._conn.commit()
+
+
+_store: Optional[MessageStore] = None
+
+
+def get_message_store() -> MessageStore:
+    """Общий экземпляр хранилища сообщений"""
+    global _store
+    if _store is None:
+        _store = MessageStore()
+    return _store
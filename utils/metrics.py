@@ -0,0 +1,180 @@
+"""
+Встроенные метрики производительности конвейера без внешних сервисов трассировки.
+Узлы графа оборачиваются instrument_node: время, число элементов и ошибки узла пишутся в реестр.
+Вызовы LLM, токены, повторы, резервные варианты и попадания в кэш относятся к узлу,
+который сейчас выполняется (contextvar current_node). Реестр отдается в текстовом формате
+Prometheus и кратким отчетом для администраторов бота.
+"""
+import inspect
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Узел графа, к которому относятся метрики; вне графа - фоновые задачи
+current_node: ContextVar[str] = ContextVar("current_node", default="background")
+
+# Границы корзин гистограммы времени узла, в секундах
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Счетчики по узлам: имя метрики Prometheus и описание
+COUNTERS = {
+    "node_runs": ("newsbot_node_runs_total", "Запуски узла графа"),
+    "node_errors": ("newsbot_node_errors_total", "Запуски узла, завершившиеся ошибкой"),
+    "node_items": ("newsbot_node_items_total", "Элементы, которые выдал узел"),
+    "llm_calls": ("newsbot_llm_calls_total", "Вызовы GigaChat"),
+    "llm_errors": ("newsbot_llm_errors_total", "Вызовы GigaChat, завершившиеся ошибкой"),
+    "prompt_tokens": ("newsbot_llm_prompt_tokens_total", "Токены промптов GigaChat"),
+    "completion_tokens": ("newsbot_llm_completion_tokens_total", "Токены ответов GigaChat"),
+    "retries": ("newsbot_llm_retries_total", "Повторные запросы к GigaChat"),
+    "batch_fallbacks": ("newsbot_batch_fallbacks_total", "Новости, повторно отправленные поодиночке после ошибки пакетного вызова"),
+    "fallbacks": ("newsbot_fallbacks_total", "Резервные результаты вместо ответа модели"),
+    "cache_hits": ("newsbot_llm_cache_hits_total", "Результаты, взятые из кэша LLM"),
+    "cache_misses": ("newsbot_llm_cache_misses_total", "Промахи кэша LLM"),
+    "shadow_checks": ("newsbot_local_classifier_shadow_checks_total", "Уверенные ответы локального классификатора, проверенные через LLM"),
+    "shadow_agreements": ("newsbot_local_classifier_shadow_agreements_total", "Проверенные ответы локального классификатора, совпавшие с LLM"),
+    "fetch_errors": ("newsbot_fetch_errors_total", "Каналы, которые не удалось обновить из Telegram"),
+    "flood_waits": ("newsbot_telegram_flood_waits_total", "Ответы FloodWait от Telegram"),
+}
+
+
+class MetricsRegistry:
+    """Потокобезопасные счетчики и гистограммы времени по узлам графа"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._durations: Dict[str, List[int]] = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self._duration_sums: Dict[str, float] = defaultdict(float)
+
+    def inc(self, name: str, value: float = 1, node: Optional[str] = None) -> None:
+        with self._lock:
+            self._counters[(name, node or current_node.get())] += value
+
+    def observe_duration(self, node: str, seconds: float) -> None:
+        with self._lock:
+            buckets = self._durations[node]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            self._duration_sums[node] += seconds
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Значения счетчиков по узлам: {узел: {метрика: значение}}"""
+        with self._lock:
+            nodes: Dict[str, Dict[str, float]] = defaultdict(dict)
+            for (name, node), value in self._counters.items():
+                nodes[node][name] = value
+            for node, total in self._duration_sums.items():
+                nodes[node]["seconds"] = total
+            return dict(nodes)
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            counters = dict(self._counters)
+            durations = {node: list(buckets) for node, buckets in self._durations.items()}
+            sums = dict(self._duration_sums)
+
+        lines = []
+        for name, (metric, description) in COUNTERS.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, node), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{metric}{{node="{node}"}} {value:g}')
+
+        lines.append("# HELP newsbot_node_duration_seconds Время выполнения узла графа")
+        lines.append("# TYPE newsbot_node_duration_seconds histogram")
+        for node, buckets in sorted(durations.items()):
+            runs = counters.get(("node_runs", node), 0)
+            for bound, count in zip(DURATION_BUCKETS, buckets):
+                lines.append(f'newsbot_node_duration_seconds_bucket{{node="{node}",le="{bound}"}} {count}')
+            lines.append(f'newsbot_node_duration_seconds_bucket{{node="{node}",le="+Inf"}} {runs:g}')
+            lines.append(f'newsbot_node_duration_seconds_sum{{node="{node}"}} {sums[node]:.6f}')
+            lines.append(f'newsbot_node_duration_seconds_count{{node="{node}"}} {runs:g}')
+
+        lines.append("# HELP newsbot_uptime_seconds Время работы процесса")
+        lines.append("# TYPE newsbot_uptime_seconds gauge")
+        lines.append(f"newsbot_uptime_seconds {time.time() - self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def render_summary(self) -> str:
+        """Краткий отчет по узлам для команды администратора"""
+        nodes = self.snapshot()
+        if not nodes:
+            return "Метрик пока нет: дайджесты еще не запускались."
+
+        lines = [f"Метрики за {(time.time() - self.started_at) / 3600:.1f} ч"]
+        for node, values in sorted(nodes.items()):
+            runs = values.get("node_runs", 0)
+            line = f"{node}:"
+            if runs:
+                line += f" {runs:g} запусков, {values.get('seconds', 0) / runs:.2f} с в среднем"
+                line += f", элементов {values.get('node_items', 0):g}, ошибок {values.get('node_errors', 0):g}"
+            if values.get("llm_calls"):
+                line += (f"; LLM {values['llm_calls']:g} вызовов, ошибок {values.get('llm_errors', 0):g}"
+                         f", токены {values.get('prompt_tokens', 0):g}+{values.get('completion_tokens', 0):g}"
+                         f", повторов {values.get('retries', 0):g}")
+            if values.get("batch_fallbacks"):
+                line += f"; поодиночке после пакета {values['batch_fallbacks']:g}"
+            if values.get("fallbacks"):
+                line += f"; резервных ответов {values['fallbacks']:g}"
+            lookups = values.get("cache_hits", 0) + values.get("cache_misses", 0)
+            if lookups:
+                line += f"; кэш {values.get('cache_hits', 0) / lookups:.0%}"
+            if values.get("shadow_checks"):
+                line += (f"; согласие локального классификатора с LLM "
+                         f"{values.get('shadow_agreements', 0) / values['shadow_checks']:.0%} из {values['shadow_checks']:g}")
+            lines.append(line)
+        return "\n".join(lines)
+
+
+metrics = MetricsRegistry()
+
+
+def instrument_node(node: str, func: Callable, count_items: Callable[[str, Dict[str, Any]], Optional[int]]) -> Callable:
+    """Обертка узла графа: время, число выданных элементов и ошибки узла.
+    Ошибкой считается появление новых записей в state["errors"]."""
+
+    def record(state: Dict[str, Any], result: Dict[str, Any], started: float) -> None:
+        metrics.observe_duration(node, time.perf_counter() - started)
+        metrics.inc("node_runs", node=node)
+        if len(result.get("errors", [])) > len(state.get("errors", [])):
+            metrics.inc("node_errors", node=node)
+        metrics.inc("node_items", count_items(node, result) or 0, node=node)
+
+    # Имя и описание узла копируются без __wrapped__: LangGraph смотрит на сигнатуру обертки
+    # и не должен передавать ей config, который ожидает декоратор traceable
+    def named(wrapper: Callable) -> Callable:
+        wrapper.__name__ = func.__name__
+        wrapper.__qualname__ = func.__qualname__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    if inspect.iscoroutinefunction(func):
+        async def async_wrapper(state):
+            token = current_node.set(node)
+            started = time.perf_counter()
+            try:
+                result = await func(state)
+            finally:
+                current_node.reset(token)
+            record(state, result, started)
+            return result
+
+        return named(async_wrapper)
+
+    def wrapper(state):
+        token = current_node.set(node)
+        started = time.perf_counter()
+        try:
+            result = func(state)
+        finally:
+            current_node.reset(token)
+        record(state, result, started)
+        return result
+
+    return named(wrapper)
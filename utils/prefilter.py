@@ -0,0 +1,146 @@
+"""
+Локальная предварительная фильтрация новостей до вызовов LLM.
+Отсекает рекламу, розыгрыши, заглушки из пары слов, сообщения из одних ссылок или эмодзи,
+а также убирает повторяющиеся в канале подписи. Правила настраиваются для каждого канала.
+"""
+import json
+import logging
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.schemas import News
+from config.settings import PREFILTER
+
+logger = logging.getLogger(__name__)
+
+_LINK_RE = re.compile(r"https?://\S+|t\.me/\S+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def load_channel_rules(path: str = PREFILTER["CHANNEL_RULES_PATH"]) -> Dict[str, Dict[str, Any]]:
+    """Переопределения правил по каналам из JSON-файла вида {"@channel": {"MIN_WORDS": 5}}"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке правил фильтрации: {e}")
+        return {}
+
+
+CHANNEL_RULES = load_channel_rules()
+
+
+def rules_for(channel: str) -> Dict[str, Any]:
+    """Правила фильтрации канала: общие настройки с переопределениями канала"""
+    return {**PREFILTER, **CHANNEL_RULES.get(channel, {})}
+
+
+def strip_boilerplate(news_list: List[News], min_share: float) -> List[News]:
+    """Удаление строк, повторяющихся в большой доле сообщений канала (подписи, призывы подписаться)"""
+    if len(news_list) < 3:
+        return news_list
+
+    line_counts = Counter()
+    for news in news_list:
+        line_counts.update({line.strip() for line in news.text.splitlines() if line.strip()})
+
+    threshold = max(2, min_share * len(news_list))
+    boilerplate = {line for line, count in line_counts.items() if count >= threshold}
+    if not boilerplate:
+        return news_list
+
+    stripped = []
+    for news in news_list:
+        text = "\n".join(line for line in news.text.splitlines() if line.strip() not in boilerplate).strip()
+        stripped.append(news.model_copy(update={"text": text}) if text != news.text else news)
+    return stripped
+
+
+@lru_cache(maxsize=None)
+def marker_pattern(markers: Tuple[str, ...], whole_word: bool) -> Optional[re.Pattern]:
+    """Регулярное выражение для маркеров: с начала слова и, если whole_word, до конца слова"""
+    if not markers:
+        return None
+    ending = r"(?!\w)" if whole_word else ""
+    return re.compile(
+        "|".join(rf"(?<!\w){re.escape(marker.lower())}{ending}" for marker in markers)
+    )
+
+
+def weak_ad_markers(text: str, rules: Dict[str, Any]) -> int:
+    """Число разных слабых признаков рекламы в тексте"""
+    pattern = marker_pattern(tuple(rules["WEAK_AD_MARKERS"]), whole_word=False)
+    if pattern is None:
+        return 0
+    return len({match.lower() for match in pattern.findall(text.lower())})
+
+
+def rejection_reason(news: News, rules: Dict[str, Any]) -> Optional[str]:
+    """Причина отсева новости или None, если новость стоит отправить в LLM"""
+    text = news.text
+    lowered = text.lower()
+
+    if rules["DROP_PINNED"] and news.pinned:
+        return "pinned"
+    if rules["DROP_FORWARDS"] and news.forwarded:
+        return "forward"
+    ad_pattern = marker_pattern(tuple(rules["AD_MARKERS"]), whole_word=True)
+    if ad_pattern is not None and ad_pattern.search(lowered):
+        return "ad"
+    if weak_ad_markers(text, rules) >= 2:
+        return "ad"
+
+    # Доля текста, занятая ссылками
+    links_length = sum(len(match) for match in _LINK_RE.findall(text))
+    if text and links_length / len(text) > rules["MAX_LINK_DENSITY"]:
+        return "links"
+
+    # Число слов без ссылок (заглушки вроде "Подробнее 👇") и доля букв (сообщения из одних эмодзи и символов).
+    # Короткий заголовок - полноценная новость, поэтому порог рассчитан только на заглушки
+    plain = _LINK_RE.sub("", text).strip()
+    if len(_WORD_RE.findall(plain)) < rules["MIN_WORDS"]:
+        return "short"
+    visible = [char for char in plain if not char.isspace()]
+    letters = sum(char.isalpha() for char in visible)
+    if visible and letters / len(visible) < rules["MIN_LETTER_RATIO"]:
+        return "no_text"
+
+    return None
+
+
+def prefilter_news(news_list: List[News]) -> Tuple[List[News], Counter]:
+    """Фильтрация новостей по правилам их каналов.
+    Возвращает оставшиеся новости в исходном порядке и число отсеянных по каждой причине."""
+    by_channel: Dict[str, List[int]] = {}
+    for index, news in enumerate(news_list):
+        by_channel.setdefault(news.channel, []).append(index)
+
+    kept: Dict[int, News] = {}
+    dropped = Counter()
+    downranked = 0
+    for channel, indices in by_channel.items():
+        rules = rules_for(channel)
+        if not rules["ENABLED"]:
+            kept.update((index, news_list[index]) for index in indices)
+            continue
+
+        channel_news = strip_boilerplate([news_list[index] for index in indices], rules["BOILERPLATE_MIN_SHARE"])
+        for index, news in zip(indices, channel_news):
+            reason = rejection_reason(news, rules)
+            if reason is not None:
+                dropped[reason] += 1
+                continue
+            # Один слабый признак рекламы встречается и в обычных новостях: не отсеиваем, а понижаем важность
+            if weak_ad_markers(news.text, rules):
+                news = news.model_copy(update={"downranked": True})
+                downranked += 1
+            kept[index] = news
+
+    if downranked:
+        logger.info(f"Pre-filter down-ranked {downranked} news items with a single weak ad marker")
+    return [kept[index] for index in sorted(kept)], dropped
@@ -0,0 +1,148 @@
+"""
+Отображение хода формирования дайджеста в Telegram.
+Сообщение о прогрессе редактируется не чаще заданного интервала, чтобы не упираться в лимиты Telegram.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Collection, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from utils.helpers import (
+    format_report_for_telegram,
+    format_overall_summary_for_telegram,
+    format_category_summary_for_telegram,
+)
+
+logger = logging.getLogger(__name__)
+
+# Названия узлов графа и поэлементных стадий для пользователя
+STAGE_TITLES = {
+    "collector": "Сбор новостей",
+    "prefilter": "Отсев рекламы и заглушек",
+    "deduplicator": "Удаление дубликатов",
+    "stream_processor": "Сбор и анализ новостей",
+    "analyzer": "Анализ",
+    "classifier": "Классификация",
+    "analyzer_classifier": "Анализ и классификация",
+    "clusterer": "Группировка по сюжетам",
+    "summarizer": "Сводки по категориям",
+    "reporter": "Общая сводка",
+    "error_handler": "Обработка ошибок",
+}
+
+
+class ProgressMessage:
+    """Сообщение с живым прогрессом обработки, обновляемое с ограничением частоты"""
+
+    def __init__(self, message: Message, min_interval: float):
+        self.message = message
+        self.min_interval = min_interval
+        self.finished: List[str] = []
+        self.items: Dict[str, Dict[str, int]] = {}
+        self.failed_channels: List[str] = []
+        self._last_text = message.text
+        self._last_edit = 0.0
+
+    def render(self) -> str:
+        lines = ["⏳ Обработка каналов, пожалуйста, подождите...", ""]
+        lines.extend(f"✅ {line}" for line in self.finished)
+        for stage, counts in self.items.items():
+            lines.append(f"🔄 {STAGE_TITLES.get(stage, stage)}: {counts['done']}/{counts['total']}")
+        if self.failed_channels:
+            lines.append(f"⚠️ Не удалось обновить: {', '.join(self.failed_channels)}, используются сохраненные сообщения")
+        return "\n".join(lines)
+
+    async def handle(self, event: Dict[str, Any]) -> None:
+        """Учет события графа и, если прошло достаточно времени, обновление сообщения"""
+        if event["type"] == "stage":
+            title = STAGE_TITLES.get(event["node"], event["node"])
+            self.finished.append(title if event["count"] is None else f"{title}: {event['count']}")
+            # Поэлементный прогресс завершенных стадий больше не нужен
+            if event["node"] == "stream_processor":
+                self.items.clear()
+            else:
+                self.items.pop(event["node"], None)
+        elif event["type"] == "channel_error":
+            if event["channel"] in self.failed_channels:
+                return
+            self.failed_channels.append(event["channel"])
+        elif event["type"] == "items":
+            counts = self.items.setdefault(event["stage"], {"total": 0, "done": 0})
+            counts["total"] += event["total"]
+            counts["done"] += event["done"]
+        else:
+            return
+
+        await self.refresh()
+
+    async def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_edit < self.min_interval:
+            return
+
+        text = self.render()
+        if text == self._last_text:
+            return
+
+        try:
+            await self.message.edit_text(text)
+            self._last_text = text
+            self._last_edit = now
+        except Exception as e:
+            # Прогресс не критичен: ошибки редактирования (в т.ч. лимиты) только логируем
+            logger.warning(f"Не удалось обновить сообщение о прогрессе: {e}")
+            self._last_edit = now
+
+
+async def send_digest_events(
+        bot: Bot,
+        chat_id: int,
+        events: AsyncIterator[Dict[str, Any]],
+        progress: ProgressMessage,
+        message_interval: float,
+        delivered_categories: Collection[str] = (),
+        on_category_sent: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> None:
+    """Отправка дайджеста по событиям конвейера: сводки категорий сразу по готовности,
+    общая сводка последней. Остальные события обновляют сообщение о прогрессе.
+    Сводки категорий из delivered_categories уже отправлены прошлой попыткой и пропускаются;
+    on_category_sent вызывается после отправки каждой сводки категории."""
+    report = None
+    report_text = None
+    categories_sent = len(delivered_categories)
+    last_sent = 0.0
+    async for event in events:
+        if event["type"] == "category_summary":
+            if event["summary"].category in delivered_categories:
+                continue
+            # Сводку категории отправляем сразу, соблюдая паузу между сообщениями
+            delay = message_interval - (asyncio.get_running_loop().time() - last_sent)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await bot.send_message(
+                chat_id,
+                format_category_summary_for_telegram(event["summary"]),
+                parse_mode="Markdown"
+            )
+            last_sent = asyncio.get_running_loop().time()
+            categories_sent += 1
+            if on_category_sent is not None:
+                await on_category_sent(event["summary"].category)
+        elif event["type"] == "report":
+            report = event["report"]
+            report_text = event.get("text")
+        else:
+            await progress.handle(event)
+
+    # Общая сводка идет последней; если сводки категорий не отправлялись, отправляем отчет целиком
+    if report is None:
+        formatted = report_text or "Не удалось сформировать общую сводку."
+    elif categories_sent:
+        formatted = format_overall_summary_for_telegram(report)
+    else:
+        # Дайджест из кэша приходит уже отформатированным
+        formatted = report_text or format_report_for_telegram(report)
+    await bot.send_message(chat_id, formatted, parse_mode="Markdown")
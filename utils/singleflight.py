@@ -0,0 +1,72 @@
+"""
+Объединение одновременных одинаковых запросов (single-flight).
+Пока задача с данным ключом выполняется, остальные запросы с тем же ключом
+не запускают ее повторно, а ждут общий результат.
+Если выполнявший задачу запрос отменен, ожидающие не отменяются, а повторяют задачу сами.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class FlightCancelled(Exception):
+    """Запрос, выполнявший задачу, отменен: ожидающим нужно повторить ее самим"""
+
+
+class SingleFlight:
+    """Реестр выполняющихся задач по ключам"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Optional[asyncio.Future]:
+        """Future уже выполняющейся задачи с этим ключом, если она есть"""
+        return self._inflight.get(key)
+
+    def claim(self, key: Hashable) -> asyncio.Future:
+        """Регистрирует задачу с ключом; владелец обязан завершить ее через resolve или reject"""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    def resolve(self, key: Hashable, result: Any) -> None:
+        """Передает результат всем ожидающим и снимает задачу с учета"""
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def reject(self, key: Hashable, error: BaseException) -> None:
+        """Передает ошибку всем ожидающим и снимает задачу с учета"""
+        future = self._inflight.pop(key, None)
+        if future is None or future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            # Отмена касается только владельца, ожидающие получают ошибку, по которой повторят задачу
+            error = FlightCancelled()
+        future.set_exception(error)
+        # Помечаем ошибку как полученной, если ожидающих не было
+        future.exception()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполняет func или присоединяется к уже выполняющемуся вызову с тем же ключом"""
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                # Отмена одного ожидающего не должна отменять общую задачу
+                return await asyncio.shield(future)
+            except FlightCancelled:
+                # Владелец отменен: выполняем задачу сами или присоединяемся к новому владельцу
+                continue
+
+        self.claim(key)
+        try:
+            result = await func()
+        except BaseException as error:
+            self.reject(key, error)
+            raise
+        self.resolve(key, result)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,67 @@
+"""
+Группировка новостей категории по сюжетам перед суммаризацией.
+Тексты переводятся в хэшированные TF-IDF векторы по основам слов (NumPy-матрица), сюжеты
+собираются по косинусному сходству жадно: самая связанная из оставшихся новостей становится
+представителем сюжета и забирает все похожие на нее. Суммаризатор получает по одному
+представителю на сюжет с числом упоминаний вместо всех сообщений.
+"""
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+from config.settings import STORY_CLUSTERING
+
+_URL_RE = re.compile(r"https?://\S+|t\.me/\S+")
+_WORD_RE = re.compile(r"\w{2,}")
+
+
+def embed_texts(texts: List[str], dims: int = STORY_CLUSTERING["DIMS"]) -> np.ndarray:
+    """Хэшированные TF-IDF векторы текстов по основам слов (первые 5 букв), нормированные по L2"""
+    rows = []
+    columns = []
+    for row, text in enumerate(texts):
+        stems = {word[:5] for word in _WORD_RE.findall(_URL_RE.sub(" ", text.lower()))}
+        columns.extend(zlib.crc32(stem.encode("utf-8")) % dims for stem in stems)
+        rows.extend([row] * len(stems))
+
+    cells = np.asarray(rows, dtype=np.int64) * dims + np.asarray(columns, dtype=np.int64)
+    counts = np.bincount(cells, minlength=len(texts) * dims).reshape(len(texts), dims).astype(np.float32)
+
+    # Слова, которые есть почти во всех новостях категории, почти не влияют на сходство
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+    vectors = np.log1p(counts) * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def cluster_stories(
+        texts: List[str],
+        importance: Optional[List[float]] = None,
+        threshold: float = STORY_CLUSTERING["THRESHOLD"],
+) -> List[List[int]]:
+    """Сюжеты как списки номеров текстов; первый номер - представитель сюжета.
+    Представителем становится новость с наибольшим числом похожих, при равенстве - более важная.
+    Сюжеты идут по убыванию числа упоминаний."""
+    if not texts:
+        return []
+
+    vectors = embed_texts(texts)
+    adjacent = vectors @ vectors.T >= threshold
+    degree = adjacent.sum(axis=1)
+    scores = np.asarray(importance if importance is not None else [0.0] * len(texts), dtype=np.float32)
+    order = np.lexsort((-scores, -degree))
+
+    assigned = np.zeros(len(texts), dtype=bool)
+    stories = []
+    for leader in order:
+        if assigned[leader]:
+            continue
+        members = np.flatnonzero(adjacent[leader] & ~assigned)
+        assigned[members] = True
+        stories.append([int(leader)] + [int(member) for member in members if member != leader])
+
+    stories.sort(key=len, reverse=True)
+    return stories
@@ -0,0 +1,57 @@
+"""
+Модуль с общим долгоживущим клиентом Telethon.
+Клиент подключается один раз на процесс и переиспользуется всеми каналами и запросами.
+"""
+import asyncio
+import logging
+from typing import Optional, TYPE_CHECKING
+
+from config.settings import TELEGRAM
+
+if TYPE_CHECKING:
+    from telethon import TelegramClient
+
+logger = logging.getLogger(__name__)
+
+SESSION_NAME = TELEGRAM["SESSION_NAME"]
+
+_client: Optional["TelegramClient"] = None
+_client_lock: Optional[asyncio.Lock] = None
+
+
+async def get_client() -> "TelegramClient":
+    """Возвращает подключенный клиент Telethon, создавая его при первом обращении"""
+    global _client, _client_lock
+
+    # Telethon импортируется лениво, чтобы не замедлять запуск бота
+    from telethon import TelegramClient
+
+    if _client_lock is None:
+        _client_lock = asyncio.Lock()
+
+    async with _client_lock:
+        if _client is None:
+            # FloodWait не пережидается внутри Telethon: им управляет общий FetchScheduler
+            _client = TelegramClient(
+                SESSION_NAME,
+                int(TELEGRAM["API_ID"]),
+                TELEGRAM["API_HASH"],
+                flood_sleep_threshold=0,
+            )
+
+        # Переподключаемся, если соединение было потеряно
+        if not _client.is_connected():
+            logger.info("Connecting shared Telethon client")
+            await _client.start()
+
+        return _client
+
+
+async def close_client() -> None:
+    """Отключение общего клиента при остановке бота"""
+    global _client
+
+    if _client is not None:
+        logger.info("Disconnecting shared Telethon client")
+        await _client.disconnect()
+        _client = None
@@ -0,0 +1,147 @@
+"""
+Хранилище подписок пользователей на каналы (SQLite в режиме WAL).
+Чтение и запись идут по одному пользователю, для фоновых задач есть обратный индекс канал -> подписчики.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from config.settings import USER_STORE_PATH, MAX_CHANNELS_PER_USER
+
+logger = logging.getLogger(__name__)
+
+# Старый формат хранения: весь словарь user_id -> каналы в одном JSON-файле
+LEGACY_USER_CHANNELS_PATH = "data/user_channels.json"
+
+
+class ChannelAlreadyAdded(Exception):
+    """Канал уже есть в списке пользователя"""
+
+
+class ChannelLimitReached(Exception):
+    """У пользователя уже максимальное число каналов"""
+
+
+class UserStore:
+    """Подписки пользователей с обратным индексом по каналам"""
+
+    def __init__(self, path: str = USER_STORE_PATH, max_channels: int = MAX_CHANNELS_PER_USER):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                user_id TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (user_id, channel)
+            );
+            CREATE INDEX IF NOT EXISTS subscriptions_by_channel ON subscriptions (channel);
+            """
+        )
+        self._conn.commit()
+        self._migrate_legacy_json()
+
+    def _migrate_legacy_json(self) -> None:
+        """Однократный перенос подписок из data/user_channels.json"""
+        if not os.path.exists(LEGACY_USER_CHANNELS_PATH):
+            return
+        if self._conn.execute("SELECT 1 FROM subscriptions LIMIT 1").fetchone():
+            return
+
+        try:
+            with open(LEGACY_USER_CHANNELS_PATH, "r", encoding="utf-8") as f:
+                user_channels = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке списка каналов: {e}")
+            return
+
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO subscriptions (user_id, channel, position) VALUES (?, ?, ?)",
+            [
+                (user_id, channel, position)
+                for user_id, channels in user_channels.items()
+                for position, channel in enumerate(channels)
+            ]
+        )
+        self._conn.commit()
+        logger.info(f"Migrated channels of {len(user_channels)} users from {LEGACY_USER_CHANNELS_PATH}")
+
+    def get_channels(self, user_id: str) -> List[str]:
+        """Каналы пользователя в порядке добавления"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel FROM subscriptions WHERE user_id = ? ORDER BY position", (user_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def add_channel(self, user_id: str, channel: str) -> None:
+        """Добавление канала пользователю с проверкой дубликата и лимита MAX_CHANNELS_PER_USER"""
+        with self._lock, self._conn:
+            exists = self._conn.execute(
+                "SELECT 1 FROM subscriptions WHERE user_id = ? AND channel = ?", (user_id, channel)
+            ).fetchone()
+            if exists:
+                raise ChannelAlreadyAdded(channel)
+
+            count, last_position = self._conn.execute(
+                "SELECT COUNT(*), MAX(position) FROM subscriptions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if count >= self.max_channels:
+                raise ChannelLimitReached(channel)
+
+            self._conn.execute(
+                "INSERT INTO subscriptions (user_id, channel, position) VALUES (?, ?, ?)",
+                (user_id, channel, (last_position or 0) + 1)
+            )
+
+    def remove_channel(self, user_id: str, index: int) -> Optional[str]:
+        """Удаление канала по его номеру в списке пользователя; возвращает удаленный канал"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT channel FROM subscriptions WHERE user_id = ? ORDER BY position LIMIT 1 OFFSET ?",
+                (user_id, index)
+            ).fetchone() if index >= 0 else None
+            if row is None:
+                return None
+
+            self._conn.execute(
+                "DELETE FROM subscriptions WHERE user_id = ? AND channel = ?", (user_id, row[0])
+            )
+            return row[0]
+
+    def get_subscribers(self, channel: str) -> List[str]:
+        """Пользователи, подписанные на канал"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id FROM subscriptions WHERE channel = ?", (channel,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def subscriber_counts(self) -> Dict[str, int]:
+        """Число подписчиков каждого канала"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT channel, COUNT(*) FROM subscriptions GROUP BY channel"
+            ).fetchall()
+        return dict(rows)
+
+
+_store: Optional[UserStore] = None
+
+
+def get_user_store() -> UserStore:
+    """Общий экземпляр хранилища подписок"""
+    global _store
+    if _store is None:
+        _store = UserStore()
+    return _store
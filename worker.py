@@ -0,0 +1,140 @@
+"""
+Процесс-обработчик очереди дайджестов: забирает задания, поставленные ботом (JOB_QUEUE_ENABLED=true),
+собирает дайджест конвейером и сам отправляет его пользователю через Bot API.
+
+Запуск (несколько процессов для нескольких ядер):
+    TELEGRAM_SESSION_NAME=newsbot_worker1 python worker.py
+    TELEGRAM_SESSION_NAME=newsbot_worker2 python worker.py
+
+Сессия Telethon - файл SQLite, поэтому каждому процессу нужна своя копия файла сессии.
+Фоновое обновление каналов (REFRESHER_ENABLED=true) в режиме очереди работает в обработчике,
+достаточно включить его в одном из процессов.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.types import Chat, Message
+from dotenv import load_dotenv
+
+from agents.agent_graph import stream_news_channels, warm_up
+from agents.refresher import ChannelRefresher
+from utils.job_queue import Job, get_job_queue
+from utils.user_store import get_user_store
+from utils.progress import ProgressMessage, send_digest_events
+from utils.telegram_client import close_client
+from utils.checkpoints import close_checkpoints
+from config.settings import TELEGRAM, PROGRESS, JOB_QUEUE, REFRESHER
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def keep_lease(job: Job) -> None:
+    """Продление аренды задания, пока дайджест собирается"""
+    queue = get_job_queue()
+    while True:
+        await asyncio.sleep(JOB_QUEUE["HEARTBEAT_SECONDS"])
+        if not await asyncio.to_thread(queue.extend, job.id, WORKER_ID):
+            logger.warning(f"Lost lease on job {job.id}")
+            return
+
+
+async def process_job(bot: Bot, job: Job) -> None:
+    """Сборка и отправка одного дайджеста"""
+    queue = get_job_queue()
+    logger.info(f"Processing job {job.id} of user {job.user_id} (attempt {job.attempts})")
+
+    if job.progress_message_id is None:
+        progress_msg = await bot.send_message(job.chat_id, "⏳ Обработка каналов, пожалуйста, подождите...")
+    else:
+        # Сообщение о прогрессе отправил бот: обработчик только редактирует и удаляет его
+        progress_msg = Message(
+            message_id=job.progress_message_id,
+            date=datetime.now(),
+            chat=Chat(id=job.chat_id, type="private"),
+            text="⏳ Сводка поставлена в очередь, пожалуйста, подождите...",
+        ).as_(bot)
+
+    async def record_delivered(category: str) -> None:
+        await asyncio.to_thread(queue.record_delivered, job.id, WORKER_ID, category)
+
+    if job.expired:
+        # Прошлые обработчики падали на этом задании, не успев сообщить об ошибке
+        await bot.send_message(job.chat_id, "Произошла ошибка при получении новостей.")
+    else:
+        heartbeat = asyncio.create_task(keep_lease(job))
+        try:
+            events = stream_news_channels(job.channels, user_id=job.user_id, since_last_digest=job.since_last_digest)
+            progress = ProgressMessage(progress_msg, PROGRESS["EDIT_INTERVAL_SECONDS"])
+            # Сводки категорий, отправленные прошлой попыткой, не дублируются
+            await send_digest_events(
+                bot,
+                job.chat_id,
+                events,
+                progress,
+                PROGRESS["MESSAGE_INTERVAL_SECONDS"],
+                delivered_categories=job.delivered_categories,
+                on_category_sent=record_delivered,
+            )
+            await asyncio.to_thread(queue.complete, job.id, WORKER_ID)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке задания {job.id}: {e}")
+            if not await asyncio.to_thread(queue.fail, job.id, WORKER_ID, str(e)):
+                # Задание вернулось в очередь: сообщение о прогрессе пригодится следующей попытке
+                return
+            await bot.send_message(job.chat_id, "Произошла ошибка при получении новостей.")
+        finally:
+            heartbeat.cancel()
+
+    try:
+        await progress_msg.delete()
+    except Exception as e:
+        logger.warning(f"Не удалось удалить сообщение о прогрессе: {e}")
+
+
+async def main():
+    bot = Bot(token=TELEGRAM["BOT_TOKEN"])
+    queue = get_job_queue()
+    await warm_up()
+    logger.info(f"Worker {WORKER_ID} started")
+
+    # Не больше WORKER_CONCURRENCY дайджестов одновременно; ссылки на задачи храним до их завершения
+    slots = asyncio.Semaphore(JOB_QUEUE["WORKER_CONCURRENCY"])
+    tasks = set()
+    if REFRESHER["ENABLED"]:
+        tasks.add(asyncio.create_task(ChannelRefresher(get_user_store().subscriber_counts).run()))
+
+    def finished(task: asyncio.Task) -> None:
+        tasks.discard(task)
+        slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            job = await asyncio.to_thread(queue.claim, WORKER_ID)
+            if job is None:
+                slots.release()
+                await asyncio.sleep(JOB_QUEUE["POLL_SECONDS"])
+                continue
+
+            task = asyncio.create_task(process_job(bot, job))
+            tasks.add(task)
+            task.add_done_callback(finished)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await close_client()
+        await close_checkpoints()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())